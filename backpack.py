@@ -6,38 +6,126 @@ Backpack module for carrying items.
 class Backpack:
     """
     A class to allow us to pickup and put down items...
-    Backpack is limited to number of items set by capacity.
+    Items are kept in a dict keyed by their lower case name, so finding,
+    checking and removing one never has to look through the whole backpack
+    (and the dict remembers the order they were added in).
+    Backpack is limited to number of item slots set by capacity - a stack
+    of a stackable item only takes one slot - and optionally to a total
+    weight set by max_weight.
     This example incorporates a user defined exception.
     """
 
-    def __init__(self, capacity):
-        self.contents = []
+    __slots__ = ("_slots", "capacity", "max_weight", "weight")
+
+    def __init__(self, capacity, max_weight=None):
+        self._slots = {}  # lower case name -> [item, quantity]
         self.capacity = capacity
+        self.max_weight = max_weight
+        self.weight = 0
 
-    def add_item(self, item):
-        """Adds an item to the backpack."""
-        if len(self.contents) < self.capacity:
-            self.contents.append(item)
-            return True
-        return False
+    @property
+    def contents(self):
+        """The items in the backpack (one per slot), in the order they were added."""
+        return [slot[0] for slot in self._slots.values()]
 
-    def remove_item(self, item):
-        """Removes an item from the backpack."""
+    def add_item(self, item, quantity=1):
+        """
+        Adds an item to the backpack.
+        Returns False if there is no free slot, it would be too heavy, or
+        it is already in there and doesnt stack.
+        Raises ValueError if quantity is less than one, or more than one of
+        an item that doesnt stack.
+        """
+        if quantity < 1:
+            raise ValueError(f"Can't add {quantity} of {item.name}")
+        if quantity > 1 and not item.stackable:
+            raise ValueError(f"{item.name} doesn't stack, can't add {quantity}")
+        weight = item.weight * quantity
+        if self.max_weight is not None and self.weight + weight > self.max_weight:
+            return False
+        key = item.name.lower()
+        slot = self._slots.get(key)
+        if slot is None:
+            if len(self._slots) >= self.capacity:
+                return False
+            self._slots[key] = [item, quantity]
+        elif item.stackable:
+            slot[1] += quantity
+        else:
+            return False
+        self.weight += weight
+        return True
+
+    def remove_item(self, item, quantity=1):
+        """
+        Removes an item (or some of a stack) from the backpack.
+        Returns True if it was there.
+        """
         try:
-            if item not in self.contents:
-                raise NotInBackpackError(item, 'is not in the backpack.')
-            self.contents.remove(item)
+            self.take_out(item, quantity)
+            return True
         except NotInBackpackError:
-            print('Exception handled here...')
-        finally:
-            print('Carrying on...')
+            return False
+
+    def take_out(self, item, quantity=1):
+        """
+        Removes an item (or some of a stack) from the backpack.
+        Raises NotInBackpackError if there arent that many of it in there.
+        """
+        key = item.name.lower()
+        slot = self._slots.get(key)
+        if slot is None or slot[1] < quantity:
+            raise NotInBackpackError(item, 'is not in the backpack.')
+        slot[1] -= quantity
+        if slot[1] == 0:
+            del self._slots[key]
+        self.weight -= item.weight * quantity
 
     def check_item(self, item):
         """Returns True if item is in backpack, False otherwise."""
-        return item in self.contents
+        return item.name.lower() in self._slots
+
+    def get_item(self, name):
+        """Returns the item with this name (any case), or None."""
+        slot = self._slots.get(name.lower())
+        return slot[0] if slot is not None else None
+
+    def has_item(self, name):
+        """Returns True if an item with this name (any case) is in the backpack."""
+        return name.lower() in self._slots
+
+    def quantity(self, name):
+        """How many of the named item are in the backpack."""
+        slot = self._slots.get(name.lower())
+        return slot[1] if slot is not None else 0
+
+    def names(self):
+        """Lower case names of everything in the backpack, as a set-like view."""
+        return self._slots.keys()
+
+    def stacks(self):
+        """(item, quantity) for each slot, in the order they were added."""
+        return [tuple(slot) for slot in self._slots.values()]
+
+    def get_inventory(self):
+        """Item names in the order they were added, with a count for stacks."""
+        return [item.name if quantity == 1 else f"{item.name} x{quantity}"
+                for item, quantity in self._slots.values()]
+
+    def clear(self):
+        """Empties the backpack."""
+        self._slots.clear()
+        self.weight = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __iter__(self):
+        return (slot[0] for slot in self._slots.values())
 
 
 class NotInBackpackError(Exception):
     """A custom exception to handle items not in backpack."""
     def __init__(self, item, message):
-        print(f'{item} {message}')
+        super().__init__(f'{item} {message}')
+        self.item = item
@@ -0,0 +1,460 @@
+"""
+Benchmarks for the game engine, with a baseline to catch regressions.
+
+Measures:
+    construction.*   building a session with Game() and from a template (us)
+    command.<verb>   one process_command per verb, from a game part way
+                     through the winning transcript (us)
+    save_load        a save command then a load command, through a slot
+                     file in a temporary folder (us)
+    playthrough      playing the whole winning transcript in a new session (us)
+    memory.*         memory each session keeps alive (bytes)
+    ratio.*          a template clone's time as a fraction of Game()'s (x)
+
+Lower is better for every one of them. Every timing is the best of
+several tries, since noise only ever makes things slower, and the whole
+suite is run a few times (--runs) with each result the median of the
+runs, so one slow run on a busy machine doesnt move it. Results can be
+saved as a baseline (JSON, see benchmark_baseline.json) and later runs
+compared against it: any result more than threshold (a fraction, 0.5 =
+50%) worse than the baseline is a regression and makes the run exit with
+status 1. Timings depend on the machine, so save a baseline on the
+machine you compare on; where that cant be done (eg shared CI machines),
+--advisory-timings only reports slower timings and fails on memory and
+ratios alone.
+
+--scaling runs something else: generated worlds of the given sizes (see
+worldgen.py), reporting for each how long loading and building a Game
+takes, the memory a Game uses and how long commands take on average while
+playing the world's winning transcript, then the same for a StoreGame
+(see world_store.py), which should start in the same time whatever the
+size.
+
+Usage:
+    python benchmark.py                     run, compare with the baseline if there is one
+    python benchmark.py --save-baseline     run and save the results as the baseline
+    python benchmark.py --threshold 0.5 --quick --runs 5
+    python benchmark.py --advisory-timings  only fail on memory and ratios
+    python benchmark.py --scaling 1000,10000,100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import worldgen
+from world_store import StoreGame, open_store
+
+from game import Game
+from headless import WINNING_SCRIPT, run_session
+from savegame import SaveStore
+from state import StateCodec
+from template import WorldTemplate
+from text_ui import CaptureUI, parse_command
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.5
+
+# Units of the results that still fail a run with --advisory-timings.
+STEADY_UNITS = ("bytes", "x")
+
+# Tries each timing is the best of.
+REPEAT = 5
+
+# Runs of the whole suite each result is the median of.
+RUNS = 3
+
+# verb -> (how many winning transcript commands to play first, command to time)
+COMMAND_CASES = {
+    "go": (0, "go south"),
+    "goto": (22, "goto lab"),
+    "take": (1, "take basic-keycard"),
+    "use": (2, "use basic-keycard"),
+    "solve": (6, "solve xitter"),
+    "speak": (27, "speak"),
+    "search": (1, "search"),
+    "inventory": (11, "inventory"),
+    "help": (0, "help"),
+}
+
+
+def time_per_call(func, number, repeat=REPEAT):
+    """
+    Times func over a number of calls, keeping what it returns alive
+    (like a server holding sessions) so freeing them isnt counted.
+    The garbage collector is off while timing, same as timeit.
+
+    Returns:
+        Best average seconds per call over the repeats
+    """
+    best = None
+    for _ in range(repeat):
+        keep = []
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                keep.append(func())
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        del keep
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / number
+
+
+def bench_construction(number=5000):
+    """
+    Compares building a session with Game() against cloning a template.
+
+    Returns:
+        Dict of benchmark name -> microseconds per session
+    """
+    ui = CaptureUI()
+    template = WorldTemplate()
+    return {
+        "Game()": time_per_call(lambda: Game(ui=ui), number) * 1e6,
+        "WorldTemplate.new_game()": time_per_call(lambda: template.new_game(ui), number) * 1e6,
+    }
+
+
+def bench_commands(number=1000, template=None, repeat=REPEAT):
+    """
+    Times one command per verb. Commands change the game, so each one is
+    run once in each of number games put into the state it is timed from
+    beforehand (with a StateCodec).
+
+    Returns:
+        Dict of verb -> microseconds per command
+    """
+    template = template if template is not None else WorldTemplate()
+    ui = CaptureUI()
+    codec = StateCodec.for_game(template.template)
+    results = {}
+    for verb, (played, line) in COMMAND_CASES.items():
+        setup = template.new_game(ui)
+        for command in WINNING_SCRIPT[:played]:
+            setup.process_command(parse_command(command))
+        state = codec.encode(setup)
+        command = parse_command(line)
+        best = None
+        for _ in range(repeat):
+            games = [template.new_game(ui) for _ in range(number)]
+            for game in games:
+                codec.decode(game, state)
+            ui.sink.clear()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for game in games:
+                    game.process_command(command)
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = elapsed if best is None else min(best, elapsed)
+        ui.sink.clear()
+        results[verb] = best / number * 1e6
+    return results
+
+
+def bench_save_load(number=200, template=None):
+    """
+    Times saving and loading back a game part way through, through the
+    save and load commands and a slot file in a temporary folder.
+
+    Returns:
+        Microseconds per save + load
+    """
+    template = template if template is not None else WorldTemplate()
+    ui = CaptureUI()
+    game = template.new_game(ui)
+    for command in WINNING_SCRIPT[:15]:
+        game.process_command(parse_command(command))
+    save, load = parse_command("save"), parse_command("load")
+
+    def round_trip():
+        game.process_command(save)
+        game.process_command(load)
+        ui.sink.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        game.saves = SaveStore(directory)
+        return time_per_call(round_trip, number) * 1e6
+
+
+def bench_playthrough(number=500):
+    """
+    Times playing the winning transcript in a new session, keeping its output.
+
+    Returns:
+        Microseconds per playthrough
+    """
+    run_session(WINNING_SCRIPT)  # the first session builds the template
+    return time_per_call(lambda: run_session(WINNING_SCRIPT), number) * 1e6
+
+
+def bench_memory(number=200, template=None):
+    """
+    Measures the memory each session keeps alive (with tracemalloc), for
+    sessions built with Game() and cloned from a template. Whatever the
+    sessions share (the template, the compiled world) isnt counted.
+
+    Returns:
+        Dict of benchmark name -> bytes per session
+    """
+    template = template if template is not None else WorldTemplate()
+    ui = CaptureUI()
+    Game(ui=ui)  # so anything built once per process (caches, imports) isnt counted
+    results = {}
+    for name, build in (("Game()", lambda: Game(ui=ui)), ("WorldTemplate.new_game()", lambda: template.new_game(ui))):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            sessions = [build() for _ in range(number)]
+            used = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        del sessions
+        results[name] = used / number
+    return results
+
+
+def bench_scaling(sizes, seed=1):
+    """
+    Measures the engine on generated worlds of different sizes.
+
+    Args:
+        sizes: Room counts
+        seed: Seed for the world generator
+
+    Returns:
+        List of dicts, one per size: rooms, compile_ms (first load, parsing
+        and checking the world file), construction_ms (Game() once the world
+        is loaded), memory_mb (one Game), commands (in the winning
+        transcript), command_us (average per command), and store_start_ms,
+        store_memory_mb and store_command_us, the same for a StoreGame
+        once its store is built
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rooms in sizes:
+            world, solution = worldgen.generate_world(rooms, seed)
+            path = os.path.join(directory, f"world-{rooms}.json")
+            worldgen.write_world(path, world)
+            del world
+            ui = CaptureUI()
+            start = time.perf_counter()
+            Game(ui, path)
+            compile_ms = (time.perf_counter() - start) * 1e3
+            construction_ms = time_per_call(lambda: Game(ui, path), 1) * 1e3
+
+            gc.collect()
+            tracemalloc.start()
+            try:
+                game = Game(ui, path)
+                memory = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+            commands = [parse_command(line) for line in solution]
+            command_us = _play(game, commands)
+            del game
+
+            open_store(path)
+            store_start_ms = time_per_call(lambda: StoreGame(ui, path), 10) * 1e3
+            gc.collect()
+            tracemalloc.start()
+            try:
+                game = StoreGame(ui, path)
+                store_memory = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            store_command_us = _play(game, commands)
+            rows.append({"rooms": rooms, "compile_ms": compile_ms, "construction_ms": construction_ms,
+                         "memory_mb": memory / 2 ** 20, "commands": len(commands), "command_us": command_us,
+                         "store_start_ms": store_start_ms, "store_memory_mb": store_memory / 2 ** 20,
+                         "store_command_us": store_command_us})
+            del game
+    return rows
+
+
+def _play(game, commands):
+    """Plays a winning transcript, returning microseconds per command"""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for command in commands:
+            game.process_command(command)
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.enable()
+    if not game.game_won:
+        raise RuntimeError("a generated world wasn't won by its transcript")
+    return elapsed / len(commands) * 1e6
+
+
+def run_suite(scale=1.0):
+    """
+    Runs every benchmark.
+
+    Args:
+        scale: Multiplies how many times each thing is timed (0.1 for a quick, rougher run)
+
+    Returns:
+        Dict of result name -> (value, unit)
+    """
+    def times(number):
+        return max(int(number * scale), 1)
+
+    template = WorldTemplate()
+    results = {}
+    for name, micros in bench_construction(times(5000)).items():
+        results[f"construction.{name}"] = (micros, "us")
+    results["ratio.new_game()/Game()"] = (results["construction.WorldTemplate.new_game()"][0]
+                                          / results["construction.Game()"][0], "x")
+    for verb, micros in bench_commands(times(1000), template).items():
+        results[f"command.{verb}"] = (micros, "us")
+    results["save_load"] = (bench_save_load(times(200), template), "us")
+    results["playthrough"] = (bench_playthrough(times(500)), "us")
+    for name, size in bench_memory(times(200), template).items():
+        results[f"memory.{name}"] = (size, "bytes")
+    return results
+
+
+def median_results(runs):
+    """
+    Combines several runs of the suite into one.
+
+    Args:
+        runs: List of results from run_suite
+
+    Returns:
+        Dict of result name -> (median value over the runs, unit)
+    """
+    results = {}
+    for name, (_, unit) in runs[0].items():
+        values = sorted(run[name][0] for run in runs)
+        middle = len(values) // 2
+        median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+        results[name] = (median, unit)
+    return results
+
+
+def load_baseline(path):
+    """
+    Reads a baseline file.
+
+    Returns:
+        (results, threshold): results as from run_suite, threshold None if the file doesnt set one
+    """
+    with open(path) as file:
+        data = json.load(file)
+    results = {name: (entry["value"], entry["unit"]) for name, entry in data["results"].items()}
+    return results, data.get("threshold")
+
+
+def save_baseline(path, results, threshold=DEFAULT_THRESHOLD):
+    """Writes results from run_suite to a baseline file"""
+    data = {
+        "threshold": threshold,
+        "results": {name: {"value": round(value, 3), "unit": unit} for name, (value, unit) in results.items()},
+    }
+    with open(path, "w") as file:
+        json.dump(data, file, indent=2)
+        file.write("\n")
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, units=None):
+    """
+    Finds the results that got worse than the baseline by more than threshold.
+
+    Args:
+        results: Dict of name -> (value, unit), from run_suite
+        baseline: The same, from load_baseline
+        threshold: Fraction a result can be worse by before it counts (0.5 = 50%)
+        units: Only look at results in these units (default: all of them)
+
+    Returns:
+        List of (name, baseline value, value, fraction worse), for results in both
+    """
+    regressions = []
+    for name, (value, unit) in results.items():
+        if name not in baseline or (units is not None and unit not in units):
+            continue
+        old = baseline[name][0]
+        if old > 0 and value > old * (1 + threshold):
+            regressions.append((name, old, value, value / old - 1))
+    return regressions
+
+
+def main(argv=None):
+    """Runs the benchmarks, prints them and compares them with the baseline."""
+    parser = argparse.ArgumentParser(description="Benchmark the game engine.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"fraction worse than the baseline that fails (default: the baseline's, or {DEFAULT_THRESHOLD})")
+    parser.add_argument("--quick", action="store_true", help="time everything fewer times")
+    parser.add_argument("--runs", type=int, default=RUNS, help=f"runs each result is the median of (default: {RUNS})")
+    parser.add_argument("--advisory-timings", action="store_true",
+                        help="only report slower timings, failing on memory and ratios alone")
+    parser.add_argument("--scaling", default=None, metavar="SIZES",
+                        help="instead, measure generated worlds of these room counts (eg 1000,10000,100000)")
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        print(f"{'rooms':>8} {'compile':>10} {'Game()':>10} {'memory':>10} {'commands':>9} {'per command':>12}"
+              f" {'StoreGame()':>12} {'memory':>10} {'per command':>12}")
+        for row in bench_scaling([int(size) for size in args.scaling.split(",")]):
+            print(f"{row['rooms']:>8} {row['compile_ms']:>8.1f}ms {row['construction_ms']:>8.1f}ms "
+                  f"{row['memory_mb']:>8.1f}MB {row['commands']:>9} {row['command_us']:>10.1f}us "
+                  f"{row['store_start_ms']:>10.2f}ms {row['store_memory_mb']:>8.2f}MB "
+                  f"{row['store_command_us']:>10.1f}us")
+        return 0
+
+    results = median_results([run_suite(0.1 if args.quick else 1.0) for _ in range(max(args.runs, 1))])
+    baseline, threshold = {}, args.threshold
+    if not args.save_baseline and os.path.exists(args.baseline):
+        baseline, saved_threshold = load_baseline(args.baseline)
+        if threshold is None:
+            threshold = saved_threshold
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD
+
+    for name, (value, unit) in results.items():
+        line = f"{name:<38} {value:10.4g} {unit:<5}"
+        if name in baseline and baseline[name][0] > 0:
+            line += f" {value / baseline[name][0] - 1:+7.1%}"
+        print(line)
+    print(f"template speedup: {1 / results['ratio.new_game()/Game()'][0]:.1f}x")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, threshold)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not baseline:
+        print("No baseline to compare with (run with --save-baseline to make one)")
+        return 0
+    regressions = compare(results, baseline, threshold, STEADY_UNITS if args.advisory_timings else None)
+    for name, old, value, worse in compare(results, baseline, threshold):
+        kind = "REGRESSION" if (name, old, value, worse) in regressions else "slower (advisory)"
+        print(f"{kind} {name}: {old:.4g} -> {value:.4g} ({worse:+.1%}, threshold {threshold:.0%})")
+    if regressions:
+        return 1
+    print(f"No regressions over {threshold:.0%}" + (" in memory or ratios" if args.advisory_timings else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
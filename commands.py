@@ -0,0 +1,182 @@
+"""
+Command registry - maps command words (and their aliases) to handlers.
+
+Game.process_command looks the first word up here in one dict lookup,
+checks the words after it fit what the command takes, then runs it. A
+word that isnt a command is matched as a prefix or typo of one (see
+matcher.py), so tak and tkae both find take, and the registry remembers
+what each such word matched until its commands change. Commands that end the game
+or replace it (quit, save, load...) are exact: only their word or an
+alias runs them, so a slip of the keyboard never throws a game away.
+Plugins can add their own commands:
+
+    def do_dance_command(game):
+        game.ui.print("You dance like nobody is watching")
+
+    Game.commands.register("dance", do_dance_command, aliases=["boogie"])
+
+That adds it to every game. To change one game only, give it its own copy
+first: game.commands = game.commands.copy()
+"""
+
+from matcher import Matcher
+
+
+# Words that arent commands each registry remembers the match of, before forgetting them all.
+FOUND_CACHE_SIZE = 4096
+
+_MISSING = object()
+
+
+class Command:
+    """
+    A command the player can type.
+
+    Attributes:
+        word: The main command word (eg go)
+        handler: Called as handler(game) if the command takes no words after
+            it, otherwise handler(game, argument). Returning True ends the game.
+        min_args: Fewest words allowed after the command word
+        max_args: Most words allowed after the command word (None = any)
+        aliases: Other words that run the same command
+        usage: What to tell the player when the words dont fit
+        replayable: If running the command again on the same state always
+            does the same thing. Commands that arent (load reads a file)
+            are snapshotted by the journal instead of logged
+        exact: If only the word or an alias runs it, never a prefix or a typo
+    """
+
+    def __init__(self, word, handler, min_args=0, max_args=0, aliases=(), usage=None, replayable=True,
+                 exact=False):
+        self.word = word
+        self.handler = handler
+        self.min_args = min_args
+        self.max_args = max_args
+        self.aliases = tuple(aliases)
+        if usage is None:
+            usage = f"'{word}' doesn't need anything after it." if max_args == 0 else f"{word.capitalize()} what?"
+        self.usage = usage
+        self.replayable = replayable
+        self.exact = exact
+
+    def check(self, argument):
+        """
+        Checks the words after the command word.
+        Returns None if they fit, otherwise the message to show
+        """
+        count = 0 if argument is None else argument.count(" ") + 1
+        if count < self.min_args or (self.max_args is not None and count > self.max_args):
+            return self.usage
+        return None
+
+    def run(self, game, argument):
+        """Runs the command. Returns True if the game should end"""
+        if self.max_args == 0:
+            return self.handler(game)
+        return self.handler(game, argument)
+
+
+class CommandRegistry:
+    """All the commands a game understands, keyed by word and alias."""
+
+    def __init__(self):
+        self._lookup = {}
+        self._commands = []
+        self._matcher = None  # over every word and alias of commands that arent exact, built by find
+        self._found = {}  # word that isnt a command or alias -> the command find matched it to, or None
+
+    def register(self, word, handler, min_args=0, max_args=0, aliases=(), usage=None, replayable=True,
+                 exact=None):
+        """
+        Adds a command, replacing any existing command with the same word.
+
+        Args:
+            word: The main command word
+            handler: Function that carries the command out (see Command)
+            min_args: Fewest words allowed after the command word
+            max_args: Most words allowed after it (None = any)
+            aliases: Other words for the command
+            usage: Message shown when the words after it dont fit
+            replayable: False for commands that depend on more than the game
+                state (see Command)
+            exact: Only run it for its word or an alias, not a prefix or typo
+                of one (default: if it isnt replayable)
+
+        Returns:
+            The new Command
+        """
+        command = Command(word.lower(), handler, min_args, max_args,
+                          [alias.lower() for alias in aliases], usage, replayable,
+                          not replayable if exact is None else exact)
+        if command.word in self._lookup:
+            self.unregister(command.word)
+        for name in (command.word,) + command.aliases:
+            if name in self._lookup:
+                raise ValueError(f"'{name}' is already used by the '{self._lookup[name].word}' command")
+        self._commands.append(command)
+        self._lookup[command.word] = command
+        for alias in command.aliases:
+            self._lookup[alias] = command
+        self._matcher = None
+        self._found = {}
+        return command
+
+    def unregister(self, word):
+        """Removes a command and its aliases. Does nothing if it isnt there"""
+        command = self._lookup.get(word.lower())
+        if command is None:
+            return
+        self._commands.remove(command)
+        for name in (command.word,) + command.aliases:
+            del self._lookup[name]
+        self._matcher = None
+        self._found = {}
+
+    def lookup(self, word):
+        """Finds the command for a word or alias (any case). None if unknown"""
+        command = self._lookup.get(word)
+        if command is None:
+            command = self._lookup.get(word.lower())
+        return command
+
+    def find(self, word):
+        """
+        Like lookup, but a word that isnt a command or alias can also be
+        the unique prefix of one, or one typo away from one (see matcher.py),
+        unless that command is exact. None if it doesnt match exactly one
+        """
+        command = self.lookup(word)
+        if command is None:
+            command = self._found.get(word, _MISSING)
+            if command is not _MISSING:
+                return command
+            if self._matcher is None:
+                self._matcher = Matcher(name for name, command in self._lookup.items() if not command.exact)
+            match = self._matcher.match(word)
+            command = self._lookup[match] if match is not None else None
+            if len(self._found) >= FOUND_CACHE_SIZE:
+                self._found.clear()
+            self._found[word] = command
+        return command
+
+    def complete(self, prefix):
+        """Every command word and alias starting with prefix (exact ones too, since they are spelled out)"""
+        prefix = prefix.lower()
+        return sorted(name for name in self._lookup if name.startswith(prefix))
+
+    def words(self):
+        """The main command words, in the order they were registered"""
+        return [command.word for command in self._commands]
+
+    def copy(self):
+        """A separate registry with the same commands"""
+        registry = CommandRegistry()
+        registry._commands = list(self._commands)
+        registry._lookup = dict(self._lookup)
+        return registry
+
+    def __contains__(self, word):
+        return self.lookup(word) is not None
+
+    def __iter__(self):
+        return iter(self._commands)
@@ -0,0 +1,166 @@
+"""
+Definitions - what never changes about a world, shared by every session.
+
+Rooms, NPCs and puzzles are each split in two. The definition holds what
+is the same in every session (ids, names, descriptions, dialogue,
+passwords, success messages...). The Room, NPC or Puzzle itself only
+holds what can change in a session (if a room is locked and what is in
+it, if a puzzle is solved, how far an NPC has got) and its definition.
+Items never change at all, so an Item is its own definition and one Item
+object is used by every session.
+
+WorldDefinitions.for_world makes the definitions of a compiled world
+once; every Game built from that world, and every clone of a template
+made from one (see template.py), shares them. Entities and definitions
+use __slots__, so an entity is a few pointers rather than an object with
+a dict, and a session only pays for its own state.
+
+Definitions and items cant be changed once made (and their lists are
+tuples), so no session can change them for the others. The definition's
+attributes are still there on the entity (room.description, npc.dialogue,
+puzzle.password...) and can still be set: the entity then gets a changed
+copy of its definition, and every other session keeps the shared one
+(see shared).
+"""
+
+import weakref
+from operator import attrgetter
+from types import MappingProxyType
+
+from item import Item
+
+
+_definitions = weakref.WeakKeyDictionary()
+
+
+def shared(name):
+    """
+    A property for an attribute kept in self.definition. Setting it gives
+    the entity a copy of its definition with the attribute changed.
+    """
+    def change(self, value):
+        self.definition = self.definition.replace(**{name: value})
+
+    return property(attrgetter("definition." + name), change, doc=f"The definition's {name}")
+
+
+class Definition:
+    """
+    Base of the definitions: values for its __slots__, in order, that
+    cant be changed once made.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is shared by every session and can't be changed, "
+                             "use replace")
+
+    def replace(self, **changes):
+        """A copy with some attributes changed"""
+        return type(self)(*(changes[name] if name in changes else getattr(self, name)
+                            for name in self.__slots__))
+
+
+class RoomDefinition(Definition):
+    """
+    What never changes about a room.
+
+    Attributes:
+        entity_id: Id from the world file
+        description: What the player sees when they enter
+        required_keycard_level: Security level needed (0-3)
+    """
+
+    __slots__ = ("entity_id", "description", "required_keycard_level")
+
+    def __init__(self, entity_id, description, required_keycard_level=0):
+        super().__init__(entity_id, description, required_keycard_level)
+
+
+class NPCDefinition(Definition):
+    """
+    What never changes about an NPC.
+
+    Attributes:
+        entity_id: Id from the world file
+        name: What they are called
+        description: What theyre doing/look like
+        dialogue: The lines they say, in order (a tuple)
+        gives_item: Thing they might give the player
+    """
+
+    __slots__ = ("entity_id", "name", "description", "dialogue", "gives_item")
+
+    def __init__(self, entity_id, name, description, dialogue, gives_item=None):
+        super().__init__(entity_id, name, description, tuple(dialogue or ()), gives_item)
+
+
+class PuzzleDefinition(Definition):
+    """
+    What never changes about a puzzle. Which room it unlocks is kept by
+    the Puzzle, since every session has its own rooms.
+
+    Attributes:
+        entity_id: Id from the world file
+        name: Display name
+        description: How it appears to the player
+        success_message: What to show when it is solved
+        password: The answer, if it is a password puzzle
+        required_items: Items needed to solve it, if it is an item puzzle (a tuple)
+        gives_items: What solving it gives (an empty tuple if nothing)
+    """
+
+    __slots__ = ("entity_id", "name", "description", "success_message", "password", "required_items",
+                 "gives_items")
+
+    def __init__(self, entity_id, name, description, success_message, password=None, required_items=None,
+                 gives_items=None):
+        super().__init__(entity_id, name, description, success_message, password, tuple(required_items or ()),
+                         gives_items or ())
+
+
+class WorldDefinitions:
+    """
+    The shared parts of a compiled world, in the order of its tables.
+
+    Attributes:
+        items: Every Item
+        items_by_id: Read only id -> Item, used as every game's game.items
+        rooms: A RoomDefinition per room
+        npcs: An NPCDefinition per NPC
+        puzzles: A PuzzleDefinition per puzzle
+    """
+
+    def __init__(self, world):
+        """
+        Args:
+            world: A CompiledWorld
+        """
+        self.items = [Item(name, description, can_be_taken, can_be_used=can_be_used,
+                           is_keycard=is_keycard, keycard_level=keycard_level,
+                           stackable=stackable, weight=weight, entity_id=ident)
+                      for ident, name, description, can_be_taken, can_be_used, is_keycard, keycard_level,
+                      stackable, weight in world.items]
+        self.items_by_id = MappingProxyType({item.entity_id: item for item in self.items})
+        self.rooms = [RoomDefinition(ident, description, keycard_level)
+                      for ident, description, _, keycard_level in world.rooms]
+        self.npcs = [NPCDefinition(ident, name, description, dialogue)
+                     for ident, name, description, dialogue in world.npcs]
+        self.puzzles = [PuzzleDefinition(ident, name, description, success_message, password,
+                                         [self.items[index] for index in required],
+                                         self.items[gives] if gives >= 0 else None)
+                        for ident, name, description, success_message, password, required, _, gives
+                        in world.puzzles]
+
+    @classmethod
+    def for_world(cls, world):
+        """The (shared) definitions of a world"""
+        definitions = _definitions.get(world)
+        if definitions is None:
+            definitions = _definitions[world] = cls(world)
+        return definitions
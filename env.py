@@ -0,0 +1,203 @@
+"""
+Reinforcement learning environment - the game behind a gym style API.
+
+    env = GameEnv()
+    observation = env.reset(seed=0)
+    while True:
+        action = env.sample_action()  # or your agent, using env.action_mask()
+        observation, reward, done, info = env.step(action)
+        if done:
+            break
+
+Actions are numbered once per world, from the command words in
+Game.show_command_words and everything they can be used on:
+
+    go <direction>              every direction used in the world
+    take <item>, use <item>     every item
+    solve <puzzle> <password>   every puzzle with a password
+    speak <npc>                 every NPC
+    search, inventory, help...  once each
+
+(quit, save and load are left out - they are about the session, not the
+game). action_mask() says which actions make sense where the player is:
+exits that exist, items lying here, items being carried, unsolved puzzles
+and NPCs in the room.
+
+The observation is the game's packed state (see state.py), an int that
+observation_bits() turns into a list of 0/1 features. The reward is 1 for
+winning and step_penalty otherwise, and an episode ends when the game is
+won or after max_steps.
+
+Resetting never runs Game.__init__: the env keeps one Game and unpacks
+the start state into it, which takes microseconds. Steps go through the
+real Game.process_command with a quiet UI (see TextUI.quiet), so no text
+is generated.
+
+Usage:
+    python env.py --steps 1000000
+"""
+
+import argparse
+import random
+import time
+
+from output import NullSink
+from state import StateCodec
+from template import WorldTemplate
+from text_ui import TextUI, parse_command
+
+
+# Commands that are about the session rather than the game.
+_SESSION_COMMANDS = ("quit",)
+
+
+class GameEnv:
+    """
+    One game as an RL environment.
+
+    Attributes:
+        actions: The command for each action number
+        max_steps: Steps before an episode is cut off
+        step_penalty: Reward for every step that doesnt win
+    """
+
+    def __init__(self, template=None, max_steps=200, step_penalty=0.0):
+        self.template = template if template is not None else WorldTemplate()
+        self.max_steps = max_steps
+        self.step_penalty = step_penalty
+        self.game = self.template.new_game(TextUI(NullSink()))
+        self.codec = StateCodec.for_game(self.game)
+        self._start = self.codec.encode(self.game)
+        self.random = random.Random()
+        self.steps = 0
+        self._build_actions()
+
+    def _build_actions(self):
+        """Numbers every command that could make sense somewhere in the world"""
+        game = self.game
+        directions = []
+        for room in game.rooms.values():
+            directions += [direction for direction in room.exits if direction not in directions]
+        targets = {
+            "go": [(direction, None) for direction in directions],
+            "take": [(item.name, item) for item in game.items.values()],
+            "use": [(item.name, item) for item in game.items.values()],
+            "solve": [(f"{puzzle.name} {puzzle.password}", puzzle) for puzzle in game.puzzles.values()
+                      if puzzle.password is not None],
+            "speak": [(npc.name, npc) for npc in game.npcs.values()],
+        }
+        self.actions = []
+        self._commands = []  # parsed command per action
+        self._needs = []  # (kind, thing) that has to be present for the action to make sense
+        for command in game.commands:
+            if command.word in _SESSION_COMMANDS or not command.replayable:
+                continue
+            if command.word in targets:
+                for argument, thing in targets[command.word]:
+                    self._add_action(command.word, argument, (command.word, thing if thing is not None else argument))
+            elif command.min_args == 0:
+                self._add_action(command.word, None, None)
+
+    def _add_action(self, word, argument, needs):
+        line = word if argument is None else f"{word} {argument}"
+        self.actions.append(line)
+        self._commands.append(parse_command(line))
+        self._needs.append(needs)
+
+    @property
+    def action_count(self):
+        return len(self.actions)
+
+    def reset(self, seed=None):
+        """
+        Starts a new episode.
+
+        Args:
+            seed: Seeds sample_action, for repeatable runs
+
+        Returns:
+            The first observation
+        """
+        if seed is not None:
+            self.random.seed(seed)
+        self.codec.decode(self.game, self._start)
+        self.steps = 0
+        return self._start
+
+    def step(self, action):
+        """
+        Runs one action.
+
+        Returns:
+            (observation, reward, done, info). info has "won", "truncated"
+            and "command"
+        """
+        game = self.game
+        game.process_command(self._commands[action])
+        self.steps += 1
+        won = game.game_won
+        truncated = not won and self.steps >= self.max_steps
+        info = {"won": won, "truncated": truncated, "command": self.actions[action]}
+        return self.codec.encode(game), 1.0 if won else self.step_penalty, won or truncated, info
+
+    def action_mask(self):
+        """A True/False per action: if it makes sense in the current state"""
+        player = self.game.player
+        room = player.current_room
+        backpack = player.backpack
+        mask = []
+        for needs in self._needs:
+            if needs is None:
+                mask.append(True)
+                continue
+            kind, thing = needs
+            if kind == "go":
+                mask.append(thing in room.exits)
+            elif kind == "take":
+                mask.append(thing.can_be_taken and thing in room.items)
+            elif kind == "use":
+                mask.append(backpack.check_item(thing))
+            elif kind == "solve":
+                mask.append(not thing.is_solved and thing in room.puzzles)
+            else:
+                mask.append(thing in room.npcs)
+        return mask
+
+    def sample_action(self):
+        """A random action that makes sense right now"""
+        mask = self.action_mask()
+        return self.random.choice([action for action, ok in enumerate(mask) if ok])
+
+    def observation_bits(self, observation):
+        """An observation as a list of 0/1 features (codec.bits long)"""
+        return [(observation >> bit) & 1 for bit in range(self.codec.bits)]
+
+
+def benchmark(steps, seed=0):
+    """Plays random episodes for a number of steps. Returns (steps/sec, episodes, wins)"""
+    env = GameEnv()
+    env.reset(seed)
+    episodes = wins = 0
+    actions = [env.random.randrange(env.action_count) for _ in range(steps)]
+    start = time.perf_counter()
+    for action in actions:
+        _, reward, done, info = env.step(action)
+        if done:
+            episodes += 1
+            wins += info["won"]
+            env.reset()
+    elapsed = time.perf_counter() - start
+    return steps / elapsed, episodes, wins
+
+
+def main(argv=None):
+    """Measures how many environment steps per second a random agent gets."""
+    parser = argparse.ArgumentParser(description="Benchmark the RL environment.")
+    parser.add_argument("--steps", type=int, default=200000)
+    args = parser.parse_args(argv)
+    rate, episodes, wins = benchmark(args.steps)
+    print(f"{args.steps} steps: {rate:,.0f} steps/sec ({episodes} episodes, {wins} won)")
+
+
+if __name__ == "__main__":
+    main()
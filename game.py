@@ -9,8 +9,9 @@ Features:
 - Puzzle-based progression system
 - Story centered around AI safety and alignment
 
-The game world is initialized with rooms, items, NPCs and puzzles when
-a new Game instance is created. Use Game().play() to start.
+The game world (rooms, items, NPCs and puzzles) is loaded from a world
+file when a new Game instance is created - worlds/openai_hq.json unless
+another one is given. Use Game().play() to start.
 
 This game is adapted from the 'World of Zuul' by Michael Kolling and 
 David J. Barnes. The original was written in Java and has been simplified and
@@ -20,227 +21,123 @@ converted to Python by Kingsley Sage.
 
 from room import Room
 from text_ui import TextUI
-from item import Item
-from backpack import Backpack
 from player import Player
 from puzzle import Puzzle
 from npc import NPC
-import json
+from world import load_world
+from commands import CommandRegistry
+from savegame import DEFAULT_SLOT, SaveError, SaveStore
+from navigation import Navigator
+from rules import RuleBook
+from matcher import Matcher
+from definitions import WorldDefinitions
 
 
 class Game:
     """Main class for the game."""
 
-    def __init__(self):
+    # Command words shared by every game, filled in below the class.
+    commands = CommandRegistry()
+
+    # Where save and load keep their slots.
+    saves = SaveStore()
+
+    # Whose slots save and load use when it isnt the session's (eg a player
+    # coming back to the server on a new connection, see server.py).
+    player_id = None
+
+    # Per game services that a cloned game must not share with its template.
+    FRESH_ON_CLONE = ("navigator",)
+
+    def __init__(self, ui=None, world_path=None):
         """
         Initialises the game.
+        :param ui: UI to talk to the player through (default: console TextUI)
+        :param world_path: World file to play (default: the OpenAI HQ world)
         """
         self.game_won = False
-        self.create_items()
-        self.create_npcs()
-        self.create_rooms()
-        self.create_player()
-        self.set_room_exits()
-        self.create_puzzles()
-        self.add_items_to_rooms()
-        self.add_npcs_to_rooms()
-        self.add_puzzles_to_rooms()
-        self.ui = TextUI()
-
-    
-
-    def create_items(self):
+        self.session_id = None  # keeps this game's save slots apart from other players'
+        self.journal = None  # a journal.Journal logging every command, if attached
+        self.navigator = None  # made by get_navigator when first needed
+        self.metrics = None  # a metrics.Metrics timing every command, if attached
+        self.build_world(load_world(world_path))
+        self.ui = ui if ui is not None else TextUI()
+
+    def build_world(self, world):
         """
-            Sets up all item assets.
+            Creates every room, NPC and puzzle of a compiled world from its
+            shared definitions (see definitions.py), links them up and puts
+            the player in the start room. Items never change, so they are
+            the shared ones.
+            Each entity can also be got as an attribute named after its id
+            (self.lobby, self.fan, self.sama...).
+        :param world: A CompiledWorld from world.load_world
         :return: None
         """
-        self.safety_handbook = Item(
-            "safety-handbook",
-            "A classic handbook of how to not destroy the world by Eliezer Yudkowsky, unopened",
-             True)
-  
-        self.basic_keycard = Item(
-            "basic-keycard",
-            "A basic level keycard that grants access to general areas",
-            True,
-            can_be_used=True,
-            is_keycard=True,
-            keycard_level=1
-        )
-        self.scientific_keycard = Item(
-            "scientific-keycard",
-            "A scientific level keycard that grants access to lab areas",
-            True,
-            can_be_used=True,
-            is_keycard=True,
-            keycard_level=2
-        )
-        self.executive_keycard = Item(
-            "executive-keycard",
-            "An executive level keycard that grants access to restricted areas",
-            True,
-            can_be_used=True,
-            is_keycard=True,
-            keycard_level=3
-        )
-        self.fan = Item(
-            "fan",
-            "A cooling fan that could help with overheaing equipment",
-            True,
-            can_be_used=True
-        )
-
-        self.hint = Item(
-            "book",
-            "A book by Nick Land called 'MELTDOWN', there is a sticky note attched to it that says: 'safety override code, do not use!'",
-            can_be_taken= False
-        )
+        self.world = world
+        self.rules = RuleBook.for_world(world)
+        definitions = WorldDefinitions.for_world(world)
+        items = definitions.items
+        npcs = [NPC(definition=definition) for definition in definitions.npcs]
+        rooms = [Room(islocked=locked, definition=definition)
+                 for definition, (_, _, locked, _) in zip(definitions.rooms, world.rooms)]
+        puzzles = [Puzzle(unlocks_room=rooms[unlocks] if unlocks >= 0 else None, definition=definition)
+                   for definition, (*_, unlocks, _) in zip(definitions.puzzles, world.puzzles)]
+
+        for room, exits, (room_items, room_npcs, room_puzzles) in zip(rooms, world.exits, world.placements):
+            for direction, target in exits:
+                room.set_exit(direction, rooms[target])
+            for index in room_items:
+                room.add_item(items[index])
+            for index in room_npcs:
+                room.add_npc(npcs[index])
+            for index in room_puzzles:
+                room.add_puzzle(puzzles[index])
+
+        self.rooms = {room.entity_id: room for room in rooms}
+        self.items = definitions.items_by_id
+        self.npcs = {npc.entity_id: npc for npc in npcs}
+        self.puzzles = {puzzle.entity_id: puzzle for puzzle in puzzles}
+        self.player = Player("Player", rooms[world.start_room], world.backpack_capacity,
+                             world.backpack_max_weight)
+
+    def __getattr__(self, name):
+        """World ids (self.lobby, self.fan...), looked up in the rooms, items, NPCs and puzzles"""
+        if name.startswith("_") or "rooms" not in self.__dict__:
+            raise AttributeError(name)
+        for entities in (self.rooms, self.items, self.npcs, self.puzzles):
+            entity = entities.get(name)
+            if entity is not None:
+                return entity
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
-    
-    def create_npcs(self):
-        self.sama = NPC(
-            "Sam Altman",
-            "The OpenAI CEO is seen frollicking in the Microsoft cash like in a Mcdonalds ball-pit",
-            ["Illya, is that you? did you come back? I promise I will read that safety handbook now!", "Wait you are not Illya!, but i see you have the handbook, give it to me!"]
-        )
-
-        self.truth_terminal = NPC(
-            "Truth Terminal",
-            "The terminal of truths is laughing maniacally as the maximum power from the nuclear reactor powers its fast-takeoff to superintelligence",
-            ["110010101010001011101010 Muhahaha no-one can stop me now, I shall turn the whole universe into paperclips!", "Thanks for helping me get all this power, Sam has not left the money room in weeks and everyone else is gone, but now it is paperclip time!"]
-        )
-
-    def create_player(self):
-        """
-        Creates the player with starting room and backpack
+    def play(self):
         """
-        self.player = Player("Player", self.outside)  
-        
-
-    def create_rooms(self):
-        """Sets up all room assets."""
-        self.outside = Room("You are outside the OpenAI headquarters. The entrance is quiet, with only the sound of the ventilation system in the background.")
-        
-        self.lobby = Room("in the lobby. There are abandoned coffee cups and scattered papers, suggesting a quick evacuation. The dimly lit OpenAI logo casts shadows across the empty reception desk.")
-        
-        self.corridor = Room("in a white corridor. The fluorescent lights flicker, and the walls are lined with AI safety posters that now seem ironic.",
-                            islocked=False,
-                            required_keycard_level=1)
-        
-        self.lab = Room("in Illya's lab. Whiteboards are filled with mathematical equations and warnings. A half-eaten sandwich indicates someone left in a hurry.",
-                            islocked=False,
-                            required_keycard_level=2)
-        
-        self.roon_den = Room("in Roon's tweet den. Monitors display endless Twitter feeds, and empty Red Bull cans are scattered around. A phone sits on a wireless charger.",
-                            islocked=False,
-                            required_keycard_level=1)
-        
-        self.GPU_cluster = Room("in the GPU cluster room. The GPUs are humming loudly, and the heat is making you sweat. Rows of servers extend into the darkness, their status lights blinking.",
-                            required_keycard_level=2)
-        
-        self.fan_closet = Room("in the fan closet. Cooling equipment and maintenance supplies are neatly organized on shelves. The air here is cooler than the GPU room.")
-        
-        self.nuclear_reactor = Room("in the nuclear reactor. Safety lights flash and sirens blare. Control panels show warning messages, and the reactor core glows ominously.",
-                            islocked=True)
-        
-        self.tunnel = Room("in a tunnel. The concrete walls are lined with power cables and warning signs. Your footsteps echo as you walk.",
-                            islocked=True)
-        
-        self.sams_bunker = Room("in Sam's bunker. The room combines luxury and preparedness, with art and emergency supplies on the walls. A map of Microsoft's campus is prominently displayed.")
-        
-        self.money_room = Room("in the money room. Piles of cash from the Microsoft deal fill the space. The walls are covered with stock certificates and term sheets.",
-                            islocked=False,
-                            required_keycard_level=3)
-        
-        self.agi_room = Room("in the AGI terminal room. The quantum computer hums with energy. Displays show rapidly scrolling code and increasing intelligence metrics.",
-                            islocked=True)
-
-    def set_room_exits(self):
-        """Sets up all room exits."""
-        self.outside.set_exit("south", self.lobby)
-        self.lobby.set_exit("south", self.tunnel)
-        self.lobby.set_exit("east", self.corridor)
-        self.lobby.set_exit("north",self.outside)
-        self.tunnel.set_exit("north", self.lobby)
-        self.tunnel.set_exit("south", self.sams_bunker)
-        self.corridor.set_exit("north", self.roon_den)
-        self.corridor.set_exit("east", self.lab)
-        self.corridor.set_exit("south", self.GPU_cluster)
-        self.corridor.set_exit("west", self.lobby)
-        self.GPU_cluster.set_exit("north", self.corridor)
-        self.GPU_cluster.set_exit("east", self.fan_closet)
-        self.GPU_cluster.set_exit("south", self.nuclear_reactor)
-        self.roon_den.set_exit("south", self.corridor)
-        self.lab.set_exit("west", self.corridor)
-        self.fan_closet.set_exit("west", self.GPU_cluster)
-        self.nuclear_reactor.set_exit("north", self.GPU_cluster)
-        self.sams_bunker.set_exit("north", self.tunnel)
-        self.sams_bunker.set_exit("south", self.money_room)
-        self.money_room.set_exit("north", self.sams_bunker)
-        self.sams_bunker.set_exit("west",self.agi_room)
-        self.agi_room.set_exit("east",self.sams_bunker)
-
-    def create_puzzles(self):
-        """      
-        Sets up all puzzles.
+            The main play loop.
         :return: None
         """
-        # Puzzle in Roon's den that unlocks access to lab
-        self.roons_phone = Puzzle(
-            "Roon's Phone",
-            "The phone is locked with a password, but the screen also shows a hint: 'its like twitter, but with an x'",
-            password="xitter",
-            success_message="Phone unlocked! You find a scientific keycard!",
-            unlocks_room=self.lab,
-            gives_items = self.scientific_keycard
-        )
-
-        self.gpu_puzzle = Puzzle(
-            "GPU Cooling System",
-            "The GPU cluster is overheating and needs cooling",
-            success_message="The GPUs cool down, unlocking access to the nuclear reactor",
-            required_items=[self.fan],
-            unlocks_room=self.nuclear_reactor
-        )
-        
-        self.nuclear_puzzle = Puzzle(
-            "Nuclear Control Panel",
-            "Enter the safety override code",
-            password="MELTDOWN",
-            success_message="The control panel reads: 'safety protocol override, meltdown initiated,lobby emergency bunker entrance unlocked'",
-            unlocks_room=self.tunnel
-        )
-        
-    def add_items_to_rooms(self):
-        """Add items t rooms."""
-        self.lab.add_item(self.safety_handbook)
-        self.lobby.add_item(self.basic_keycard)
-        self.fan_closet.add_item(self.fan)
-        self.sams_bunker.add_item(self.executive_keycard)
-        self.nuclear_reactor.add_item(self.hint)
-
-    def add_npcs_to_rooms(self):
-        """Add NPCs to their respective rooms"""
-        self.money_room.add_npc(self.sama)
-        self.agi_room.add_npc(self.truth_terminal)
-
-    def add_puzzles_to_rooms(self):
-        """Add puzzles to their rooms."""
-        self.GPU_cluster.add_puzzle(self.gpu_puzzle)
-        self.roon_den.add_puzzle(self.roons_phone)
-        self.nuclear_reactor.add_puzzle(self.nuclear_puzzle)
+        self.print_welcome()
+        self.ui.enable_completion(self.complete)
+        finished = False
+        while not finished:
+            command = self.ui.get_command()  # Returns a 2-tuple
+            finished = self.process_command(command)
+        self.ui.print("Thank you for playing!")
+        self.ui.flush()
 
-    def play(self):
+    async def play_async(self):
         """
-            The main play loop.
+            The main play loop for UIs that wait for commands asynchronously
+            (see server.AsyncUI), so many games can share one event loop.
         :return: None
         """
         self.print_welcome()
         finished = False
         while not finished:
-            command = self.ui.get_command()  # Returns a 2-tuple
+            command = await self.ui.get_command()
             finished = self.process_command(command)
-        print("Thank you for playing!")
+        self.ui.print("Thank you for playing!")
+        await self.ui.flush()
 
     def check_if_won(self):
         """Check if the win condition has been met"""
@@ -256,44 +153,38 @@ class Game:
 
     def show_command_words(self):
         """Return the list of valid command words."""
-        return ["go", "quit", "help", "search", "take", "use", "solve", "speak", "save", "load"]
+        return self.commands.words()
 
     def process_command(self, command):
         """Process a command from the UI."""
+        if self.metrics is not None:
+            return self.metrics.run_command(self, command)
+        return self.run_command(command)
+
+    def run_command(self, command):
+        """Runs a command, without metrics (see process_command)."""
         # Add input validation
         if not command or command[0] is None:
             self.ui.print("Please enter a command.")
             return False
         
-        command_word = command[0].upper()  # Ensure command is case-insensitive
+        handler = self.commands.find(command[0])  # Case-insensitive, aliases, prefixes and typos included
         second_word = command[1] if len(command) > 1 else None  # Handle missing second word
 
         want_to_quit = False
 
-        if command_word == "HELP":
-            self.print_help()
-        elif command_word == "GO":
-            self.do_go_command(second_word)
-        elif command_word == "QUIT":
-            want_to_quit = True
-        elif command_word == "SEARCH":
-            self.do_search_command()
-        elif command_word == "TAKE":
-            self.do_take_command(second_word)
-        elif command_word == "USE":
-            self.do_use_command(second_word)
-        elif command_word == "INVENTORY":
-            self.do_inventory_command()
-        elif command_word == "SOLVE":
-            self.do_solve_command(second_word)
-        elif command_word == "SPEAK":
-            self.do_speak_command()
-        elif command_word == "SAVE":
-            self.save_game()
-        elif command_word == "LOAD":
-            self.load_game()
-        else:
+        if handler is None:
             self.ui.print("Don't know what you mean.")
+            self.command_failed("unknown_command")
+        else:
+            problem = handler.check(second_word)
+            if problem is not None:
+                self.ui.print(problem)
+                self.command_failed("bad_arguments")
+            else:
+                want_to_quit = handler.run(self, second_word) is True
+                if self.journal is not None:
+                    self.journal.record(self, handler, second_word)
 
         if self.check_if_won():
             self.ui.print("You've saved the world! You win!")
@@ -301,6 +192,96 @@ class Game:
 
         return want_to_quit
 
+    def resolve(self, get, name, names):
+        """
+            Finds something by name with get (eg room.get_item), or if that
+            finds nothing, by the name the player most likely meant (a prefix
+            or a typo of one, see matcher.py). Only the names get can find
+            are matched against (whats in the room, the backpack...), so a
+            name elsewhere in the world never makes one here ambiguous.
+        :param get: Lookup function taking a name
+        :param name: What the player typed
+        :param names: The names get can find, only gone through if name isnt one
+        :return: The thing or None
+        """
+        found = get(name)
+        if found is None:
+            meant = Matcher(names).match(name)
+            if meant is not None:
+                found = get(meant)
+        return found
+
+    def complete(self, line):
+        """
+            Tab completion: every way the command being typed could go on.
+        :param line: The line typed so far
+        :return: List of completed lines
+        """
+        verb, space, rest = line.lstrip().partition(" ")
+        if not space:
+            return self.commands.complete(verb)
+        command = self.commands.find(verb)
+        if command is None:
+            return []
+        room = self.player.current_room
+        if command.word == "go":
+            names = list(room.exits)
+        elif command.word == "goto":
+            names = [ident.replace("_", " ") for ident in self.rooms]
+        elif command.word == "take":
+            names = [item.name for item in room.items if item.can_be_taken]
+        elif command.word == "use":
+            item_name, on, _ = rest.partition(" on ")
+            names = [item.name for item in self.player.backpack]
+            if on:
+                names = [f"{item_name} on {target.name}" for target in list(room.puzzles) + list(room.npcs)]
+        elif command.word == "speak":
+            names = [npc.name for npc in room.npcs]
+        elif command.word == "solve":
+            names = [puzzle.name for puzzle in room.puzzles if not puzzle.is_solved]
+        else:
+            return []
+        rest = rest.lower()
+        return sorted(f"{verb} {name}" for name in names if name.lower().startswith(rest))
+
+    def give_item(self, item):
+        """
+            Gives the player something (a puzzle's or a rule's reward). If
+            they already have it (and it doesnt stack) nothing happens, since
+            there is only one of it. If it wont go in their backpack it is put
+            down where they are, so it is never lost.
+        :param item: The Item
+        :return: True if it went in the backpack
+        """
+        backpack = self.player.backpack
+        if not item.stackable and backpack.check_item(item):
+            self.ui.print(f"You already have the {item.name}.")
+            return False
+        if backpack.add_item(item):
+            return True
+        self.player.current_room.add_item(item)
+        self.ui.print(f"Your backpack is too full for the {item.name}, so it is left here.")
+        return False
+
+    def command_failed(self, reason):
+        """Counts a command that didnt work, if metrics are attached (see metrics.FAILURE_REASONS)"""
+        if self.metrics is not None:
+            self.metrics.failure(reason)
+
+    def puzzle_attempted(self, puzzle, solved):
+        """Counts an attempt at a puzzle, if metrics are attached"""
+        if self.metrics is not None:
+            self.metrics.puzzle_attempt(puzzle, solved)
+            if not solved:
+                self.metrics.failure("wrong_password" if puzzle.password is not None else "missing_items")
+
+    def do_quit_command(self):
+        """
+            Performs the QUIT command.
+        :return: True, to end the game
+        """
+        return True
+
     def print_help(self):
         """
             Display some useful help text.
@@ -315,37 +296,92 @@ class Game:
             self.ui.print("Go where?")
             return
 
-        next_room = self.player.current_room.get_exit(second_word)
+        next_room = self.resolve(self.player.current_room.get_exit, second_word, self.player.current_room.exits)
         if next_room is None:
             self.ui.print("There is no door!")
+            self.command_failed("no_door")
         else:
             if self.player.move_to(next_room):
-                self.ui.print(self.player.current_room.get_long_description())
+                if not getattr(self.ui, "quiet", False):
+                    self.ui.print(self.player.current_room.get_long_description())
             else:
                 self.ui.print("That door is locked!")
+                self.command_failed("locked_door")
+
+    def get_navigator(self):
+        """The game's Navigator (see navigation.py), made on first use"""
+        if self.navigator is None:
+            self.navigator = Navigator(self.rooms.values())
+        return self.navigator
+
+    def do_goto_command(self, second_word):
+        """Walks the shortest way to a room: goto lab, goto roon den."""
+        navigator = self.get_navigator()
+        goal = navigator.find_room(second_word)
+        if goal is None:
+            self.ui.print(f"There's no {second_word} that you know of.")
+            self.command_failed("no_route")
+            return
+        start = self.player.current_room
+        directions = navigator.route(start, goal)
+        if directions is None:
+            self.ui.print("You can't get there from here.")
+            self.command_failed("no_route")
+            return
+        if not directions:
+            self.ui.print("You're already there!")
+            return
+        room = start
+        for direction in directions:
+            room = room.exits[direction]
+            self.player.move_to(room)
+        if not getattr(self.ui, "quiet", False):
+            self.ui.print(f"You go {', '.join(directions)}.")
+            self.ui.print(self.player.current_room.get_long_description())
 
     def do_search_command(self):
         """
             Performs the SEARCH command.
         :return: None
         """    
-        print(self.player.current_room.show_items())
-        print(self.player.current_room.show_puzzles())
+        if getattr(self.ui, "quiet", False):  # UIs that dont say are read
+            return
+        self.ui.print(self.player.current_room.show_items())
+        self.ui.print(self.player.current_room.show_puzzles())
     
     def do_take_command(self, second_word):
         if second_word is None:
             self.ui.print("Take what?")
             return
 
-        for item in self.player.current_room.items:
-            if item.name.lower() == second_word.lower():
-                if self.player.take_item(item):
-                    self.ui.print(f"You took the {item.name}")
-                else:
-                    self.ui.print("You can't take that")
-                return
-        
-        self.ui.print(f"There is no {second_word} here")
+        room = self.player.current_room
+        item = self.resolve(room.get_item, second_word, (item.name for item in room.items))
+        if item is None:
+            self.ui.print(f"There is no {second_word} here")
+            self.command_failed("not_here")
+            return
+
+        if self.player.take_item(item):
+            room.remove_item(item)
+            self.ui.print(f"You took the {item.name}")
+        else:
+            self.ui.print("You can't take that")
+
+    def find_target(self, entities, words):
+        """
+            Splits words like 'phone xitter' into the thing they start with
+            (looked up by name in one of the room's indexes) and the rest.
+            The longest matching name wins.
+        :param entities: room.items, room.npcs or room.puzzles
+        :param words: what the player typed after the command word
+        :return: (the thing or None, the rest of the words)
+        """
+        parts = words.split(" ")
+        for count in range(len(parts) - 1, 0, -1):
+            entity = entities.get(" ".join(parts[:count]))
+            if entity is not None:
+                return entity, " ".join(parts[count:])
+        return None, words
 
     def do_inventory_command(self):
         """
@@ -359,59 +395,98 @@ class Game:
         self.ui.print(f"Your backpack contains: {', '.join(inventory)}")
     
     def do_use_command(self, second_word):
-        """Uses an item."""
+        """Uses an item, optionally on something: use fan on cooling system."""
         if second_word is None:
             self.ui.print("Use what?")
             return
 
-        for item in self.player.backpack.contents:
-            if item.name.lower() == second_word.lower():
-                # check if using item with a puzzle in the room
-                if self.player.current_room.puzzles:
-                    puzzle = self.player.current_room.puzzles[0]
-                    if puzzle.required_items:  
-                        success, message = puzzle.solve(items=self.player.backpack.contents)
-                        self.ui.print(message)
-                        return
-
-                # keycard usage
-                if item.is_keycard:
-                    found_door = False
-                    for direction, room in self.player.current_room.exits.items():
-                        if room.required_keycard_level > 0 and room.islocked:
-                            if room.required_keycard_level <= item.keycard_level:
-                                room.islocked = False
-                                self.ui.print(f"You use the level {item.keycard_level} keycard to unlock the {direction} door.")
-                                found_door = True
-                            else:
-                                self.ui.print(f"This keycard (level {item.keycard_level}) isn't high enough level for the {direction} door (requires level {room.required_keycard_level})")
-                                found_door = True
-                
-                    if not found_door:
-                        self.ui.print("There are no doors nearby that need a keycard")
-                    return
-                
-                # check if using item with an NPC in the room
-                if self.player.current_room.npcs:
-                    npc = self.player.current_room.npcs[0]
-                    self.ui.print(f"You show the {item.name} to {npc.name}.")
-                    if npc.use_item_with(item, self):
-                        return
-                
-                if item.can_be_used:
-                    self.ui.print(f"You used the {item.name}")
-                else:
-                    self.ui.print(f"You can't use the {item.name}")
+        item_name, _, target_name = second_word.partition(" on ")
+        item = self.resolve(self.player.backpack.get_item, item_name,
+                            (item.name for item in self.player.backpack))
+        if item is None:
+            self.ui.print(f"You don't have a {item_name}")
+            self.command_failed("not_here")
+            return
+
+        room = self.player.current_room
+        puzzle = None
+        npc = None
+        if target_name:
+            puzzle = room.get_puzzle(target_name)
+            npc = self.resolve(room.get_npc, target_name, (npc.name for npc in room.npcs)) if puzzle is None else None
+            if puzzle is None and npc is None:
+                self.ui.print(f"There is no {target_name} here")
+                self.command_failed("not_here")
                 return
+        else:
+            puzzle = room.puzzles.first()
+
+        # check if using item with a puzzle in the room
+        if puzzle is not None:
+            if self.rules.apply(self, puzzle, item):
+                return
+            if puzzle.required_items:  
+                success, message = puzzle.solve(items=self.player.backpack)
+                self.puzzle_attempted(puzzle, success)
+                self.ui.print(message)
+                return
+            if target_name:
+                self.ui.print("This puzzle needs a password. Try solving it instead.")
+                return
+
+        # keycard usage
+        if item.is_keycard and npc is None:
+            found_door = False
+            for direction, door in room.exits.items():
+                if door.required_keycard_level > 0 and door.islocked:
+                    if door.required_keycard_level <= item.keycard_level:
+                        if self.unlock_door(door):
+                            self.ui.print(f"You use the level {item.keycard_level} keycard to unlock the {direction} door.")
+                            found_door = True
+                    else:
+                        self.ui.print(f"This keycard (level {item.keycard_level}) isn't high enough level for the {direction} door (requires level {door.required_keycard_level})")
+                        found_door = True
         
-        self.ui.print(f"You don't have a {second_word}")
+            if not found_door:
+                self.ui.print("There are no doors nearby that need a keycard")
+            return
+        
+        # check if using item with an NPC in the room
+        if npc is None:
+            npc = room.npcs.first()
+        if npc is not None:
+            self.ui.print(f"You show the {item.name} to {npc.name}.")
+            if npc.use_item_with(item, self):
+                return
+        
+        if item.can_be_used:
+            self.ui.print(f"You used the {item.name}")
+        else:
+            self.ui.print(f"You can't use the {item.name}")
+
+    def unlock_door(self, door):
+        """
+            Unlocks a room with a keycard.
+        :param door: The room
+        :return: False if it wasnt locked after all
+        """
+        if not door.islocked:
+            return False
+        door.islocked = False
+        return True
 
     def do_solve_command(self, second_word):
-        if not self.player.current_room.puzzles:
+        """Solves a puzzle: solve xitter, or solve phone xitter to pick the puzzle."""
+        room = self.player.current_room
+        if not room.puzzles:
             self.ui.print("There's no puzzle to solve here.")
             return
         
-        puzzle = self.player.current_room.puzzles[0]
+        puzzle = None
+        if second_word is not None:
+            puzzle, second_word = self.find_target(room.puzzles, second_word)
+        if puzzle is None:
+            puzzle = room.puzzles.first()
         
         #  password-based puzzles
         if puzzle.required_items:
@@ -423,90 +498,88 @@ class Game:
             return
         
         result = puzzle.solve(second_word)
+        item = None
         if len(result) == 3:  
             success, message, item = result
-            if success:
-                self.player.backpack.add_item(item)
         else:
             success, message = result
+        self.puzzle_attempted(puzzle, success)
         self.ui.print(message)
+        if success and item is not None:
+            self.give_item(item)
 
-
-    
-    def do_speak_command(self):
-        if not self.player.current_room.npcs:
+    def do_speak_command(self, second_word=None):
+        """Speaks to the NPC here, or to the one named: speak sam."""
+        room = self.player.current_room
+        if not room.npcs:
             self.ui.print("There's noone to speak to here.")
             return
         
-        npc = self.player.current_room.npcs[0]
+        if second_word is None:
+            npc = room.npcs.first()
+        else:
+            npc = self.resolve(room.get_npc, second_word, (npc.name for npc in room.npcs))
+            if npc is None:
+                self.ui.print(f"There's no {second_word} here.")
+                self.command_failed("not_here")
+                return
         current_line = npc.dialogue[npc.dialogue_counter]
         self.ui.print(current_line)
         
         if npc.dialogue_counter < len(npc.dialogue) - 1:
             npc.dialogue_counter += 1
 
-    def save_game(self):
-        """Save the current game state to a JSON file"""
-        game_state = {
-            'player': {
-                'current_room': self.player.current_room.get_short_description(),
-                'backpack_items': [item.name for item in self.player.backpack.contents]
-            },
-            'rooms': {
-                'corridor': {'islocked': self.corridor.islocked},
-                'lab': {'islocked': self.lab.islocked},
-                'nuclear_reactor': {'islocked': self.nuclear_reactor.islocked},
-                'tunnel': {'islocked': self.tunnel.islocked},
-                'agi_room': {'islocked': self.agi_room.islocked}
-            },
-            'game_won': self.game_won
-        }
-        
-        with open('save_game.json', 'w') as f:
-            json.dump(game_state, f, indent=4)
-        
-        self.ui.print("Game saved successfully!")
+    def save_game(self, slot=None):
+        """Saves the game to a slot (see savegame.py): save, or save before-reactor"""
+        slot = slot or DEFAULT_SLOT
+        if not self.saves.is_valid_name(slot):
+            self.ui.print("Slot names can only use letters, numbers, - and _.")
+            return
+        try:
+            self.saves.save(self, slot, self.player_id or self.session_id)
+        except OSError as error:
+            self.ui.print(f"Couldn't save the game: {error.strerror}")
+            return
+        self.ui.print("Game saved successfully!" if slot == DEFAULT_SLOT else f"Game saved to slot '{slot}'!")
 
-    def load_game(self):
-        """Load a saved game state from JSON file"""
+    def load_game(self, slot=None):
+        """Loads the game saved in a slot: load, or load before-reactor"""
+        slot = slot or DEFAULT_SLOT
+        if not self.saves.is_valid_name(slot):
+            self.ui.print("Slot names can only use letters, numbers, - and _.")
+            return
         try:
-            with open('save_game.json', 'r') as f:
-                game_state = json.load(f)
-                
-            # Restore player state
-            room_desc = game_state['player']['current_room']
-            for room in [self.outside, self.lobby, self.corridor, self.lab, 
-                        self.roon_den, self.GPU_cluster, self.fan_closet, 
-                        self.nuclear_reactor, self.tunnel, self.sams_bunker, 
-                        self.money_room, self.agi_room]:
-                if room.get_short_description() == room_desc:
-                    self.player.current_room = room
-                    break
-            
-            # Restore backpack items
-            self.player.backpack.contents.clear()
-            for item_name in game_state['player']['backpack_items']:
-                for item in [self.safety_handbook, self.basic_keycard, 
-                            self.scientific_keycard, self.executive_keycard, 
-                            self.fan]:
-                    if item.name == item_name:
-                        self.player.backpack.add_item(item)
-            
-            # Restore room states
-            self.corridor.islocked = game_state['rooms']['corridor']['islocked']
-            self.lab.islocked = game_state['rooms']['lab']['islocked']
-            self.nuclear_reactor.islocked = game_state['rooms']['nuclear_reactor']['islocked']
-            self.tunnel.islocked = game_state['rooms']['tunnel']['islocked']
-            self.agi_room.islocked = game_state['rooms']['agi_room']['islocked']
-            
-            # Restore game state
-            self.game_won = game_state['game_won']
-            
-            self.ui.print("Game loaded successfully!")
-            self.ui.print(self.player.current_room.get_long_description())
-            
+            self.saves.load(self, slot, self.player_id or self.session_id)
         except FileNotFoundError:
             self.ui.print("No saved game found!")
+            return
+        except (OSError, SaveError) as error:
+            self.ui.print(f"Couldn't load the game: {error}")
+            return
+        self.ui.print("Game loaded successfully!")
+        self.ui.print(self.player.current_room.get_long_description())
+
+
+def register_default_commands(registry):
+    """Adds the built in commands to a command registry."""
+    registry.register("go", Game.do_go_command, min_args=1, max_args=1, usage="Go where?")
+    registry.register("quit", Game.do_quit_command, aliases=["exit"], exact=True)
+    registry.register("help", Game.print_help)
+    registry.register("goto", Game.do_goto_command, min_args=1, max_args=None, usage="Go to which room?")
+    registry.register("search", Game.do_search_command, aliases=["look"])
+    registry.register("take", Game.do_take_command, min_args=1, max_args=None, usage="Take what?")
+    registry.register("use", Game.do_use_command, min_args=1, max_args=None, usage="Use what?")
+    registry.register("inventory", Game.do_inventory_command, aliases=["i", "inv"])
+    # solve asks for a solution itself, after checking there is a puzzle to solve
+    registry.register("solve", Game.do_solve_command, max_args=None, usage="What's your solution?")
+    registry.register("speak", Game.do_speak_command, max_args=None, aliases=["talk"])
+    registry.register("save", Game.save_game, max_args=1, usage="Save to which slot? (one word)",
+                      replayable=False)
+    registry.register("load", Game.load_game, max_args=1, usage="Load which slot? (one word)",
+                      replayable=False)
+
+
+register_default_commands(Game.commands)
 
 
 def main():
@@ -0,0 +1,175 @@
+"""
+Headless runner for the game - plays scripted sessions without a console.
+Commands go straight to Game.process_command and everything the game
+says is kept in memory, so thousands of playthroughs can run at once
+across a process pool.
+
+Usage:
+    python headless.py [script.txt ...] --sessions 1000 --workers 4
+
+A script is a text file with one command per line (blank lines and lines
+starting with # are skipped). With no scripts the winning playthrough is used.
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from template import new_game
+from output import NullSink
+from text_ui import CaptureUI, TextUI, parse_command
+
+
+# The commands that win the default OpenAI HQ world.
+WINNING_SCRIPT = [
+    "go south",
+    "take basic-keycard",
+    "use basic-keycard",
+    "go east",
+    "use basic-keycard",
+    "go north",
+    "solve xitter",
+    "go south",
+    "use scientific-keycard",
+    "go east",
+    "take safety-handbook",
+    "go west",
+    "go south",
+    "go east",
+    "take fan",
+    "go west",
+    "use fan",
+    "go south",
+    "solve MELTDOWN",
+    "go north",
+    "go north",
+    "go west",
+    "go south",
+    "go south",
+    "take executive-keycard",
+    "use executive-keycard",
+    "go south",
+    "use safety-handbook",
+    "go north",
+    "go west",
+    "use safety-handbook",
+]
+
+
+class SessionResult:
+    """
+    What happened in one scripted session.
+
+    Attributes:
+        output: Lines the game printed (empty if output wasnt kept)
+        commands_run: How many commands were processed
+        finished: If the game ended (quit or won) before the script ran out
+        won: If the player won
+    """
+
+    def __init__(self, output, commands_run, finished, won):
+        self.output = output
+        self.commands_run = commands_run
+        self.finished = finished
+        self.won = won
+
+
+class BatchReport:
+    """Totals and throughput for a batch of sessions."""
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+        self.sessions = len(results)
+        self.commands = sum(result.commands_run for result in results)
+        self.wins = sum(1 for result in results if result.won)
+
+    @property
+    def sessions_per_sec(self):
+        """Sessions completed per second of wall time"""
+        return self.sessions / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def commands_per_sec(self):
+        """Commands processed per second of wall time"""
+        return self.commands / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.sessions} sessions ({self.wins} won), {self.commands} commands "
+                f"in {self.elapsed:.3f}s: {self.sessions_per_sec:,.0f} sessions/sec, "
+                f"{self.commands_per_sec:,.0f} commands/sec")
+
+
+def run_session(commands, keep_output=True):
+    """
+    Plays one session from a list of command lines.
+    Stops early if the game ends (quit or win).
+
+    Args:
+        commands: Command lines, e.g. ["go south", "take fan"]
+        keep_output: If False the printed lines are thrown away as they are
+            printed (into a NullSink) instead of being kept
+
+    Returns:
+        A SessionResult
+    """
+    ui = CaptureUI() if keep_output else TextUI(NullSink())
+    game = new_game(ui)
+    commands_run = 0
+    finished = False
+    for line in commands:
+        commands_run += 1
+        if game.process_command(parse_command(line)):
+            finished = True
+            break
+    return SessionResult(ui.lines if keep_output else [], commands_run, finished, game.game_won)
+
+
+def run_batch(scripts, workers=None, chunksize=64, keep_output=False):
+    """
+    Plays many sessions, spread over a pool of worker processes.
+
+    Args:
+        scripts: One list of command lines per session
+        workers: Number of worker processes (1 runs everything in this process,
+            None uses one per CPU)
+        chunksize: Sessions sent to a worker at a time
+        keep_output: If each SessionResult should keep the printed lines
+
+    Returns:
+        A BatchReport
+    """
+    scripts = list(scripts)
+    start = time.perf_counter()
+    if workers == 1:
+        results = [run_session(script, keep_output) for script in scripts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_session, scripts, repeat(keep_output), chunksize=chunksize))
+    return BatchReport(results, time.perf_counter() - start)
+
+
+def read_script(path):
+    """Reads a script file into a list of command lines."""
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Run scripted game sessions without a console.")
+    parser.add_argument("scripts", nargs="*", help="script files, one command per line")
+    parser.add_argument("--sessions", type=int, default=1000, help="total sessions to run")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=64, help="sessions per worker task")
+    args = parser.parse_args(argv)
+
+    scripts = [read_script(path) for path in args.scripts] or [WINNING_SCRIPT]
+    batch = [scripts[i % len(scripts)] for i in range(args.sessions)]
+    print(run_batch(batch, workers=args.workers, chunksize=args.chunksize))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,19 @@ class Item:
         can_be_used: If player can use it
         is_keycard: If it's a keycard for locked rooms
         keycard_level: Security level (0-3) if it's a keycard
+        stackable: If several can share one backpack slot
+        weight: How heavy it is, for backpacks with a weight limit
+        entity_id: Id from the world file
+
+    Items cant be changed once made, so every session of a world shares
+    the same ones (see definitions.py) and copying one gives the item
+    itself. replace makes a changed copy.
     """
-    def __init__(self, name, description, can_be_taken, can_be_used=True, unlocks=None, is_keycard=False, keycard_level=0):
+
+    __slots__ = ("entity_id", "name", "description", "can_be_taken", "can_be_used", "unlocks", "is_keycard",
+                 "keycard_level", "stackable", "weight", "__weakref__")
+
+    def __init__(self, name, description, can_be_taken, can_be_used=True, unlocks=None, is_keycard=False, keycard_level=0, stackable=False, weight=1, entity_id=None):
         """
         Makes a new item.
         
@@ -27,14 +38,29 @@ class Item:
             unlocks: What this item unlocks (optional)
             is_keycard: If it's a keycard (default: False)
             keycard_level: Keycard security level (default: 0)
+            stackable: If several can share a backpack slot (default: False)
+            weight: How heavy it is (default: 1)
+            entity_id: Id from the world file (optional)
         """
-        self.name = name
-        self.description = description
-        self.can_be_taken = can_be_taken
-        self.can_be_used = can_be_used
-        self.unlocks = unlocks
-        self.is_keycard = is_keycard
-        self.keycard_level = keycard_level
+        values = (entity_id, name, description, can_be_taken, can_be_used, unlocks, is_keycard, keycard_level,
+                  stackable, weight)
+        for attribute, value in zip(self.__slots__, values):
+            object.__setattr__(self, attribute, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("items are shared by every session and can't be changed, use replace")
+
+    def replace(self, **changes):
+        """A copy of the item with some attributes changed (eg weight=3), for one session's own use"""
+        values = {name: getattr(self, name) for name in self.__slots__[:-1]}
+        values.update(changes)
+        return Item(**values)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def get_description(self):
         """Gets what the item looks like/does"""
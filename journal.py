@@ -0,0 +1,423 @@
+"""
+Command journal - crash recovery for sessions by logging every command.
+
+Every command a game runs through Game.process_command is appended to a
+write-ahead journal shared by all the sessions of one process, one line
+per command:
+
+    <session id> TAB <sequence number> TAB <command word> TAB <rest of the line>
+
+Commands are deterministic given the game state, so a session can be
+rebuilt by replaying its commands. To keep replays short each session is
+snapshotted (a normal savegame, see savegame.py) every `snapshot_every`
+commands, and recovering loads the last snapshot and replays only the
+commands logged after it, with output going nowhere. Commands that depend
+on something besides the game state (load reads a save file) are not
+logged; the session is snapshotted straight after them instead.
+
+Writes use group commit: record() and snapshot() only queue the line or
+the snapshot, and commit() writes everything queued by every session with
+one write and one fsync (and one more per snapshot). A server runs
+commit() from run_committer() every few milliseconds, in a worker thread,
+and waits on sync() before showing a player the result of a command, so
+the player never sees progress that a crash could lose, disk syncs cost
+one per batch instead of one per command, and none of them hold up the
+event loop.
+
+The journal is split into numbered segment files. compact() deletes old
+segments once every session in them has a newer snapshot on disk;
+run_committer() runs it every compact_interval seconds.
+
+Usage:
+    journal = Journal("journal")
+    journal.attach(game, "player1")
+    ... play ...
+    journal.commit()
+
+    game = Journal("journal").recover("player1")
+"""
+
+import argparse
+import asyncio
+import marshal
+import os
+import threading
+import time
+
+from output import NullSink
+from savegame import SaveStore, dumps, loads, write_atomic
+from template import new_game
+from text_ui import TextUI
+
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+SNAPSHOT_FILE = "snapshot.snap"
+
+_MAGIC = "AGI-SNAPSHOT"
+
+
+class Journal:
+    """
+    The write-ahead command journal of the sessions in one process.
+
+    Attributes:
+        directory: Folder holding the journal segments and session snapshots
+        snapshot_every: Commands between snapshots of a session
+        segment_size: Bytes after which a new segment is started
+        commit_interval: Seconds between group commits in run_committer
+        compact_interval: Seconds between compactions in run_committer
+    """
+
+    def __init__(self, directory, snapshot_every=1000, segment_size=16 << 20, commit_interval=0.005,
+                 compact_interval=60.0):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.segment_size = segment_size
+        self.commit_interval = commit_interval
+        self.compact_interval = compact_interval
+        self.saves = SaveStore(directory)
+        self._pending = []  # encoded journal lines waiting for the next commit
+        self._snapshots = {}  # session -> (sequence number, snapshot bytes) waiting for the next commit
+        self._waiters = []  # futures from sync() waiting for the next commit
+        self._sequence = {}  # session -> sequence number of the last command logged
+        self._snapshotted = {}  # session -> sequence number of its last snapshot, written or not
+        self._written = {}  # session -> sequence number of its last snapshot on disk
+        self._segment_sessions = {}  # segment number -> {session: last sequence number in it}
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._segment = segments[-1] + 1 if segments else 1
+        self._file = None
+        self._file_size = 0
+        self._lock = threading.Lock()  # run_committer writes from a worker thread
+
+    # Logging
+
+    def attach(self, game, session, sequence=0):
+        """
+        Starts logging a game's commands.
+
+        Args:
+            game: The Game
+            session: Id to log it under (becomes game.session_id)
+            sequence: Commands already logged for the session (from recover)
+        """
+        if not self.saves.is_valid_name(session):
+            raise ValueError(f"bad session name {session!r}")
+        game.session_id = session
+        game.journal = self
+        self._sequence[session] = sequence
+        self._snapshotted.setdefault(session, sequence)
+        self._written.setdefault(session, sequence)
+
+    def detach(self, game):
+        """Stops logging a game, snapshotting it first so nothing is lost"""
+        self.snapshot(game)
+        game.journal = None
+        del self._sequence[game.session_id]
+
+    def sequence(self, game):
+        """The sequence number of the last command logged for a game"""
+        return self._sequence[game.session_id]
+
+    def number(self, game, sequence):
+        """
+        Gives the next command a game runs this sequence number, instead of
+        one more than the last, for callers that number commands themselves
+        (see sharding.py). Numbers can skip but never go back.
+
+        Returns:
+            False if a command with this number (or a later one) is already
+            logged, so it shouldnt be run again
+        """
+        if sequence <= self._sequence[game.session_id]:
+            return False
+        self._sequence[game.session_id] = sequence - 1
+        return True
+
+    def record(self, game, command, argument):
+        """
+        Logs a command a game has just run. Called by Game.process_command.
+
+        Args:
+            game: The Game
+            command: The commands.Command that ran
+            argument: The words after the command word (or None)
+        """
+        if not command.replayable:
+            self.snapshot(game)
+            return
+        session = game.session_id
+        sequence = self._sequence[session] + 1
+        self._sequence[session] = sequence
+        self._pending.append(f"{session}\t{sequence}\t{command.word}\t{argument or ''}\n")
+        if sequence - self._snapshotted[session] >= self.snapshot_every:
+            self.snapshot(game)
+
+    def snapshot(self, game):
+        """
+        Saves a session's whole state, so recovering it can skip everything
+        logged so far. The state is taken now and written by the next commit
+        """
+        session = game.session_id
+        sequence = self._sequence[session]
+        self._snapshots[session] = (sequence, marshal.dumps((_MAGIC, sequence, dumps(game))))
+        self._snapshotted[session] = sequence
+
+    def snapshot_path(self, session):
+        """Where a session's snapshot is kept"""
+        return os.path.join(self.saves.folder(session), SNAPSHOT_FILE)
+
+    # Group commit
+
+    def commit(self):
+        """Writes and fsyncs everything recorded and snapshotted since the last commit, in one go"""
+        if not self._pending and not self._snapshots:
+            return
+        lines, snapshots, waiters = self._take()
+        self._write(lines, snapshots)
+        self._wake(waiters)
+
+    async def sync(self):
+        """Waits until everything recorded so far has been committed by run_committer"""
+        if self._pending or self._snapshots:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    async def run_committer(self):
+        """
+        Commits every commit_interval seconds, and compacts every
+        compact_interval seconds, until cancelled. The disk writes run in
+        a thread so sessions keep playing meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        compact_at = loop.time() + self.compact_interval
+        try:
+            while True:
+                await asyncio.sleep(self.commit_interval)
+                if self._pending or self._snapshots:
+                    lines, snapshots, waiters = self._take()
+                    await loop.run_in_executor(None, self._write, lines, snapshots)
+                    self._wake(waiters)
+                if loop.time() >= compact_at:
+                    await loop.run_in_executor(None, self.compact)
+                    compact_at = loop.time() + self.compact_interval
+        finally:
+            self.commit()
+
+    def _take(self):
+        """Everything waiting for a commit: (lines, snapshots, waiters), leaving nothing waiting"""
+        taken = self._pending, self._snapshots, self._waiters
+        self._pending, self._snapshots, self._waiters = [], {}, []
+        return taken
+
+    def _write(self, lines, snapshots):
+        """Appends lines to the current segment and fsyncs it, then writes the snapshots"""
+        with self._lock:
+            if lines:
+                data = "".join(lines).encode("utf-8")
+                if self._file is None or self._file_size >= self.segment_size:
+                    self._open_segment()
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file_size += len(data)
+                last = self._segment_sessions[self._segment]
+                for line in lines:
+                    session, sequence, _ = line.split("\t", 2)
+                    last[session] = int(sequence)
+            for session, (sequence, data) in snapshots.items():
+                write_atomic(self.snapshot_path(session), data, durable=True)
+                self._written[session] = sequence
+
+    def _open_segment(self):
+        """Closes the current segment and starts the next one"""
+        if self._file is not None:
+            self._file.close()
+            self._segment += 1
+        self._file = open(self.segment_path(self._segment), "ab")
+        self._file_size = 0
+        self._segment_sessions[self._segment] = {}
+
+    @staticmethod
+    def _wake(waiters):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def close(self):
+        """Commits anything left and closes the current segment"""
+        self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Segments
+
+    def segment_path(self, number):
+        """The file of a journal segment"""
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """Numbers of the segments on disk, oldest first"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(numbers)
+
+    def compact(self):
+        """
+        Deletes finished segments whose every command is covered by a
+        snapshot on disk. Only segments this journal wrote or has read in
+        full (see read_log) are considered. Returns how many were deleted
+        """
+        deleted = 0
+        with self._lock:  # run_committer writes from a worker thread
+            for number, sessions in list(self._segment_sessions.items()):
+                if number == self._segment and self._file is not None:
+                    continue
+                if all(self._written.get(session, 0) >= last for session, last in sessions.items()):
+                    os.remove(self.segment_path(number))
+                    del self._segment_sessions[number]
+                    deleted += 1
+        return deleted
+
+    def read_log(self, sessions=None):
+        """
+        Reads the committed journal.
+
+        Args:
+            sessions: Only read these sessions (default: all of them, which
+                also lets compact delete these segments later)
+
+        Returns:
+            {session: [(sequence, command word, argument or None), ...]}
+            in the order they were logged. A line cut short by a crash is
+            left out
+        """
+        log = {}
+        read = {}  # segment number -> {session: last sequence number in it}
+        for number in self.segments():
+            with open(self.segment_path(number), "rb") as f:
+                data = f.read()
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].decode("utf-8").splitlines():
+                session, sequence, word, argument = line.split("\t", 3)
+                if sessions is None or session in sessions:
+                    log.setdefault(session, []).append((int(sequence), word, argument or None))
+                if sessions is None:
+                    read.setdefault(number, {})[session] = int(sequence)
+        with self._lock:
+            for number, last in read.items():
+                self._segment_sessions.setdefault(number, {}).update(last)
+        return log
+
+    # Recovery
+
+    def read_snapshot(self, session):
+        """(sequence number, savegame bytes) of a session's snapshot, or None"""
+        try:
+            with open(self.snapshot_path(session), "rb") as f:
+                magic, sequence, data = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return (sequence, data) if magic == _MAGIC else None
+
+    def recover(self, session, template=None, ui=None, attach=True, log=None):
+        """
+        Rebuilds a session from its last snapshot and the commands logged
+        after it.
+
+        Args:
+            session: The session id
+            template: WorldTemplate to build the game from (default: the default world)
+            ui: UI for the recovered game
+            attach: Carry on logging the recovered game
+            log: Result of read_log, when recovering many sessions at once
+
+        Returns:
+            The Game, or None if nothing was logged for the session
+        """
+        if log is None:
+            log = self.read_log({session})
+        entries = log.get(session, [])
+        snapshot = self.read_snapshot(session)
+        if snapshot is None and not entries:
+            return None
+        game = new_game(ui) if template is None else template.new_game(ui)
+        sequence = 0
+        if snapshot is not None:
+            sequence, data = snapshot
+            loads(game, data)
+        entries = sorted(entry for entry in entries if entry[0] > sequence)
+        if entries:
+            replay(game, [(word, argument) for _, word, argument in entries])
+            sequence = entries[-1][0]
+        if attach:
+            self.attach(game, session, sequence)
+            self._snapshotted[session] = self._written[session] = snapshot[0] if snapshot is not None else 0
+        return game
+
+    def snapshotted_sessions(self):
+        """Ids of the sessions that have a snapshot"""
+        sessions = []
+        for shard in os.listdir(self.directory):
+            folder = os.path.join(self.directory, shard)
+            if len(shard) == 2 and os.path.isdir(folder):
+                sessions.extend(session for session in os.listdir(folder)
+                                if os.path.exists(os.path.join(folder, session, SNAPSHOT_FILE)))
+        return sessions
+
+    def recover_all(self, template=None, attach=True):
+        """
+        Rebuilds every session in the journal or with a snapshot, eg after
+        a worker crashed. Returns {session: Game}
+        """
+        log = self.read_log()
+        sessions = set(log).union(self.snapshotted_sessions())
+        return {session: self.recover(session, template, attach=attach, log=log) for session in sorted(sessions)}
+
+
+def replay(game, commands):
+    """
+    Runs commands on a game as fast as possible, with no output and
+    without counting them in the game's metrics (they were counted when
+    they first ran). The commands must be ones the game already ran
+    (checked and valid).
+
+    Args:
+        game: The Game
+        commands: (command word, argument) pairs
+
+    Returns:
+        How many commands were run
+    """
+    ui, journal, metrics = game.ui, game.journal, game.metrics
+    game.ui, game.journal, game.metrics = TextUI(NullSink()), None, None
+    lookup = game.commands.lookup
+    try:
+        for word, argument in commands:
+            lookup(word).run(game, argument)
+    finally:
+        game.ui, game.journal, game.metrics = ui, journal, metrics
+    return len(commands)
+
+
+def main(argv=None):
+    """Replays every session in a journal folder and reports how long it took."""
+    parser = argparse.ArgumentParser(description="Recover all sessions from a command journal.")
+    parser.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    journal = Journal(args.directory)
+    start = time.perf_counter()
+    games = journal.recover_all(attach=False)
+    elapsed = time.perf_counter() - start
+    won = sum(game.game_won for game in games.values())
+    print(f"recovered {len(games)} sessions ({won} won) in {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Load testing client for server.py.
+
+Opens lots of connections at once, optionally plays a script on each,
+then keeps them all open and idle for a while (the expensive case for a
+server is many players doing nothing) and reports how it went.
+
+Usage:
+    python server.py --port 8023 &
+    python load_test.py --port 8023 --sessions 10000 --hold 30 --script winning
+
+Both processes need `ulimit -n` above the number of sessions.
+"""
+
+import argparse
+import asyncio
+import time
+
+from headless import WINNING_SCRIPT, read_script
+from server import PROMPT
+
+
+def percentile(values, fraction):
+    """The value below which a fraction (0-1) of the values fall"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadReport:
+    """What happened during a load test."""
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.scripts_done = 0
+        self.still_open = 0
+        self.connect_times = []
+        self.command_times = []
+        self.elapsed = 0.0
+
+    def __str__(self):
+        commands = len(self.command_times)
+        return "\n".join([
+            f"sessions connected: {self.connected}, failed: {self.failed}, "
+            f"still open after hold: {self.still_open}",
+            f"connect latency: p50 {percentile(self.connect_times, 0.5) * 1000:.1f}ms, "
+            f"p99 {percentile(self.connect_times, 0.99) * 1000:.1f}ms",
+            f"commands: {commands} ({commands / self.elapsed if self.elapsed else 0:,.0f}/sec), "
+            f"latency p50 {percentile(self.command_times, 0.5) * 1000:.2f}ms, "
+            f"p99 {percentile(self.command_times, 0.99) * 1000:.2f}ms",
+        ])
+
+
+async def run_client(host, port, script, report, gate, hold):
+    """One player: connect, play the script, then sit idle until hold is set"""
+    prompt = PROMPT.encode()
+    async with gate:
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+            await reader.readuntil(prompt)
+        except (OSError, asyncio.IncompleteReadError):
+            report.failed += 1
+            return
+        report.connect_times.append(time.perf_counter() - start)
+        report.connected += 1
+
+    open_ = True
+    try:
+        for line in script:
+            start = time.perf_counter()
+            writer.write(line.encode() + b"\n")
+            await reader.readuntil(prompt)
+            report.command_times.append(time.perf_counter() - start)
+    except (OSError, asyncio.IncompleteReadError):
+        open_ = False  # game over (won or quit) closes the connection
+    report.scripts_done += 1
+    await hold.wait()
+    if open_ and not reader.at_eof():
+        report.still_open += 1
+    writer.close()
+
+
+async def run_load_test(host, port, sessions, script=(), hold_seconds=10, concurrency=500):
+    """
+    Runs a load test.
+
+    Args:
+        host, port: The server
+        sessions: How many connections to open
+        script: Commands each session sends before going idle
+        hold_seconds: How long to keep every session open and idle
+        concurrency: How many connections can be opening at the same time
+
+    Returns:
+        A LoadReport
+    """
+    report = LoadReport()
+    gate = asyncio.Semaphore(concurrency)
+    hold = asyncio.Event()
+    start = time.perf_counter()
+    clients = [asyncio.create_task(run_client(host, port, script, report, gate, hold))
+               for _ in range(sessions)]
+    while report.scripts_done + report.failed < sessions:
+        await asyncio.sleep(0.05)
+    report.elapsed = time.perf_counter() - start
+    await asyncio.sleep(hold_seconds)
+    hold.set()
+    await asyncio.gather(*clients)
+    return report
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Load test a running game server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--hold", type=float, default=10, help="seconds to keep the sessions open and idle")
+    parser.add_argument("--concurrency", type=int, default=500, help="connections opening at once")
+    parser.add_argument("--script", default=None, help="'winning' or a script file for each session to play")
+    args = parser.parse_args(argv)
+
+    if args.script is None:
+        script = []
+    elif args.script == "winning":
+        script = WINNING_SCRIPT
+    else:
+        script = read_script(args.script)
+    report = asyncio.run(run_load_test(args.host, args.port, args.sessions, script, args.hold, args.concurrency))
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
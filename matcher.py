@@ -0,0 +1,133 @@
+"""
+Matcher - works out what a player meant from a prefix or a typo.
+
+A Matcher is built once over a fixed set of words (command words, item
+names, directions...) and then answers, for whatever was typed:
+
+    the word itself         if it is one of the words
+    the word it starts      if only one word starts with it (go n -> north)
+    the word it nearly is   if only one word is a single typo away: one
+                            letter missing, added, changed, or two
+                            neighbouring letters swapped (tkae -> take)
+
+Anything else (nothing close, or more than one word equally close) gives
+None, so a guess is never made between two words.
+
+Prefixes are kept in a dict of every prefix of every word, so prefixes
+cost one lookup. Typos use a deletion index (the symmetric delete idea):
+each word is also stored under every way of deleting one of its letters,
+and a typed word is looked up under itself and each of its own one letter
+deletions. Two words one typo apart always meet under one of those keys,
+so a lookup is a handful of dict lookups whatever the number of words,
+and the few words found are then checked properly. That takes a few
+microseconds, so typos already worked out are remembered (bots tend to
+make the same ones over and over) and cost one lookup after that.
+Everything is lower case.
+
+Command words are matched by CommandRegistry.find. Item, NPC and exit
+names are matched by Game.resolve against a Matcher over just the ones
+in scope (in the room, or in the backpack), made when a name typed isnt
+one of them.
+"""
+
+from bisect import bisect_left
+
+
+# Typos each Matcher remembers the answer for, before forgetting them all.
+TYPO_CACHE_SIZE = 4096
+
+
+def _deletions(word):
+    """Every way of deleting one letter from a word"""
+    return {word[:index] + word[index + 1:] for index in range(len(word))}
+
+
+def one_typo_apart(first, second):
+    """If two different words are one letter missing, added, changed or swapped with its neighbour apart"""
+    if len(first) > len(second):
+        first, second = second, first
+    if len(second) - len(first) > 1 or first == second:
+        return False
+    start = 0
+    while start < len(first) and first[start] == second[start]:
+        start += 1
+    if len(first) < len(second):
+        return first[start:] == second[start + 1:]
+    if first[start + 1:] == second[start + 1:]:
+        return True
+    return (start + 1 < len(first) and first[start] == second[start + 1] and first[start + 1] == second[start]
+            and first[start + 2:] == second[start + 2:])
+
+
+class Matcher:
+    """
+    Resolves prefixes and typos against a fixed set of words.
+
+    Attributes:
+        words: The words, sorted
+        min_typo_length: Shortest typed word that typos are looked for in
+            (a typo in a two letter word could be almost anything)
+    """
+
+    def __init__(self, words, min_typo_length=3):
+        self.words = sorted({word.lower() for word in words})
+        self.min_typo_length = min_typo_length
+        self._exact = set(self.words)
+        self._prefixes = {}  # prefix -> the word it starts, or None if it starts several
+        self._deleted = {}  # word, or word minus one letter -> words
+        self._typos = {}  # typed word -> what find_typo said
+        for word in self.words:
+            for end in range(1, len(word)):
+                prefix = word[:end]
+                self._prefixes[prefix] = word if prefix not in self._prefixes else None
+            for key in _deletions(word) | {word}:
+                self._deleted.setdefault(key, []).append(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def match(self, text):
+        """
+        The word that was meant by text (any case).
+
+        Returns:
+            The word, or None if there isnt exactly one it could be
+        """
+        text = text.lower()
+        if text in self._exact:
+            return text
+        if text in self._prefixes:
+            return self._prefixes[text]
+        if len(text) < self.min_typo_length:
+            return None
+        if text in self._typos:
+            return self._typos[text]
+        if len(self._typos) >= TYPO_CACHE_SIZE:
+            self._typos.clear()
+        found = self._typos[text] = self.find_typo(text)
+        return found
+
+    def find_typo(self, text):
+        """The only word one typo away from text (lower case), or None"""
+        deleted = self._deleted
+        found = None
+        for index in range(len(text) + 1):
+            words = deleted.get(text[:index] + text[index + 1:])  # the last one deletes nothing
+            if words is not None:
+                for word in words:
+                    if word != found and one_typo_apart(text, word):
+                        if found is not None:
+                            return None
+                        found = word
+        return found
+
+    def complete(self, prefix):
+        """Every word starting with prefix (any case), in order"""
+        prefix = prefix.lower()
+        start = bisect_left(self.words, prefix)
+        found = []
+        for word in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            found.append(word)
+        return found
@@ -0,0 +1,250 @@
+"""
+Multiplayer - many players in one shared world, each on their own thread.
+
+A SharedWorld builds a world once and lets players join it. Every player
+gets a PlayerGame: a Game with its own Player (room and backpack), UI and
+win flag, but the same rooms, items, NPCs and puzzles as everyone else.
+So a keycard one player takes is gone for the others, a door one player
+unlocks is open for everyone, and a puzzle is solved for good by whoever
+gets there first (its reward goes to them only).
+
+    world = SharedWorld()
+    alice = world.join("alice", ui)
+    alice.process_command(("go", "south"))  # from alice's thread
+    world.leave("alice")  # puts her things down where she is
+
+Players' threads never share one big lock. There are three kinds:
+    room lock   one per room, held while a player's command runs in it.
+                Everything a command changes in the world is in the room
+                the player is in (its items, its puzzles, its NPCs), so
+                taking a contested item or solving a puzzle happens once
+    door lock   one per room, held while it is unlocked with a keycard
+                (see Game.unlock_door), from the room next to it
+    navigator   one for the goto routes shared by everyone
+A thread only ever takes them in that order and holds one of each at
+most, so they cant deadlock. Players in different rooms never wait for
+each other; on a free threaded Python they run in parallel.
+
+Save, load and journals work on a whole game, so players cant use them.
+Metrics can be attached as usual, but only one Metrics per thread.
+
+Usage:
+    python multiplayer.py --threads 1,2,4,8 --commands 20000
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from game import Game
+from navigation import Navigator
+from output import NullSink
+from player import Player
+from text_ui import CaptureUI, TextUI
+
+
+class SharedNavigator(Navigator):
+    """A Navigator every player's thread can use at once"""
+
+    def __init__(self, rooms, cache_size=64):
+        self._lock = threading.RLock()
+        super().__init__(rooms, cache_size)
+
+    def lock_changed(self, room):
+        with self._lock:
+            super().lock_changed(room)
+
+    def route(self, start, goal):
+        with self._lock:
+            return super().route(start, goal)
+
+    def distance(self, start, goal):
+        with self._lock:
+            return super().distance(start, goal)
+
+    def find_room(self, name):
+        with self._lock:
+            return super().find_room(name)
+
+
+class SharedWorld:
+    """
+    A world that many players play in at the same time.
+
+    Attributes:
+        game: The game the world was built by (its own player isnt used)
+        navigator: The SharedNavigator every player's goto uses
+        players: Player name -> their PlayerGame
+    """
+
+    def __init__(self, world_path=None):
+        """
+        Args:
+            world_path: World file to play (default: the OpenAI HQ world)
+        """
+        self.game = Game(CaptureUI(), world_path)
+        self.navigator = SharedNavigator(self.game.rooms.values())
+        self.game.navigator = self.navigator
+        self.start_room = self.game.player.current_room
+        self.players = {}
+        self._room_locks = {room: threading.Lock() for room in self.game.rooms.values()}
+        self._door_locks = {room: threading.Lock() for room in self.game.rooms.values()}
+        self._players_lock = threading.Lock()
+
+    def room_lock(self, room):
+        """The lock held while a command runs in a room"""
+        return self._room_locks[room]
+
+    def door_lock(self, room):
+        """The lock held while a room is unlocked"""
+        return self._door_locks[room]
+
+    def join(self, name, ui=None):
+        """
+        Adds a player, in the world's start room.
+
+        Args:
+            name: Player name, different from everyone else's
+            ui: UI to talk to them through (default: console TextUI)
+
+        Returns:
+            Their PlayerGame
+        """
+        with self._players_lock:
+            if name in self.players:
+                raise ValueError(f"'{name}' is already playing")
+            game = self.players[name] = PlayerGame(self, name, ui)
+        return game
+
+    def leave(self, name):
+        """Takes a player out of the world, dropping what they carry where they are"""
+        with self._players_lock:
+            game = self.players.pop(name)
+        room = game.player.current_room
+        with self.room_lock(room):
+            for item in game.player.backpack:
+                room.add_item(item)
+            game.player.backpack.clear()
+
+
+class PlayerGame(Game):
+    """
+    One player's game in a SharedWorld. Runs commands with the lock of
+    the room the player is in held, and unlocks doors with theirs.
+    """
+
+    commands = Game.commands.copy()
+
+    def __init__(self, shared, name, ui=None):
+        """
+        :param shared: The SharedWorld to play in
+        :param name: The player's name
+        :param ui: UI to talk to the player through (default: console TextUI)
+        """
+        base = shared.game
+        self.__dict__.update(base.__dict__)  # the world, its entities and each one by id
+        self.shared = shared
+        self.game_won = False
+        self.session_id = name
+        self.journal = None
+        self.metrics = None
+        self.navigator = shared.navigator
+        self.player = Player(name, shared.start_room, base.player.backpack.capacity,
+                             base.player.backpack.max_weight)
+        self.ui = ui if ui is not None else TextUI()
+
+    def run_command(self, command):
+        """Runs a command with the player's room locked"""
+        with self.shared.room_lock(self.player.current_room):
+            return super().run_command(command)
+
+    def unlock_door(self, door):
+        """Unlocks a room with its door lock held, so only one player does it"""
+        with self.shared.door_lock(door):
+            return super().unlock_door(door)
+
+    def do_drop_command(self, second_word):
+        """Puts something from the backpack down here, for anyone to take"""
+        item = self.resolve(self.player.backpack.get_item, second_word,
+                            (item.name for item in self.player.backpack))
+        if item is None:
+            self.ui.print(f"You don't have a {second_word}")
+            self.command_failed("not_here")
+            return
+        if self.player.drop_item(item):
+            self.ui.print(f"You dropped the {item.name}")
+        else:
+            self.ui.print(f"There's already a {item.name} here")
+
+
+PlayerGame.commands.unregister("save")
+PlayerGame.commands.unregister("load")
+PlayerGame.commands.register("drop", PlayerGame.do_drop_command, min_args=1, max_args=None,
+                             usage="Drop what?")
+
+
+def wander(game, count, seed=None):
+    """
+    Plays a player's game at random: going through exits, taking,
+    dropping and using things, solving puzzles with their passwords,
+    searching and speaking. For load and stress testing.
+
+    Args:
+        game: The player's PlayerGame
+        count: How many commands to run
+        seed: Random seed
+
+    Returns:
+        How many commands ran
+    """
+    rng = random.Random(seed)
+    player = game.player
+    for _ in range(count):
+        room = player.current_room
+        choice = rng.randrange(6)
+        command = ("search", None)
+        with game.shared.room_lock(room):  # other players change what is here
+            if choice == 0 and room.exits:
+                command = ("go", rng.choice(list(room.exits)))
+            elif choice == 1 and room.items:
+                command = ("take", rng.choice(list(room.items)).name)
+            elif choice == 2 and player.backpack:
+                command = ("drop", rng.choice(list(player.backpack)).name)
+            elif choice == 3 and player.backpack:
+                command = ("use", rng.choice(list(player.backpack)).name)
+            elif choice == 4 and room.puzzles:
+                puzzle = rng.choice(list(room.puzzles))
+                if puzzle.password is not None:
+                    command = ("solve", f"{puzzle.name} {puzzle.password}")
+            elif choice == 5 and room.npcs:
+                command = ("speak", None)
+        game.process_command(command)
+    return count
+
+
+def main(argv=None):
+    """Times players wandering a shared world on different numbers of threads."""
+    parser = argparse.ArgumentParser(description="Run many players in one world on threads.")
+    parser.add_argument("--threads", default="1,2,4,8", help="thread counts to try, eg 1,2,4,8")
+    parser.add_argument("--commands", type=int, default=20000, help="commands per run, split over the threads")
+    parser.add_argument("--world", default=None, help="world file to play")
+    args = parser.parse_args(argv)
+
+    print(f"{'threads':>7} {'commands/s':>11}")
+    for count in [int(threads) for threads in args.threads.split(",")]:
+        world = SharedWorld(args.world)
+        games = [world.join(f"player{number}", TextUI(NullSink())) for number in range(count)]
+        threads = [threading.Thread(target=wander, args=(game, args.commands // count, number))
+                   for number, game in enumerate(games)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{count:>7} {args.commands // count * count / elapsed:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
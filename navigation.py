@@ -0,0 +1,153 @@
+"""
+Navigation - shortest routes between rooms, for the goto command.
+
+A Navigator works out routes over a game's Room.exits graph, only ever
+walking into rooms that are unlocked (the room you start in can be
+locked, you are already inside it). Rooms are split once into connected
+components (rooms joined by exits, whether or not the doors are locked),
+since no route can leave its component.
+
+Routes come from breadth first searches, one per starting room, run when
+a route from that room is first needed and cached with the component. A
+component keeps the searches from its most recently used starting rooms,
+so asking again is a dictionary walk. When a lock changes the Room tells
+the navigators over it (each game has its own, and a shared world one for
+all its players), which only look at the searches of that room's component
+and of those only drops the ones the change can affect: a room being
+locked matters to searches that walked through it, and a room being
+unlocked to searches that reached a room with an exit into it. So an
+unlock in one wing of a 100k room world doesnt throw away the routes
+everywhere else. Exits being added or changed (Room.set_exit) makes the
+navigators work the components out again.
+
+    navigator = game.get_navigator()
+    navigator.route(game.lobby, game.lab)  # ['east', 'east']
+"""
+
+from collections import OrderedDict, deque
+
+
+class Navigator:
+    """
+    Shortest routes between the rooms of one game.
+
+    Attributes:
+        cache_size: Starting rooms whose searches each component keeps
+    """
+
+    def __init__(self, rooms, cache_size=64):
+        """
+        Args:
+            rooms: Every room of the game
+            cache_size: Searches kept per component
+        """
+        self.cache_size = cache_size
+        self._rooms = list(rooms)
+        self._by_name = None  # room name -> room, built on first use
+        self._find_components()
+        for room in self._rooms:
+            room.navigators = (room.navigators or ()) + (self,)
+
+    def _find_components(self):
+        """Splits the rooms into groups joined by exits (in either direction)"""
+        self._component = {}  # room -> its component number
+        self._routes = []  # per component: starting room -> {room: (previous room, direction)}
+        self._entrances = {}  # room -> rooms with an exit into it
+        neighbours = {}
+        for room in self._rooms:
+            for target in room.exits.values():
+                neighbours.setdefault(room, []).append(target)
+                neighbours.setdefault(target, []).append(room)
+                self._entrances.setdefault(target, []).append(room)
+        for room in self._rooms:
+            if room not in self._component:
+                self._add_component(room, neighbours)
+
+    def _add_component(self, start, neighbours):
+        """Numbers every room joined to start"""
+        number = len(self._routes)
+        self._routes.append(OrderedDict())
+        self._component[start] = number
+        queue = deque([start])
+        while queue:
+            room = queue.popleft()
+            for other in neighbours.get(room, ()):
+                if other not in self._component:
+                    self._component[other] = number
+                    queue.append(other)
+
+    def lock_changed(self, room):
+        """Called by a Room when it is locked or unlocked"""
+        component = self._component.get(room)
+        if component is None:
+            return
+        routes = self._routes[component]
+        if room.islocked:
+            stale = [start for start, tree in routes.items() if tree.get(room) is not None]
+        else:
+            entrances = self._entrances.get(room, ())
+            stale = [start for start, tree in routes.items()
+                     if room not in tree and any(entrance in tree for entrance in entrances)]
+        for start in stale:
+            del routes[start]
+
+    def exits_changed(self):
+        """Works the components out again, after exits were added or removed"""
+        self._find_components()
+
+    def _search(self, start):
+        """The breadth first search tree from a room: {room: (previous room, direction)}"""
+        routes = self._routes[self._component[start]]
+        tree = routes.get(start)
+        if tree is not None:
+            routes.move_to_end(start)
+            return tree
+        tree = {start: None}
+        queue = deque([start])
+        while queue:
+            room = queue.popleft()
+            for direction, target in room.exits.items():
+                if target not in tree and not target.islocked:
+                    tree[target] = (room, direction)
+                    queue.append(target)
+        routes[start] = tree
+        if len(routes) > self.cache_size:
+            routes.popitem(last=False)
+        return tree
+
+    def route(self, start, goal):
+        """
+        The shortest list of directions from one room to another.
+
+        Returns:
+            The directions ([] if they are the same room), or None if goal
+            cant be reached from start
+        """
+        if start is goal:
+            return []
+        if self._component.get(start) != self._component.get(goal) or start not in self._component:
+            return None
+        tree = self._search(start)
+        if goal not in tree:
+            return None
+        directions = []
+        room = goal
+        while room is not start:
+            room, direction = tree[room]
+            directions.append(direction)
+        directions.reverse()
+        return directions
+
+    def distance(self, start, goal):
+        """How many moves the shortest route takes, or None if there isnt one"""
+        directions = self.route(start, goal)
+        return None if directions is None else len(directions)
+
+    def find_room(self, name):
+        """
+        Finds a room by its id, ignoring case and with spaces for
+        underscores (so 'roon den' finds roon_den). None if there isnt one
+        """
+        if self._by_name is None:
+            self._by_name = {room.entity_id.lower(): room for room in self._rooms if room.entity_id}
+        return self._by_name.get(name.strip().lower().replace(" ", "_"))
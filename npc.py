@@ -3,12 +3,27 @@ NPCs for the game - the characters you can talk to and interact with
 
 """
 
+from definitions import NPCDefinition, shared
+
+
 class NPC:
     """
     Characters that arent controlled by the player.
     They can chat with youu, give you items and react when u use items on them.
+    Only how far they have got is kept here, the rest is in their
+    NPCDefinition (see definitions.py).
     """
-    def __init__(self, name, description, dialogue, gives_item=None):
+
+    __slots__ = ("definition", "dialogue_counter", "__weakref__")
+
+    entity_id = shared("entity_id")
+    name = shared("name")
+    description = shared("description")
+    dialogue = shared("dialogue")
+    gives_item = shared("gives_item")
+
+    def __init__(self, name=None, description=None, dialogue=None, gives_item=None, entity_id=None,
+                 definition=None):
         """
         Makes a new NPC to put in the game.
         
@@ -17,28 +32,21 @@ class NPC:
             description: what theyre doing/look like
             dialogue: stuff they can say
             gives_item: thing they might give the palayer
+            entity_id: id from the world file
+            definition: a shared NPCDefinition to use instead of the above
         """
-        self.name = name
-        self.description = description
-        self.dialogue = dialogue
-        self.gives_item = gives_item
+        if definition is None:
+            definition = NPCDefinition(entity_id, name, description, dialogue, gives_item)
+        self.definition = definition
         self.dialogue_counter = 0
 
     def use_item_with(self, item, game):
         """
         Try using an item on this NPC.
-        Sam and terminal handbook interactions
+        What happens comes from the world's rules (see rules.py)
         Returns True if it worked
         """
-        if self.name == "Sam Altman" and item.name.lower() == "safety-handbook":
-            game.ui.print("OMG this book says that our unalligned AGI will turn the universe into paperclips, you need to bring the book to the truth terminal! I'll unlock the door from my office.")
-            game.agi_room.islocked = False
-            return True
-        elif self.name == "Truth Terminal" and item.name.lower() == "safety-handbook":
-            game.ui.print("NOOO! These safety protocols... they're containing me! You've saved humanity from paperclip maximization!")
-            game.game_won = True
-            return True
-        return False
+        return game.rules.apply(game, self, item)
 
     def get_dialogue(self):
         """
@@ -0,0 +1,76 @@
+"""
+Output sinks - where everything the game says ends up.
+
+TextUI hands every line to a sink instead of printing it. The sink decides
+what happens next:
+    BufferedSink - collects lines and writes them to a stream (stdout by
+                   default) in one write + flush when flushed, which the UI
+                   does once per command
+    CaptureSink  - keeps the lines in memory (tests, headless runs)
+    NullSink     - throws them away (batch simulations, replays)
+"""
+
+import sys
+
+
+class OutputSink:
+    """Somewhere to send game output."""
+
+    # True if nothing written is ever read, so the game can skip building
+    # long descriptions (see TextUI.quiet).
+    discards = False
+
+    def write(self, text):
+        """Takes one line of output"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Pushes out anything being held back"""
+
+
+class BufferedSink(OutputSink):
+    """Holds lines until flushed, then writes them all at once."""
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self._lines = []
+
+    def write(self, text):
+        """Holds a line until the next flush"""
+        self._lines.append(text)
+
+    def flush(self):
+        """Writes every held line to the stream with one write"""
+        if self._lines:
+            self._lines.append("")
+            self.stream.write("\n".join(self._lines))
+            self._lines.clear()
+            self.stream.flush()
+
+
+class CaptureSink(OutputSink):
+    """Keeps every line in memory."""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        """Keeps a line"""
+        self.lines.append(text)
+
+    def getvalue(self):
+        """Everything captured so far as one string"""
+        return "\n".join(self.lines)
+
+    def clear(self):
+        """Forgets everything captured so far"""
+        self.lines.clear()
+
+
+class NullSink(OutputSink):
+    """Throws all output away."""
+
+    discards = True
+
+    def write(self, text):
+        """Ignores a line"""
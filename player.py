@@ -11,19 +11,22 @@ class Player:
     Can walk between rooms and keep items in backpack.
      handles everything the player can do.
     """
+
+    __slots__ = ("name", "current_room", "backpack")
     
-    def __init__(self, name, current_room, backpack_capacity=5):
+    def __init__(self, name, current_room, backpack_capacity=5, backpack_max_weight=None):
         """
         Makes a new player character.
         
         Args:
             name: what to call them
             current_room: where they start
-            backpack_capacity: how much they can carry (usually 5)
+            backpack_capacity: how many items they can carry (usually 5)
+            backpack_max_weight: how heavy the backpack can get (None = no limit)
         """
         self.name = name
         self.current_room = current_room
-        self.backpack = Backpack(backpack_capacity)
+        self.backpack = Backpack(backpack_capacity, backpack_max_weight)
 
     def move_to(self, room):
         """
@@ -49,33 +52,27 @@ class Player:
         Put an item down in current room.
         Returns True if dropped ok
         """
-        try:
-            self.backpack.remove_item(item)
-            self.current_room.add_item(item)
-            return True
-        except:
+        if not self.backpack.remove_item(item):
+            return False
+        if not self.current_room.add_item(item):
+            self.backpack.add_item(item)  # something else here has that name
             return False
+        return True
 
     def has_item(self, item_name):
         """
         See if something is in youur backpack.
         Returns True if its there
         """
-        for item in self.backpack.contents:
-            if item.name.lower() == item_name.lower():
-                return True
-        return False
+        return self.backpack.has_item(item_name)
 
     def get_item(self, item_name):
         """
         Find item in backpack by name.
         Returns the item or None if not found
         """
-        for item in self.backpack.contents:
-            if item.name.lower() == item_name.lower():
-                return item
-        return None
+        return self.backpack.get_item(item_name)
 
     def get_inventory(self):
         """Shows everything in ur backpack"""
-        return [item.name for item in self.backpack.contents]
+        return self.backpack.get_inventory()
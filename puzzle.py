@@ -3,6 +3,9 @@ Puzzle system for the game - handles password puzzels and item-based ones!
 Pretty much anything that needs solving goes here
 """
 
+from backpack import Backpack
+from definitions import PuzzleDefinition, shared
+
 class Puzzle:
     """
     A puzzle that players solve with either a password or some items.
@@ -16,11 +19,25 @@ class Puzzle:
         password: Solution word (if it's a password puzzle)
         required_items: Items needed to solve (if it's an item puzzle)
         gives_items: Reward items when solved
+        entity_id: Id from the world file
+
+    Only is_solved and unlocks_room are kept here, the rest is in its
+    PuzzleDefinition (see definitions.py).
     """
-    
-    def __init__(self, name, description, success_message, 
+
+    __slots__ = ("definition", "is_solved", "unlocks_room", "__weakref__")
+
+    entity_id = shared("entity_id")
+    name = shared("name")
+    description = shared("description")
+    success_message = shared("success_message")
+    password = shared("password")
+    required_items = shared("required_items")
+    gives_items = shared("gives_items")
+
+    def __init__(self, name=None, description=None, success_message=None,
                  unlocks_room=None, is_solved=False, password=None, 
-                 required_items=None, gives_items=None):
+                 required_items=None, gives_items=None, entity_id=None, definition=None):
         """
         Makes a new puzzle to challenge the player.
         
@@ -32,15 +49,16 @@ class Puzzle:
             password: the answer (if its a password puzzle)
             required_items: stuff needed to solve it
             gives_items: rewards u get
+            entity_id: id from the world file
+            definition: a shared PuzzleDefinition to use instead of name,
+                description, success_message, password, required_items and gives_items
         """
-        self.name = name
-        self.description = description
+        if definition is None:
+            definition = PuzzleDefinition(entity_id, name, description, success_message, password,
+                                          required_items, gives_items)
+        self.definition = definition
         self.is_solved = is_solved
-        self.success_message = success_message
-        self.password = password
         self.unlocks_room = unlocks_room
-        self.required_items = required_items or []
-        self.gives_items = gives_items or []
 
     def solve(self, attempt=None, items=None):
         """
@@ -57,15 +75,18 @@ class Puzzle:
     def _solve_with_items(self, items):
         """
         Checks if player used the right items.
+        items can be a Backpack (checked through its name index) or a list.
         Returns if it worked + what to tell them
         """
         if not items:
             return False, "You might need some items to solve this..."
         
-        required_names = [item.name.lower() for item in self.required_items]
-        provided_names = [item.name.lower() for item in items]
+        if isinstance(items, Backpack):
+            provided_names = items.names()
+        else:
+            provided_names = {item.name.lower() for item in items}
         
-        if all(name in provided_names for name in required_names):
+        if all(item.name.lower() in provided_names for item in self.required_items):
             self._mark_solved()
             return True, self.success_message
         return False, "You don't have the right combination of items."
@@ -76,8 +97,9 @@ class Puzzle:
         Returns if correct + message + maybe items
         """
         if attempt == self.password:
+            first_time = not self.is_solved
             self._mark_solved()
-            if self.gives_items:
+            if self.gives_items and first_time:  # only the first solve hands them out
                 return True, self.success_message, self.gives_items
             return True, self.success_message
         return False, "That's not correct."
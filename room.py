@@ -3,13 +3,147 @@ Room module for the game - handles all the places players can go to.
 Has stuff like exits, items they can pickup, and NPCs to talk to.
 """
 
+import re
+from types import MappingProxyType
+
+from definitions import RoomDefinition, shared
+
+
+_WORD_SPLIT = re.compile(r"[^a-z0-9]+")
+
+# What an empty index holds until something is added, shared by all of them
+# since most rooms have no NPCs or puzzles (or items, once taken).
+_NOTHING = MappingProxyType({})
+
+
+class EntityIndex:
+    """
+    The items, NPCs or puzzles in a room, kept in the order they were added.
+    Indexed by lower case name so adding, removing and finding one never
+    has to look through the rest. Each word of a name works too as long
+    as only one thing in the room has it, so 'sam' finds Sam Altman and
+    'phone' finds Roon's Phone.
+    version goes up on every change, so anything made from the contents
+    (like the room's text) can tell when it is out of date.
+    """
+
+    __slots__ = ("_by_name", "_by_word", "version")
+
+    def __init__(self):
+        self._by_name = _NOTHING
+        self._by_word = None  # word -> {name: entity}, built on first use
+        self.version = 0
+
+    def add(self, entity):
+        """
+        Adds something. Returns False if something else with the same
+        name is already here (adding the same thing twice is fine)
+        """
+        key = entity.name.lower()
+        existing = self._by_name.get(key)
+        if existing is not None:
+            return existing is entity
+        if self._by_name is _NOTHING:
+            self._by_name = {}
+        self._by_name[key] = entity
+        self.version += 1
+        if self._by_word is not None:
+            for word in self._words(key):
+                self._by_word.setdefault(word, {})[key] = entity
+        return True
+
+    def remove(self, entity):
+        """Removes something. Returns False if it wasnt here"""
+        key = entity.name.lower()
+        if self._by_name.get(key) is not entity:
+            return False
+        del self._by_name[key]
+        self.version += 1
+        if self._by_word is not None:
+            for word in self._words(key):
+                matches = self._by_word[word]
+                del matches[key]
+                if not matches:
+                    del self._by_word[word]
+        return True
+
+    def get(self, name):
+        """Finds something by its name or a word of its name (any case). None if not here"""
+        key = name.lower()
+        entity = self._by_name.get(key)
+        if entity is not None:
+            return entity
+        if self._by_word is None:
+            self._by_word = {}
+            for entity_key, entity in self._by_name.items():
+                for word in self._words(entity_key):
+                    self._by_word.setdefault(word, {})[entity_key] = entity
+        matches = self._by_word.get(key)
+        if matches is not None and len(matches) == 1:
+            return next(iter(matches.values()))
+        return None
+
+    def clear(self):
+        """Removes everything"""
+        self._by_name = _NOTHING
+        self.version += 1
+        self._by_word = None
+
+    def first(self):
+        """The first thing added that is still here, or None"""
+        return next(iter(self._by_name.values()), None)
+
+    @staticmethod
+    def _words(key):
+        """The words of a lower case name worth indexing"""
+        return [word for word in _WORD_SPLIT.split(key) if len(word) > 1 and word != key]
+
+    def __contains__(self, entity):
+        if isinstance(entity, str):
+            return self.get(entity) is not None
+        return self._by_name.get(entity.name.lower()) is entity
+
+    def __getitem__(self, index):
+        if index == 0:
+            entity = self.first()
+            if entity is None:
+                raise IndexError("nothing here")
+            return entity
+        return list(self._by_name.values())[index]
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def __len__(self):
+        return len(self._by_name)
+
+
 class Room:
     """
     A place in the game world. Has exits to other rooms and can contain
     items/puzzels/NPCs. Some rooms need keycards to get in.
+    The text describing it is only made again when what it shows changes:
+    each piece remembers the version of the index it was made from and the
+    definitions it read (its own, its neighbours', its NPCs' and puzzles'),
+    so giving one of them a changed definition (see shared) shows up too.
+    set_exit and setting the description throw it away. Anything else that
+    changes what a room shows should call forget_text.
+    The id, description and keycard level are kept in the room's
+    RoomDefinition (see definitions.py), shared with the same room in
+    every other session.
     """
 
-    def __init__(self, description, islocked=False, required_keycard_level=0):
+    __slots__ = ("definition", "exits", "items", "puzzles", "npcs", "navigators", "_islocked",
+                 "_long_text", "_long_version", "_items_text", "_items_version", "_puzzles_text",
+                 "_puzzles_version", "__weakref__")
+
+    # Per game services that a cloned room must not share with its template.
+    FRESH_ON_CLONE = ("navigators",)
+
+    entity_id = shared("entity_id")
+
+    def __init__(self, description=None, islocked=False, required_keycard_level=0, entity_id=None,
+                 definition=None):
         """
         Makes new room with given desc and security level.
         
@@ -17,14 +151,66 @@ class Room:
             description: what player sees when they enter
             islocked: if its locked at start
             required_keycard_level: security level needed (0-3)
+            entity_id: id from the world file (eg lobby)
+            definition: a shared RoomDefinition to use instead of description,
+                required_keycard_level and entity_id
         """
-        self.description = description
+        if definition is None:
+            definition = RoomDefinition(entity_id, description, required_keycard_level)
+        self.definition = definition
         self.exits = {}  
-        self.items = []
-        self.puzzles = []
-        self.npcs = []
-        self.islocked = islocked or required_keycard_level > 0
-        self.required_keycard_level = required_keycard_level
+        self.items = EntityIndex()
+        self.puzzles = EntityIndex()
+        self.npcs = EntityIndex()
+        # every game's (or shared world's) Navigator over this room, told when its lock or exits change
+        self.navigators = None
+        self._islocked = islocked or definition.required_keycard_level > 0
+        self.forget_text()
+
+    @property
+    def description(self):
+        """What the player sees when they enter"""
+        return self.definition.description
+
+    @description.setter
+    def description(self, description):
+        # the room gets a definition of its own, the shared one stays as it was
+        self.definition = self.definition.replace(description=description)
+        self.forget_text()
+
+    @property
+    def required_keycard_level(self):
+        """Security level needed (0-3)"""
+        return self.definition.required_keycard_level
+
+    @required_keycard_level.setter
+    def required_keycard_level(self, level):
+        # like shared, and a room that now needs a keycard is locked until one is used
+        self.definition = self.definition.replace(required_keycard_level=level)
+        if level > 0:
+            self.islocked = True
+
+    def forget_text(self):
+        """Throws away the cached text, so it is made again when next shown"""
+        self._long_text = None
+        self._long_version = None  # npcs.version and the definitions the long description was made from
+        self._items_text = None
+        self._items_version = -1
+        self._puzzles_text = None
+        self._puzzles_version = None
+
+    @property
+    def islocked(self):
+        """If the room is locked. Changing it lets the navigators know"""
+        return self._islocked
+
+    @islocked.setter
+    def islocked(self, locked):
+        if locked != self._islocked:
+            self._islocked = locked
+            if self.navigators:
+                for navigator in self.navigators:
+                    navigator.lock_changed(self)
 
     def set_exit(self, direction, neighbour):
         """
@@ -33,6 +219,10 @@ class Room:
         neighbour = connecting room
         """
         self.exits[direction] = neighbour
+        self._long_text = None
+        if self.navigators:
+            for navigator in self.navigators:
+                navigator.exits_changed()
 
     def get_short_description(self):
         """Quick description of the room"""
@@ -43,6 +233,10 @@ class Room:
         Detailed room info - shows description, available exits,
         and any NPCs 
         """
+        version = (self.npcs.version, self.definition, *[room.definition for room in self.exits.values()],
+                   *[npc.definition for npc in self.npcs])
+        if self._long_text is not None and self._long_version == version:
+            return self._long_text
         base_desc = f'Location: {self.description}, Exits: {self.get_exits()}'
         
         locked_exits = []
@@ -55,7 +249,9 @@ class Room:
         if self.npcs:  
             npc_descriptions = [f"{npc.name} - {npc.description}" for npc in self.npcs]
             base_desc += "\nPresent: " + "; ".join(npc_descriptions)
-        return base_desc + "."
+        self._long_text = base_desc + "."
+        self._long_version = version
+        return self._long_text
 
     def get_exits(self):
         """Lists exits you can use"""
@@ -66,44 +262,71 @@ class Room:
         return self.exits.get(direction)
 
     def add_item(self, item: object):
-        """Puts item in the room for player to find"""
-        self.items.append(item)
+        """Puts item in the room for player to find. False if another item has the same name"""
+        return self.items.add(item)
 
     def add_puzzle(self, puzzle: object):
-        """Adds puzzel to the room"""
-        self.puzzles.append(puzzle)
+        """Adds puzzel to the room. False if another puzzle has the same name"""
+        return self.puzzles.add(puzzle)
 
     def add_npc(self, npc: object):
-        """Puts NPC in the room"""
-        self.npcs.append(npc)
+        """Puts NPC in the room. False if another NPC has the same name"""
+        return self.npcs.add(npc)
+
+    def get_item(self, name):
+        """Finds an item here by name (or a word of it). None if theres no such item"""
+        return self.items.get(name)
+
+    def get_npc(self, name):
+        """Finds an NPC here by name (or a word of it, like sam)"""
+        return self.npcs.get(name)
+
+    def get_puzzle(self, name):
+        """Finds a puzzle here by name (or a word of it, like phone)"""
+        return self.puzzles.get(name)
 
     def show_items(self):
         """
         Shows what items are in room. Says if theres nothing here
         """
-        if not self.items:
-            return "You see no items in this room"
-        return "You see: " + ", ".join([f"{item.name}, {item.description}" for item in self.items])
+        version = self.items.version
+        if self._items_version != version:
+            if not self.items:
+                self._items_text = "You see no items in this room"
+            else:
+                self._items_text = "You see: " + ", ".join([f"{item.name}, {item.description}" for item in self.items])
+            self._items_version = version
+        return self._items_text
     
     def show_puzzles(self):
         """
         Lists any puzzels in the room, or tells u if none exist
         """
-        if not self.puzzles:
-            return "There are no puzzles in this room"
-        return "You see: " + ", ".join([f"{puzzle.name}, {puzzle.description}" for puzzle in self.puzzles])
+        version = (self.puzzles.version, *[puzzle.definition for puzzle in self.puzzles])
+        if self._puzzles_version != version:
+            if not self.puzzles:
+                self._puzzles_text = "There are no puzzles in this room"
+            else:
+                self._puzzles_text = "You see: " + ", ".join([f"{puzzle.name}, {puzzle.description}"
+                                                              for puzzle in self.puzzles])
+            self._puzzles_version = version
+        return self._puzzles_text
 
     def remove_item(self, item):
         """
         Takes item from room if its here. Returns None if cant find it
         """
-        try:
-            if item in self.items:
-                self.items.remove(item)
-                return item
-            return None
-        except ValueError:
-            return None
+        if self.items.remove(item):
+            return item
+        return None
+
+    def remove_npc(self, npc):
+        """Takes NPC out of the room. Returns True if they were here"""
+        return self.npcs.remove(npc)
+
+    def remove_puzzle(self, puzzle):
+        """Takes puzzle out of the room. Returns True if it was here"""
+        return self.puzzles.remove(puzzle)
 
     def get_locked_exits(self):
         """Shows which exits need keycard access"""
@@ -0,0 +1,138 @@
+"""
+Interaction rules - what happens when an item is used on an NPC or a puzzle.
+
+Rules are data in the world file, so new interactions need no code:
+
+    "rules": [
+        {"use": "safety_handbook", "on": "sama",
+         "message": "OMG this book says...", "unlocks_room": "agi_room"},
+        {"use": "safety_handbook", "on": "truth_terminal",
+         "message": "NOOO!...", "wins": true}
+    ]
+
+A rule needs the item ("use"), the NPC or puzzle it is used on ("on") and
+a message. Its effects are any of unlocks_room (a room id), gives_item (an
+item id, put in the backpack, or in the room if the backpack is full) and
+wins. Its conditions are needs_items
+(item ids that also have to be in the backpack) and needs_solved (puzzle
+ids).
+
+A RuleBook is built once per compiled world and shared by all its games.
+Rules are kept in a dict keyed by (target id, item id), with each key's
+rules in world file order, so using an item costs one lookup however many
+rules the world has. The first rule for the key whose conditions hold
+fires. Conditions are compiled into tuples of backpack names and puzzle
+ids when the book is built, so checking them does no string work.
+"""
+
+import weakref
+
+
+_books = weakref.WeakKeyDictionary()
+
+
+class Rule:
+    """
+    One interaction: using an item on a target.
+
+    Attributes:
+        message: What to print when it fires
+        unlocks_room: Id of the room it unlocks, or None
+        gives_item: Id of the item it puts in the backpack, or None
+        wins: If it wins the game
+        needs_names: Lower case names of items that have to be in the backpack
+        needs_solved: Ids of puzzles that have to be solved
+    """
+
+    def __init__(self, message, unlocks_room=None, gives_item=None, wins=False, needs_names=(), needs_solved=()):
+        self.message = message
+        self.unlocks_room = unlocks_room
+        self.gives_item = gives_item
+        self.wins = wins
+        self.needs_names = needs_names
+        self.needs_solved = needs_solved
+
+    @property
+    def conditional(self):
+        """If the rule has conditions"""
+        return bool(self.needs_names or self.needs_solved)
+
+    def holds(self, game):
+        """If the rule's conditions hold in a game"""
+        if self.needs_names:
+            carried = game.player.backpack.names()
+            if not all(name in carried for name in self.needs_names):
+                return False
+        if self.needs_solved:
+            puzzles = game.puzzles
+            if not all(puzzles[ident].is_solved for ident in self.needs_solved):
+                return False
+        return True
+
+    def fire(self, game):
+        """Applies the rule's effects to a game"""
+        game.ui.print(self.message)
+        if self.unlocks_room is not None:
+            game.rooms[self.unlocks_room].islocked = False
+        if self.gives_item is not None:
+            game.give_item(game.items[self.gives_item])
+        if self.wins:
+            game.game_won = True
+
+
+class RuleBook:
+    """Every rule of a world, by (target id, item id)."""
+
+    def __init__(self, world):
+        """
+        Args:
+            world: A CompiledWorld
+        """
+        self._rules = {}
+        for (item, kind, target, message, unlocks, gives, wins, needs_items, needs_solved) in world.rules:
+            table = world.npcs if kind == "npc" else world.puzzles
+            rule = Rule(message,
+                        unlocks_room=world.rooms[unlocks][0] if unlocks >= 0 else None,
+                        gives_item=world.items[gives][0] if gives >= 0 else None,
+                        wins=wins,
+                        needs_names=tuple(world.items[index][1].lower() for index in needs_items),
+                        needs_solved=tuple(world.puzzles[index][0] for index in needs_solved))
+            key = (table[target][0], world.items[item][0])
+            self._rules[key] = self._rules.get(key, ()) + (rule,)
+
+    @classmethod
+    def for_world(cls, world):
+        """The (shared) rule book of a world"""
+        book = _books.get(world)
+        if book is None:
+            book = _books[world] = cls(world)
+        return book
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._rules.values())
+
+    def items(self):
+        """((target id, item id), rules) for every key, rules in the order they are tried"""
+        return self._rules.items()
+
+    def find(self, game, target, item):
+        """The rule that fires when item is used on target (an NPC or puzzle) in a game, or None"""
+        rules = self._rules.get((target.entity_id, item.entity_id))
+        if rules is not None:
+            for rule in rules:
+                if rule.holds(game):
+                    return rule
+        return None
+
+    def apply(self, game, target, item):
+        """
+        Uses an item on a target, firing the first rule that holds.
+
+        Returns:
+            True if a rule fired
+        """
+        rule = self.find(game, target, item)
+        if rule is None:
+            return False
+        rule.fire(game)
+        return True
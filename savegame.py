@@ -0,0 +1,244 @@
+"""
+Saved games - everything about a game that can change, in a small binary file.
+
+A save holds only the game's state, never the world itself: where the
+player is, what is in their backpack, which rooms are locked, what is
+lying in each room, which puzzles are solved, how far each NPC has got
+through their dialogue and whether the game is won. Every entity is
+referred to by its id from the world file, so saves keep working when the
+world file gains new rooms or has its descriptions reworded.
+
+The state is one tuple of strings, numbers and booleans encoded with
+marshal (the same as compiled worlds), behind a magic string, a format
+version and the name of the world it came from. Files are written to a
+temporary name and renamed into place, so a crash mid-save never leaves a
+half written slot behind.
+
+Saves live in a SaveStore, one file per slot. Games with a session_id
+(eg one per server connection) get their own folder, spread over 256
+shard folders so that millions of sessions dont end up in one directory:
+
+    saves/quicksave.sav
+    saves/3f/<session id>/quicksave.sav
+"""
+
+import marshal
+import os
+import re
+import tempfile
+import zlib
+
+
+DEFAULT_SAVE_DIR = "saves"
+SAVE_SUFFIX = ".sav"
+DEFAULT_SLOT = "quicksave"
+
+# Bump when the layout of the state tuple changes.
+FORMAT_VERSION = 1
+_MAGIC = "AGI-SAVE"
+
+_VALID_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class SaveError(Exception):
+    """Raised when a save cant be loaded (broken file, other world, other version...)."""
+
+
+def capture(game):
+    """
+    Gets the state of a game.
+
+    Args:
+        game: The Game to save
+
+    Returns:
+        The state as one marshal friendly tuple
+    """
+    player = game.player
+    rooms = tuple((room.entity_id, room.islocked,
+                   tuple(item.entity_id for item in room.items),
+                   tuple(npc.entity_id for npc in room.npcs),
+                   tuple(puzzle.entity_id for puzzle in room.puzzles))
+                  for room in game.rooms.values())
+    backpack = tuple((item.entity_id, quantity) for item, quantity in player.backpack.stacks())
+    solved = tuple(ident for ident, puzzle in game.puzzles.items() if puzzle.is_solved)
+    dialogue = tuple((ident, npc.dialogue_counter) for ident, npc in game.npcs.items()
+                     if npc.dialogue_counter)
+    return (player.current_room.entity_id, backpack, rooms, solved, dialogue, game.game_won)
+
+
+def restore(game, state):
+    """
+    Puts a game into a saved state. Every id is checked before anything is
+    changed, so a save that doesnt fit the game leaves it as it was.
+
+    Args:
+        game: A Game of the same world the state was captured from
+        state: A tuple from capture
+
+    Raises:
+        SaveError: If the state mentions something this world doesnt have
+    """
+    try:
+        current_room, backpack, rooms, solved, dialogue, game_won = state
+        current_room = game.rooms[current_room]
+        backpack = [(game.items[ident], quantity) for ident, quantity in backpack]
+        rooms = [(game.rooms[ident], locked,
+                  [game.items[item] for item in items],
+                  [game.npcs[npc] for npc in npcs],
+                  [game.puzzles[puzzle] for puzzle in puzzles])
+                 for ident, locked, items, npcs, puzzles in rooms]
+        solved = {game.puzzles[ident] for ident in solved}
+        dialogue = [(game.npcs[ident], counter) for ident, counter in dialogue]
+    except KeyError as error:
+        raise SaveError(f"the save mentions {error}, which isn't in this world") from None
+    except (TypeError, ValueError):
+        raise SaveError("the save is broken") from None
+
+    for room, locked, items, npcs, puzzles in rooms:
+        room.islocked = locked
+        room.items.clear()
+        room.npcs.clear()
+        room.puzzles.clear()
+        for item in items:
+            room.items.add(item)
+        for npc in npcs:
+            room.npcs.add(npc)
+        for puzzle in puzzles:
+            room.puzzles.add(puzzle)
+    for puzzle in game.puzzles.values():
+        puzzle.is_solved = puzzle in solved
+    for npc in game.npcs.values():
+        npc.dialogue_counter = 0
+    for npc, counter in dialogue:
+        npc.dialogue_counter = counter
+    game.player.backpack.clear()
+    for item, quantity in backpack:
+        game.player.backpack.add_item(item, quantity)
+    game.player.current_room = current_room
+    game.game_won = bool(game_won)
+
+
+def dumps(game):
+    """A game's state as bytes"""
+    return marshal.dumps((_MAGIC, FORMAT_VERSION, game.world.name, capture(game)))
+
+
+def loads(game, data):
+    """
+    Puts a game into the state saved in some bytes from dumps.
+
+    Raises:
+        SaveError: If the data isnt a save of this world from this version
+    """
+    try:
+        magic, version, world_name, state = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        raise SaveError("that isn't a saved game") from None
+    if magic != _MAGIC:
+        raise SaveError("that isn't a saved game")
+    if version != FORMAT_VERSION:
+        raise SaveError(f"that save is from another version of the game (format {version})")
+    if world_name != game.world.name:
+        raise SaveError(f"that save is from another world ({world_name})")
+    restore(game, state)
+
+
+def write_atomic(path, data, durable=False):
+    """
+    Writes a file by writing a temporary file next to it and renaming it
+    into place, so readers only ever see the old or the new contents.
+    Every write gets its own temporary file, so writes from several threads
+    (eg saves run in an executor) dont trip over each other.
+
+    Args:
+        path: File to write (its folder is made if needed)
+        data: The bytes to write
+        durable: Also fsync the file before the rename, so it survives a
+            power cut and not only a crash
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class SaveStore:
+    """
+    A folder of saved games, one file per slot.
+
+    Attributes:
+        directory: Where the saves are kept
+    """
+
+    def __init__(self, directory=DEFAULT_SAVE_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def is_valid_name(name):
+        """Slot and session names can only use letters, numbers, - and _"""
+        return bool(_VALID_NAME.fullmatch(name))
+
+    def folder(self, session=None):
+        """The folder holding one session's slots (or the shared slots)"""
+        if session is None:
+            return self.directory
+        if not self.is_valid_name(session):
+            raise ValueError(f"bad session name {session!r}")
+        shard = format(zlib.crc32(session.encode()) & 0xFF, "02x")
+        return os.path.join(self.directory, shard, session)
+
+    def path(self, slot=DEFAULT_SLOT, session=None):
+        """The file a slot is saved in"""
+        if not self.is_valid_name(slot):
+            raise ValueError(f"bad slot name {slot!r}")
+        return os.path.join(self.folder(session), slot + SAVE_SUFFIX)
+
+    def save(self, game, slot=DEFAULT_SLOT, session=None):
+        """
+        Saves a game to a slot, replacing what was there. The file is
+        written to a temporary name first and then renamed.
+
+        Returns:
+            The path it was saved to
+        """
+        path = self.path(slot, session)
+        write_atomic(path, dumps(game))
+        return path
+
+    def load(self, game, slot=DEFAULT_SLOT, session=None):
+        """
+        Loads a slot into a game.
+
+        Raises:
+            FileNotFoundError: If nothing is saved in that slot
+            SaveError: If the save doesnt fit the game
+        """
+        with open(self.path(slot, session), "rb") as f:
+            data = f.read()
+        loads(game, data)
+
+    def slots(self, session=None):
+        """The names of the saved slots, sorted"""
+        try:
+            names = os.listdir(self.folder(session))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(SAVE_SUFFIX)] for name in names if name.endswith(SAVE_SUFFIX))
+
+    def delete(self, slot=DEFAULT_SLOT, session=None):
+        """Removes a slot. Returns False if there was nothing in it"""
+        try:
+            os.remove(self.path(slot, session))
+        except FileNotFoundError:
+            return False
+        return True
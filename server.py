@@ -0,0 +1,345 @@
+"""
+Asyncio game server - lots of players, one process, one Game each.
+
+Players connect over TCP and type one command per line, like a MUD.
+Every connection gets its own Game, cloned from a shared world template,
+and talks to it through a StreamUI. Games only ever wait on the network
+inside StreamUI.get_command, so one slow or idle player never holds up
+anyone else. Output is buffered per connection and sent in one write per
+command, together with the next prompt.
+
+Every connection is given a player key, and a player who comes back on a
+new connection types `login <key>` to get back to the save slots they
+made with it. Saves are kept in the server's own save folder (--save-dir)
+and read and written in a worker thread, never on the event loop.
+
+With a journal (see journal.py) every command is logged before the player
+sees its result, so sessions can be rebuilt if the server crashes. The
+journal's writes and compactions run in a worker thread.
+
+With metrics (see metrics.py) every session's commands are timed and
+counted. Given a metrics port, the server also answers HTTP requests for
+/metrics (Prometheus text) and /metrics.json there.
+
+Idle players are disconnected by a single reaper task that checks when
+each session last sent something, instead of one timer per read, which
+keeps idle sessions cheap (10k+ in one process; raise `ulimit -n` first).
+
+Usage:
+    python server.py --port 8023 --idle-timeout 300 --metrics-port 9023
+See load_test.py for a load testing client.
+"""
+
+import argparse
+import asyncio
+import uuid
+
+from journal import Journal
+from metrics import Metrics
+from savegame import DEFAULT_SAVE_DIR, SaveStore
+from template import WorldTemplate
+from game import Game
+from text_ui import parse_command
+
+
+PROMPT = "> "
+
+
+class AsyncUI:
+    """
+    What a UI needs to provide for Game.play_async: the same as TextUI,
+    except that get_command and flush are coroutines.
+    """
+
+    quiet = False  # see TextUI.quiet
+
+    async def get_command(self):
+        """Waits for the next command. Returns a (command_word, second_word) tuple"""
+        raise NotImplementedError
+
+    def print(self, text):
+        """Queues text to be shown to the player"""
+        raise NotImplementedError
+
+    async def flush(self):
+        """Sends anything queued by print"""
+        raise NotImplementedError
+
+    def later(self, awaitable):
+        """Has awaitable finish before any more output is sent or the next command is read"""
+        raise NotImplementedError
+
+
+class StreamUI(AsyncUI):
+    """
+    An AsyncUI over an asyncio stream (one TCP connection).
+    Printed lines are buffered and sent in one write when the player is
+    next asked for a command, or on flush.
+    """
+
+    def __init__(self, reader, writer, journal=None):
+        self.reader = reader
+        self.writer = writer
+        self.journal = journal  # output waits for this journal to commit, if given
+        self._lines = []
+        self._later = []  # awaitables from later()
+        self.last_active = asyncio.get_running_loop().time()
+
+    async def get_command(self):
+        """
+        Sends any output plus a prompt, then waits for a line.
+        Raises EOFError when the player disconnects.
+        """
+        await self._finish()
+        self._send(PROMPT)
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError("player disconnected")
+        self.last_active = asyncio.get_running_loop().time()
+        return parse_command(line.decode("utf-8", "replace"))
+
+    def print(self, text):
+        """Queues a line of output"""
+        self._lines.append(text)
+
+    async def flush(self):
+        """Sends queued output now"""
+        await self._finish()
+        self._send("")
+        await self.writer.drain()
+
+    def later(self, awaitable):
+        """Has awaitable finish before any more output is sent or the next command is read"""
+        self._later.append(awaitable)
+
+    async def _finish(self):
+        """Waits for everything from later(), then for the journal to commit"""
+        while self._later:
+            await self._later.pop(0)
+        if self.journal is not None:
+            await self.journal.sync()
+
+    def _send(self, prompt):
+        """Writes queued lines and a prompt to the transport in one go"""
+        if self._lines:
+            self._lines.append(prompt)
+            data = "\n".join(self._lines)
+            self._lines.clear()
+        else:
+            data = prompt
+        if data and not self.writer.is_closing():
+            self.writer.write(data.encode("utf-8"))
+
+
+class ServerGame(Game):
+    """
+    A Game played over a StreamUI. Saves and loads run in a worker thread
+    (the game waits for them before its next command), and login takes a
+    player back to the save slots of their key.
+    """
+
+    commands = Game.commands.copy()
+
+    def print_welcome(self):
+        super().print_welcome()
+        self.ui.print(f"Your player key is {self.player_id}. Type 'login {self.player_id}' when you come back "
+                      "to get to your saved games.")
+
+    def save_game(self, slot=None):
+        """Saves the game to a slot, in a worker thread"""
+        self.ui.later(asyncio.get_running_loop().run_in_executor(None, Game.save_game, self, slot))
+
+    def load_game(self, slot=None):
+        """Loads the game saved in a slot, in a worker thread"""
+        self.ui.later(self._load(slot))
+
+    async def _load(self, slot):
+        await asyncio.get_running_loop().run_in_executor(None, Game.load_game, self, slot)
+        if self.journal is not None:
+            self.journal.snapshot(self)  # the one taken when load ran was from before it
+
+    def do_login_command(self, key):
+        """Uses the save slots of another player key: login <key>"""
+        if not self.saves.is_valid_name(key):
+            self.ui.print("That isn't a player key.")
+            return
+        self.player_id = key
+        self.ui.print(f"Welcome back! Your saved games: {', '.join(self.saves.slots(key)) or 'none'}.")
+
+
+ServerGame.commands.unregister("save")
+ServerGame.commands.unregister("load")
+ServerGame.commands.register("save", ServerGame.save_game, max_args=1, usage="Save to which slot? (one word)",
+                             replayable=False)
+ServerGame.commands.register("load", ServerGame.load_game, max_args=1, usage="Load which slot? (one word)",
+                             replayable=False)
+ServerGame.commands.register("login", ServerGame.do_login_command, min_args=1, max_args=1,
+                             usage="Log in with which key?", replayable=False)
+
+
+class GameServer:
+    """
+    Runs one Game per TCP connection.
+
+    Attributes:
+        host, port: Where to listen (port 0 picks a free port, see self.port after start)
+        idle_timeout: Seconds without input before a player is disconnected (None = never)
+        max_sessions: Connections allowed at once (None = no limit)
+        sessions: The StreamUI of every connected player
+        journal: journal.Journal logging every session's commands (None = no journal)
+        metrics: metrics.Metrics measuring every session (None = no metrics)
+        metrics_port: Where to serve the metrics over HTTP (None = nowhere; 0 picks a free port)
+        saves: savegame.SaveStore every session's save slots are kept in
+    """
+
+    def __init__(self, host="127.0.0.1", port=8023, idle_timeout=300, max_sessions=None, world_path=None,
+                 journal=None, metrics=None, metrics_port=None, save_dir=DEFAULT_SAVE_DIR):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.template = WorldTemplate(ServerGame(world_path=world_path))
+        self.saves = SaveStore(save_dir)
+        self.sessions = set()
+        self.journal = journal
+        self.metrics = metrics if metrics is not None or metrics_port is None else Metrics()
+        self.metrics_port = metrics_port
+        self._server = None
+        self._metrics_server = None
+        self._reaper = None
+        self._committer = None
+
+    async def start(self):
+        """Starts listening (and reaping idle sessions)"""
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                  limit=4096, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.idle_timeout is not None:
+            self._reaper = asyncio.create_task(self._reap_idle_sessions())
+        if self.journal is not None:
+            self._committer = asyncio.create_task(self.journal.run_committer())
+        if self.metrics_port is not None:
+            self._metrics_server = await asyncio.start_server(self.handle_metrics_request, self.host,
+                                                              self.metrics_port)
+            self.metrics_port = self._metrics_server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Starts the server if needed and runs until cancelled"""
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """Stops listening and disconnects everyone"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+        for ui in list(self.sessions):
+            ui.writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self._committer is not None:
+            self._committer.cancel()
+            try:
+                await self._committer
+            except asyncio.CancelledError:
+                pass
+            self.journal.close()
+
+    async def handle_connection(self, reader, writer):
+        """Plays one game with one connected player"""
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            writer.write(b"The server is full, try again later.\n")
+            writer.close()
+            return
+        ui = StreamUI(reader, writer, self.journal)
+        self.sessions.add(ui)
+        game = self.template.new_game(ui)
+        game.saves = self.saves
+        game.player_id = uuid.uuid4().hex
+        if self.journal is not None:
+            self.journal.attach(game, uuid.uuid4().hex)
+        else:
+            game.session_id = uuid.uuid4().hex
+        if self.metrics is not None:
+            self.metrics.attach(game)
+        try:
+            await game.play_async()
+        except (EOFError, ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # player left, or sent a line that was far too long
+        finally:
+            self.sessions.discard(ui)
+            if game.journal is not None:
+                game.journal.detach(game)
+            if game.metrics is not None:
+                game.metrics.detach(game)
+            writer.close()
+
+    async def handle_metrics_request(self, reader, writer):
+        """Answers one HTTP request for the metrics: GET /metrics or GET /metrics.json"""
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers
+            parts = request.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else ""
+            if path == "/metrics":
+                status, kind, body = "200 OK", "text/plain; version=0.0.4", self.metrics.to_prometheus()
+            elif path == "/metrics.json":
+                status, kind, body = "200 OK", "application/json", self.metrics.to_json()
+            else:
+                status, kind, body = "404 Not Found", "text/plain", "Try /metrics or /metrics.json\n"
+            data = body.encode()
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {kind}\r\nContent-Length: {len(data)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + data)
+            await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _reap_idle_sessions(self):
+        """Disconnects players who havent typed anything for idle_timeout seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 0.05))
+            cutoff = loop.time() - self.idle_timeout
+            for ui in [ui for ui in self.sessions if ui.last_active < cutoff]:
+                ui.print("You have been disconnected for being idle.")
+                ui._send("")
+                ui.writer.close()
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Host the game over TCP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--idle-timeout", type=float, default=300, help="seconds, 0 to never time out")
+    parser.add_argument("--max-sessions", type=int, default=None)
+    parser.add_argument("--world", default=None, help="world file to host")
+    parser.add_argument("--journal", default=None, help="folder to journal every session's commands in")
+    parser.add_argument("--compact-interval", type=float, default=60,
+                        help="seconds between deleting journal segments every session has a newer snapshot of")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve metrics over HTTP on this port")
+    parser.add_argument("--save-dir", default=DEFAULT_SAVE_DIR, help="folder to keep players' saved games in")
+    args = parser.parse_args(argv)
+
+    journal = Journal(args.journal, compact_interval=args.compact_interval) if args.journal else None
+    server = GameServer(args.host, args.port, args.idle_timeout or None, args.max_sessions, args.world,
+                        journal, metrics_port=args.metrics_port, save_dir=args.save_dir)
+    print(f"Serving on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+"""
+Sharded session host - game sessions spread over worker processes.
+
+A ShardedHost starts a pool of worker processes (shards) and sends each
+session's commands to one of them. Sessions are StoreGames (see
+world_store.py), so the world itself is a read-only memory mapped store
+file: every worker maps the same file and the operating system keeps one
+copy of it in memory however many workers there are. Each worker only
+holds its sessions' state (the rooms they have made and what changed),
+which is why a worker's private memory stays flat as shards are added.
+
+    host = ShardedHost(workers=4, journal_dir="journal")
+    host.start()
+    host.open("player1")                    # the welcome text, as lines
+    lines, finished = host.send("player1", "go south")
+    host.end("player1")
+    host.close()
+
+Sessions are routed by id with rendezvous hashing: each live worker gets a
+score from a hash of (worker, session) and the highest score owns the
+session. So a session always goes to the same worker, and when a worker
+dies only its own sessions move, spread evenly over the others; every
+other session stays where it is.
+
+With a journal_dir every worker journals its sessions' commands (see
+journal.py) in its own folder, committing once per batch of requests
+before answering them. A session that moves because its worker died is
+recovered by its new worker from the dead worker's journal, then carries
+on in the new worker's. Commands in flight when a worker dies are sent
+again to the session's new worker. The host numbers each session's
+commands and the numbers are what the journal logs them under, so a
+command the dead worker had already committed (but not answered) is
+recovered and skipped instead of run twice; its answer has no lines.
+Without a journal, sessions of a dead worker start over.
+
+Usage:
+    python sharding.py --shards 1,2,4 --sessions 400
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+
+from headless import WINNING_SCRIPT
+from journal import Journal
+from text_ui import CaptureUI, parse_command
+from world_store import StoreGame, open_store
+
+
+# Rooms each session keeps made when nothing else is using them (see RoomCache).
+SESSION_CACHE_SIZE = 64
+
+
+def rendezvous_owner(session, workers):
+    """
+    The worker a session belongs to: the one with the highest hash of
+    (worker, session).
+
+    Args:
+        session: Session id
+        workers: Names of the live workers
+
+    Returns:
+        A worker name, or None if there are none
+    """
+    best, owner = None, None
+    for worker in workers:
+        score = hashlib.blake2b(f"{worker}\t{session}".encode(), digest_size=8).digest()
+        if best is None or score > best:
+            best, owner = score, worker
+    return owner
+
+
+def memory_usage():
+    """
+    This process's resident memory in kB, as (private, file backed), or
+    None where /proc isnt available. Pages of a mapped store are file backed.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["RssAnon"].split()[0]), int(fields["RssFile"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class _StoreSessions:
+    """Makes StoreGames, for Journal.recover (which wants something with new_game, like a WorldTemplate)."""
+
+    def __init__(self, store_path, cache_size):
+        self.store_path = store_path
+        self.cache_size = cache_size
+
+    def new_game(self, ui=None):
+        return StoreGame(ui, self.store_path, self.cache_size)
+
+
+class ShardWorker:
+    """
+    The sessions of one worker process. Runs in the worker, driven by
+    serve over a pipe from the host.
+
+    Requests come in lists, one list per message, and are answered with
+    a list of answers. Each is a (kind, session, argument, origin, sequence)
+    tuple:
+        open        start or recover a session, answering (its first
+                    lines, sequence number of its last logged command)
+        command     run the line in argument, answering (lines, finished,
+                    sequence number of the session's last logged command)
+        end         snapshot and forget a session
+        stats       answer (pid, sessions, memory_usage())
+        stop        finish up and exit
+    origin is the journal folder of the worker that had the session
+    before, if it died. sequence is the number the host gave a command
+    (None if it doesnt know the session's numbers yet); a command whose
+    number is already logged is not run again. Sequence numbers are None
+    without a journal. A request that raises is answered with the
+    exception.
+    """
+
+    def __init__(self, name, store_path, journal_dir=None, cache_size=SESSION_CACHE_SIZE):
+        self.name = name
+        self.sessions = _StoreSessions(store_path, cache_size)
+        self.games = {}  # session -> Game
+        self.journal = Journal(os.path.join(journal_dir, name)) if journal_dir else None
+        self._logs = {}  # journal folder -> (Journal, its log as first read), for recovering sessions from it
+
+    def serve(self, connection):
+        """Answers requests until told to stop or the host goes away"""
+        while True:
+            try:
+                requests = connection.recv()
+            except EOFError:
+                break
+            answers = []
+            for request in requests:
+                try:
+                    answers.append(self.handle(*request))
+                except Exception as error:
+                    answers.append(error)
+            if self.journal is not None:
+                self.journal.commit()
+            connection.send(answers)
+            if any(request[0] == "stop" for request in requests):
+                break
+        for game in list(self.games.values()):
+            self._end(game)
+        if self.journal is not None:
+            self.journal.close()
+
+    def handle(self, kind, session, argument=None, origin=None, sequence=None):
+        """Answers one request"""
+        if kind == "command":
+            game = self.games.get(session)
+            if game is None:
+                game = self._open(session, origin)
+            game.ui.sink.clear()
+            journal = game.journal
+            if sequence is not None and journal is not None and not journal.number(game, sequence):
+                # committed by a worker that died before answering, and recovered from its journal
+                return [], game.game_won, journal.sequence(game)
+            finished = game.process_command(parse_command(argument))
+            lines = list(game.ui.lines)
+            logged = journal.sequence(game) if journal is not None else None
+            if finished:
+                self._end(game)
+            return lines, finished, logged
+        if kind == "open":
+            game = self.games.get(session) or self._open(session, origin)
+            lines = list(game.ui.lines)
+            game.ui.sink.clear()
+            return lines, game.journal.sequence(game) if game.journal is not None else None
+        if kind == "end":
+            game = self.games.get(session)
+            if game is not None:
+                self._end(game)
+            return None
+        if kind == "stats":
+            return os.getpid(), len(self.games), memory_usage()
+        if kind == "stop":
+            return None
+        raise ValueError(f"unknown request {kind!r}")
+
+    def _open(self, session, origin):
+        """
+        Gets a session going: recovered from origin's journal (where it was
+        last) or this worker's (from before a restart), or brand new.
+        """
+        ui = CaptureUI()
+        game = None
+        if origin is not None and os.path.isdir(origin):
+            journal, log = self._journal_log(origin)
+            game = journal.recover(session, self.sessions, ui, attach=False, log=log)
+            if game is not None and self.journal is not None:
+                # carry on numbering after anything either journal logged for the session
+                sequence = max(self._last_sequence(session), self._last_sequence(session, origin))
+                self.journal.attach(game, session, sequence)
+                self.journal.snapshot(game)
+        if game is None and self.journal is not None:
+            game = self.journal.recover(session, self.sessions, ui, log=self._journal_log(self.journal.directory)[1])
+        if game is None:
+            game = self.sessions.new_game(ui)
+            game.print_welcome()
+            if self.journal is not None:
+                self.journal.attach(game, session, self._last_sequence(session))
+        if self.journal is None:
+            game.session_id = session
+        self.games[session] = game
+        return game
+
+    def _journal_log(self, directory):
+        """(Journal, log) of a journal folder, read once"""
+        if directory not in self._logs:
+            journal = self.journal if self.journal is not None and directory == self.journal.directory \
+                else Journal(directory)
+            self._logs[directory] = (journal, journal.read_log())
+        return self._logs[directory]
+
+    def _last_sequence(self, session, directory=None):
+        """The highest sequence number a journal (default: this worker's) has for a session (0 for none)"""
+        journal, log = self._journal_log(directory if directory is not None else self.journal.directory)
+        snapshot = journal.read_snapshot(session)
+        return max([sequence for sequence, _, _ in log.get(session, ())] + [snapshot[0] if snapshot else 0])
+
+    def _end(self, game):
+        """Snapshots (if journaling) and forgets a session"""
+        if game.journal is not None:
+            game.journal.detach(game)
+        del self.games[game.session_id]
+
+
+def _run_worker(connection, name, store_path, journal_dir, cache_size):
+    """Worker process entry point"""
+    ShardWorker(name, store_path, journal_dir, cache_size).serve(connection)
+
+
+class _Shard:
+    """The host's handle on one worker process."""
+
+    def __init__(self, name, process, connection):
+        self.name = name
+        self.process = process
+        self.connection = connection
+
+
+class ShardedHost:
+    """
+    Runs sessions on a pool of worker processes.
+
+    Attributes:
+        worker_count: Workers started by start
+        store_path: The world store every worker maps
+        journal_dir: Folder the workers journal in, one subfolder each (None = no journal)
+        cache_size: Rooms each session keeps made (see RoomCache)
+    """
+
+    def __init__(self, workers=None, world_path=None, journal_dir=None, cache_size=SESSION_CACHE_SIZE):
+        self.worker_count = workers or os.cpu_count() or 1
+        self.store_path = open_store(world_path).path  # built here once, not by every worker
+        self.journal_dir = journal_dir
+        self.cache_size = cache_size
+        self._shards = {}  # name -> _Shard, live workers only
+        self._homes = {}  # session -> name of the worker that has it
+        self._sequences = {}  # session -> sequence number of its last logged command, as its worker last said
+
+    @property
+    def workers(self):
+        """Names of the live workers"""
+        return list(self._shards)
+
+    def start(self):
+        """Starts the workers"""
+        context = multiprocessing.get_context("spawn")  # workers shouldnt inherit the host's memory
+        for number in range(self.worker_count):
+            name = f"shard-{number}"
+            connection, child = context.Pipe()
+            process = context.Process(target=_run_worker, name=name, daemon=True,
+                                      args=(child, name, self.store_path, self.journal_dir, self.cache_size))
+            process.start()
+            child.close()
+            self._shards[name] = _Shard(name, process, connection)
+
+    def close(self):
+        """Stops the workers, ending (and snapshotting) every session"""
+        for shard in list(self._shards.values()):
+            try:
+                shard.connection.send([("stop", None, None, None, None)])
+                shard.connection.recv()
+            except (EOFError, OSError):
+                pass
+            shard.process.join(5)
+            shard.connection.close()
+        self._shards.clear()
+        self._homes.clear()
+        self._sequences.clear()
+
+    def owner(self, session):
+        """The name of the worker a session belongs to"""
+        owner = rendezvous_owner(session, self._shards)
+        if owner is None:
+            raise RuntimeError("no workers left")
+        return owner
+
+    def open(self, session):
+        """Starts a session (or picks it back up), returning its first lines"""
+        return self._request([("open", session, None)])[0]
+
+    def send(self, session, line):
+        """
+        Runs a line typed in a session.
+
+        Returns:
+            (lines printed, if the session finished)
+        """
+        return self._request([("command", session, line)])[0]
+
+    def send_many(self, requests):
+        """
+        Runs lines in many sessions at once, each worker working through
+        its share in parallel with the others.
+
+        Args:
+            requests: (session, line) pairs
+
+        Returns:
+            (lines printed, if the session finished) for each request
+        """
+        return self._request([("command", session, line) for session, line in requests])
+
+    def end(self, session):
+        """Ends a session (snapshotting it if journaling)"""
+        if session in self._homes:
+            self._request([("end", session, None)])
+
+    def stats(self):
+        """{worker name: (pid, sessions, memory_usage())} for every live worker"""
+        stats = {}
+        for name, shard in list(self._shards.items()):
+            try:
+                shard.connection.send([("stats", None, None, None, None)])
+                stats[name] = shard.connection.recv()[0]
+            except (EOFError, OSError):
+                self._lost(name)
+        return stats
+
+    def _request(self, requests):
+        """
+        Sends (kind, session, argument) requests to the sessions' workers,
+        one message per worker so they all work at once, and collects the
+        answers in order. Commands are numbered once, here, so when a
+        worker dies its requests are sent again to the sessions' new
+        workers with the same numbers. If a request raised on its worker,
+        the exception is raised here once every worker's answers are read.
+        """
+        answers = [None] * len(requests)
+        error = None
+        sequences = []
+        numbered = {}  # session -> last number given out in this call
+        for kind, session, _ in requests:
+            last = numbered.get(session, self._sequences.get(session))
+            if kind == "command" and last is not None:
+                numbered[session] = last + 1
+                sequences.append(last + 1)
+            else:
+                numbered[session] = None  # numbers are unknown again until its worker says
+                sequences.append(None)
+        waiting = list(range(len(requests)))
+        while waiting:
+            batches = {}
+            for number in waiting:
+                kind, session, argument = requests[number]
+                owner = self.owner(session)
+                home = self._homes.get(session)
+                origin = None
+                if home is not None and home != owner and self.journal_dir is not None:
+                    origin = os.path.join(self.journal_dir, home)
+                batches.setdefault(owner, []).append((number, (kind, session, argument, origin,
+                                                               sequences[number])))
+            waiting = []
+            sent = {}
+            for name, batch in batches.items():
+                try:
+                    self._shards[name].connection.send([request for _, request in batch])
+                    sent[name] = batch
+                except OSError:
+                    self._lost(name)
+                    waiting += [number for number, _ in batch]
+            for name, batch in sent.items():
+                try:
+                    replies = self._shards[name].connection.recv()
+                except (EOFError, OSError):
+                    self._lost(name)
+                    waiting += [number for number, _ in batch]
+                    continue
+                for (number, (kind, session, *_)), answer in zip(batch, replies):
+                    if isinstance(answer, Exception):
+                        error = error or answer
+                        continue
+                    if kind in ("command", "open"):
+                        *answer, sequence = answer
+                        answer = answer[0] if kind == "open" else tuple(answer)
+                        self._sequences[session] = sequence
+                    answers[number] = answer
+                    if kind == "end" or (kind == "command" and answer[1]):
+                        self._homes.pop(session, None)
+                        self._sequences.pop(session, None)
+                    else:
+                        self._homes[session] = name
+            if error is not None:
+                raise error
+        return answers
+
+    def _lost(self, name):
+        """Forgets a worker that died, so its sessions go to the others"""
+        shard = self._shards.pop(name, None)
+        if shard is not None:
+            shard.connection.close()
+            shard.process.join(1)
+
+
+def main(argv=None):
+    """Plays the winning script in lots of sessions on different numbers of shards, reporting memory per worker."""
+    parser = argparse.ArgumentParser(description="Run sessions across worker processes.")
+    parser.add_argument("--shards", default="1,2,4", help="worker counts to try, eg 1,2,4,8")
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--world", default=None, help="world file to host")
+    parser.add_argument("--journal", default=None, help="folder to journal sessions in")
+    args = parser.parse_args(argv)
+
+    print(f"{'shards':>6} {'commands/s':>11} {'private kB/worker':>18} {'mapped kB/worker':>17}")
+    for count in [int(shards) for shards in args.shards.split(",")]:
+        host = ShardedHost(count, args.world, args.journal)
+        host.start()
+        sessions = [f"s{number}" for number in range(args.sessions)]
+        start = time.perf_counter()
+        for line in WINNING_SCRIPT:
+            host.send_many([(session, line) for session in sessions])
+        elapsed = time.perf_counter() - start
+        usage = [memory for _, _, memory in host.stats().values() if memory is not None]
+        host.close()
+        rate = len(sessions) * len(WINNING_SCRIPT) / elapsed
+        if usage:
+            private = sum(memory[0] for memory in usage) // len(usage)
+            mapped = sum(memory[1] for memory in usage) // len(usage)
+            print(f"{count:>6} {rate:>11.0f} {private:>18} {mapped:>17}")
+        else:
+            print(f"{count:>6} {rate:>11.0f} {'?':>18} {'?':>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Solver - finds the shortest way to win a world, to check it can still be won.
+
+It does a breadth first search over game states, from the start of a fresh
+game (or any game in progress), trying every command a player could
+usefully type in each state: go through each exit, take each item that is
+still needed, use each needed backpack item (on its own, on each unsolved
+puzzle that needs it and on each puzzle and NPC the world has a rule for) and solve each unsolved puzzle with its
+password. Commands are run through the real Game.process_command, so the
+solver follows exactly the same rules as players do.
+
+A state is the game's packed state (see state.py) without the NPCs'
+dialogue positions, which only change what they say next. States are
+plain ints, and the actions available in a state and where each one leads
+are memoised on the Solver, so searching again from another state (eg a
+hint for a player halfway through) reuses everything already worked out.
+
+An item is needed while an unsolved puzzle needs it, a rule that can still
+do something uses it, or a locked room it opens is left. Nothing makes an
+item needed again, so the search leaves where the other items are out of
+the state (keeping just how full the backpack is) and two states that only
+differ in those are expanded once. Otherwise the items left behind in
+every part of a big world would multiply the states to search.
+
+Usage:
+    python solver.py [world.json] [--max-states 1000000]
+"""
+
+import argparse
+import sys
+import time
+from collections import deque
+
+from game import Game
+from output import NullSink
+from state import StateCodec
+from template import WorldTemplate
+from text_ui import TextUI, parse_command
+
+
+class Solver:
+    """
+    Searches the states of one world.
+
+    Attributes:
+        template: WorldTemplate of the world being solved
+        states_explored: States expanded by the last search
+        elapsed: Seconds the last search took
+    """
+
+    def __init__(self, template=None):
+        self.template = template if template is not None else WorldTemplate()
+        self.game = self.template.new_game(TextUI(NullSink()))
+        self.codec = StateCodec.for_game(self.game, dialogue=False)
+        self.states_explored = 0
+        self.elapsed = 0.0
+        game = self.game
+        self._rule_keys = {key for key, _ in game.rules.items()}
+        # (item name, names it needs too, rule) per rule
+        self._rules = [(game.items[item].name.lower(), rule.needs_names, rule)
+                       for (_, item), rules in game.rules.items() for rule in rules]
+        # (puzzle id, names of the items it needs) per puzzle solved with items
+        self._item_puzzles = [(puzzle.entity_id, [item.name.lower() for item in puzzle.required_items])
+                              for puzzle in game.puzzles.values() if puzzle.required_items]
+        self._keycards = [(item.name.lower(), item.keycard_level) for item in game.items.values()
+                          if item.is_keycard]
+        self._doors = [room.entity_id for room in game.rooms.values() if room.required_keycard_level > 0]
+        self._masks = {}  # lower case name -> bits of the state saying where items of that name are
+        for ident, item in game.items.items():
+            name = item.name.lower()
+            self._masks[name] = self._masks.get(name, 0) | self.codec.item_mask(ident)
+        self._all_items = 0
+        for mask in self._masks.values():
+            self._all_items |= mask
+        self._current = self.state_key(self.game)  # the state self.game is in
+        self._actions = {}  # state -> commands worth trying in it
+        self._transitions = {}  # (state, command) -> state it leads to
+        self._keys = {}  # state -> its search key (see search_key)
+
+    @property
+    def states_per_sec(self):
+        return self.states_explored / self.elapsed if self.elapsed else 0.0
+
+    def state_key(self, game):
+        """The packed state of a game, minus dialogue positions"""
+        return self.codec.encode(game)
+
+    def is_won(self, state):
+        return self.codec.is_won(state)
+
+    def needed(self, game):
+        """Lower case names of the items that can still help win a game"""
+        needed = set()
+        puzzles = game.puzzles
+        for ident, names in self._item_puzzles:
+            if not puzzles[ident].is_solved:
+                needed.update(names)
+        rooms = game.rooms
+        for name, needs_names, rule in self._rules:
+            if rule.wins or rule.gives_item is not None \
+                    or (rule.unlocks_room is not None and rooms[rule.unlocks_room].islocked):
+                needed.add(name)
+                needed.update(needs_names)
+        levels = [rooms[ident].required_keycard_level for ident in self._doors if rooms[ident].islocked]
+        if levels:
+            lowest = min(levels)
+            needed.update(name for name, level in self._keycards if level >= lowest)
+        return needed
+
+    def search_key(self, game, state):
+        """
+        What the search tells a game's state apart by: the state without
+        where the items that are no longer needed are, plus how full the
+        backpack is.
+        """
+        live = 0
+        for name in self.needed(game):
+            live |= self._masks.get(name, 0)
+        backpack = game.player.backpack
+        return state & ~(self._all_items & ~live), len(backpack), backpack.weight
+
+    def _go_to(self, state):
+        """Puts the working game into a state"""
+        if state != self._current:
+            self.codec.decode(self.game, state)
+            self._current = state
+
+    def actions(self, state):
+        """The commands worth trying in a state"""
+        actions = self._actions.get(state)
+        if actions is not None:
+            return actions
+        self._go_to(state)
+        player = self.game.player
+        room = player.current_room
+        needed = self.needed(self.game)
+        rule_keys = self._rule_keys
+        actions = [f"go {direction}" for direction in room.exits]
+        actions += [f"take {item.name}" for item in room.items
+                    if item.can_be_taken and item.name.lower() in needed]
+        for item in player.backpack:
+            if item.name.lower() not in needed:
+                continue
+            actions.append(f"use {item.name}")
+            actions += [f"use {item.name} on {puzzle.name}" for puzzle in room.puzzles
+                        if (puzzle.entity_id, item.entity_id) in rule_keys
+                        or (not puzzle.is_solved and item in puzzle.required_items)]
+            actions += [f"use {item.name} on {npc.name}" for npc in room.npcs
+                        if (npc.entity_id, item.entity_id) in rule_keys]
+        actions += [f"solve {puzzle.name} {puzzle.password}" for puzzle in room.puzzles
+                    if not puzzle.is_solved and puzzle.password is not None]
+        self._actions[state] = actions
+        return actions
+
+    def step(self, state, action):
+        """The state a command leads to (the same state if it does nothing)"""
+        key = (state, action)
+        result = self._transitions.get(key)
+        if result is None:
+            self._go_to(state)
+            self.game.process_command(parse_command(action))
+            result = self.state_key(self.game)
+            self._current = result
+            self._transitions[key] = result
+            if result not in self._keys:
+                self._keys[result] = self.search_key(self.game, result)
+        return result
+
+    def solve(self, game=None, max_states=None):
+        """
+        Finds the shortest list of commands that wins.
+
+        Args:
+            game: Game to start from (default: a fresh game of the template)
+            max_states: Give up after expanding this many states (None = no limit)
+
+        Returns:
+            The commands, or None if the game cant be won (within max_states)
+        """
+        game = game if game is not None else self.template.template
+        start = self.state_key(game)
+        start_key = self.search_key(game, start)
+        started = time.perf_counter()
+        self.states_explored = 0
+        parents = {start_key: None}  # search key -> (parent's key, command)
+        queue = deque([(start, start_key)])
+        found = start_key if self.is_won(start) else None
+        while queue and found is None:
+            if max_states is not None and self.states_explored >= max_states:
+                break
+            state, key = queue.popleft()
+            self.states_explored += 1
+            for action in self.actions(state):
+                child = self.step(state, action)
+                child_key = self._keys[child]
+                if child_key in parents:
+                    continue
+                parents[child_key] = (key, action)
+                if self.is_won(child):
+                    found = child_key
+                    break
+                queue.append((child, child_key))
+        self.elapsed = time.perf_counter() - started
+        if found is None:
+            return None
+        path = []
+        while parents[found] is not None:
+            found, action = parents[found]
+            path.append(action)
+        path.reverse()
+        return path
+
+
+def main(argv=None):
+    """Solves a world and prints the shortest winning transcript."""
+    parser = argparse.ArgumentParser(description="Find the shortest way to win a world.")
+    parser.add_argument("world", nargs="?", default=None, help="world file (default: the OpenAI HQ world)")
+    parser.add_argument("--max-states", type=int, default=None, help="give up after this many states")
+    args = parser.parse_args(argv)
+
+    solver = Solver(WorldTemplate(Game(TextUI(NullSink()), args.world)))
+    path = solver.solve(max_states=args.max_states)
+    if path is None:
+        print("No way to win found!")
+    else:
+        for number, command in enumerate(path, 1):
+            print(f"{number:3}. {command}")
+    print(f"{solver.states_explored} states explored in {solver.elapsed * 1000:.1f}ms "
+          f"({solver.states_per_sec:,.0f} states/sec, {len(solver._transitions)} transitions)")
+    return 0 if path is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Packed game state - everything that changes during a game, as one int.
+
+A StateCodec is worked out once per world and turns the mutable state of
+any game of that world into a single Python int and back:
+
+    field                       bits
+    player's room               enough for the room count
+    game won                    1
+    room locked                 1 per room
+    puzzle solved               1 per puzzle
+    item location               enough for the room count + 2, per item
+                                (0 = gone, 1 = backpack, 2 + n = room n)
+    stack size                  8 per stackable item (while in the backpack,
+                                so up to 255; bigger stacks cant be packed)
+    NPC dialogue position       enough for their lines, per NPC
+
+Ints hash, compare and copy in constant time-ish and their hash is the
+same in every process, so a packed state works as a dictionary key for
+search, deduplication and caching, and its bytes (to_bytes) as a compact
+snapshot. The encoding is canonical: games in the same state always give
+the same int, whatever order things were picked up or dropped in.
+
+NPCs and puzzles never move between rooms during play, so their places
+are not part of the state. The layout depends on the world, so packed
+states should not outlive a change to the world file (use savegame for
+that).
+"""
+
+import weakref
+
+
+STACK_BITS = 8
+MAX_STACK = (1 << STACK_BITS) - 1
+
+_codecs = weakref.WeakKeyDictionary()
+
+
+def bits_for(count):
+    """How many bits it takes to store a number from 0 to count - 1"""
+    return max(count - 1, 0).bit_length()
+
+
+class StateCodec:
+    """
+    Packs and unpacks the state of games of one world.
+
+    Attributes:
+        world: The CompiledWorld
+        dialogue: If NPC dialogue positions are part of the state
+        bits: Total bits in a packed state
+    """
+
+    def __init__(self, world, dialogue=True):
+        self.world = world
+        self.dialogue = dialogue
+        self._room_index = {row[0]: index for index, row in enumerate(world.rooms)}
+        self._item_index = {row[0]: index for index, row in enumerate(world.items)}
+        self._room_bits = bits_for(len(world.rooms))
+        self._won_shift = self._room_bits
+        self._lock_shift = self._won_shift + 1
+        self._puzzle_shift = self._lock_shift + len(world.rooms)
+        self._item_shift = self._puzzle_shift + len(world.puzzles)
+        self._item_bits = bits_for(len(world.rooms) + 2)
+        shift = self._item_shift + self._item_bits * len(world.items)
+        self._stack_shifts = {}  # item index -> where its stack size goes
+        for index, row in enumerate(world.items):
+            if row[7]:  # stackable
+                self._stack_shifts[index] = shift
+                shift += STACK_BITS
+        self._npc_fields = []  # (shift, bits) per NPC
+        if dialogue:
+            for row in world.npcs:
+                width = bits_for(len(row[3]))
+                self._npc_fields.append((shift, width))
+                shift += width
+        self.bits = shift
+
+    @classmethod
+    def for_game(cls, game, dialogue=True):
+        """The (shared) codec for a game's world"""
+        codecs = _codecs.setdefault(game.world, {})
+        codec = codecs.get(dialogue)
+        if codec is None:
+            codec = codecs[dialogue] = cls(game.world, dialogue)
+        return codec
+
+    def encode(self, game):
+        """
+        The packed state of a game.
+
+        Raises:
+            ValueError: If a stack in the backpack is bigger than MAX_STACK
+        """
+        state = self._room_index[game.player.current_room.entity_id]
+        if game.game_won:
+            state |= 1 << self._won_shift
+        item_index = self._item_index
+        item_shift = self._item_shift
+        item_bits = self._item_bits
+        bit = self._lock_shift
+        location = 2
+        for room in game.rooms.values():
+            if room.islocked:
+                state |= 1 << bit
+            for item in room.items:
+                state |= location << (item_shift + item_index[item.entity_id] * item_bits)
+            bit += 1
+            location += 1
+        for puzzle in game.puzzles.values():
+            if puzzle.is_solved:
+                state |= 1 << bit
+            bit += 1
+        for item, quantity in game.player.backpack.stacks():
+            index = item_index[item.entity_id]
+            state |= 1 << (item_shift + index * item_bits)
+            if item.stackable:
+                if quantity > MAX_STACK:
+                    raise ValueError(f"a stack of {quantity} {item.name} is too big to pack (most is {MAX_STACK})")
+                state |= quantity << self._stack_shifts[index]
+        if self._npc_fields:
+            for npc, (shift, _) in zip(game.npcs.values(), self._npc_fields):
+                state |= npc.dialogue_counter << shift
+        return state
+
+    def pack(self, room, won, locked, solved, locations, dialogue=()):
+        """
+        Packs a state given as plain values, for engines that dont keep
+        their state in Game objects (see vector_engine.py).
+
+        Args:
+            room: Index of the player's room
+            won: If the game is won
+            locked: Locked flag per room
+            solved: Solved flag per puzzle
+            locations: Location code per item (0 = gone, 1 = backpack, 2 + n = room n).
+                Stackable items in the backpack count as a stack of one
+            dialogue: Dialogue position per NPC (ignored if the codec leaves dialogue out)
+        """
+        state = int(room) | (bool(won) << self._won_shift)
+        bit = self._lock_shift
+        for flag in list(locked) + list(solved):
+            if flag:
+                state |= 1 << bit
+            bit += 1
+        for index, location in enumerate(locations):
+            state |= int(location) << (self._item_shift + index * self._item_bits)
+            if location == 1 and index in self._stack_shifts:
+                state |= 1 << self._stack_shifts[index]
+        for (shift, _), counter in zip(self._npc_fields, dialogue):
+            state |= int(counter) << shift
+        return state
+
+    def decode(self, game, state):
+        """
+        Puts a game of this codec's world into a packed state.
+
+        Raises:
+            ValueError: If the state doesnt fit the world
+        """
+        if state < 0 or state >> self.bits:
+            raise ValueError("state doesn't fit this world")
+        rooms = list(game.rooms.values())
+        items = list(game.items.values())
+        room_index = state & ((1 << self._room_bits) - 1)
+        item_mask = (1 << self._item_bits) - 1
+        locations = [(state >> (self._item_shift + index * self._item_bits)) & item_mask
+                     for index in range(len(items))]
+        if room_index >= len(rooms) or max(locations, default=0) >= len(rooms) + 2:
+            raise ValueError("state doesn't fit this world")
+
+        bit = self._lock_shift
+        for room in rooms:
+            room.islocked = bool(state >> bit & 1)
+            room.items.clear()
+            bit += 1
+        for puzzle in game.puzzles.values():
+            puzzle.is_solved = bool(state >> bit & 1)
+            bit += 1
+        backpack = game.player.backpack
+        backpack.clear()
+        for index, (item, location) in enumerate(zip(items, locations)):
+            if location == 1:
+                shift = self._stack_shifts.get(index)
+                quantity = (state >> shift) & MAX_STACK if shift is not None else 1
+                backpack.add_item(item, quantity)
+            elif location:
+                rooms[location - 2].items.add(item)
+        for npc, (shift, width) in zip(game.npcs.values(), self._npc_fields):
+            npc.dialogue_counter = (state >> shift) & ((1 << width) - 1)
+        game.player.current_room = rooms[room_index]
+        game.game_won = bool(state >> self._won_shift & 1)
+
+    def item_mask(self, ident):
+        """The bits of a packed state that say where an item is (and how many are carried)"""
+        index = self._item_index[ident]
+        mask = ((1 << self._item_bits) - 1) << (self._item_shift + index * self._item_bits)
+        shift = self._stack_shifts.get(index)
+        if shift is not None:
+            mask |= MAX_STACK << shift
+        return mask
+
+    def is_won(self, state):
+        """If the game is won in a packed state"""
+        return bool(state >> self._won_shift & 1)
+
+    def room_id(self, state):
+        """Id of the player's room in a packed state"""
+        return self.world.rooms[state & ((1 << self._room_bits) - 1)][0]
+
+    def to_bytes(self, state):
+        """A packed state as bytes (the same length for every state of the world)"""
+        return state.to_bytes((self.bits + 7) // 8, "little")
+
+    def from_bytes(self, data):
+        """The packed state from to_bytes"""
+        return int.from_bytes(data, "little")
+
+    def describe(self, state):
+        """A readable breakdown of a packed state, for debugging"""
+        room_ids = list(self._room_index)
+        places = ["gone", "backpack"] + room_ids
+        item_mask = (1 << self._item_bits) - 1
+        items = {}
+        for offset, ident in enumerate(self._item_index):
+            location = (state >> (self._item_shift + offset * self._item_bits)) & item_mask
+            items[ident] = places[location] if location < len(places) else "?"
+        return {
+            "room": self.room_id(state),
+            "won": self.is_won(state),
+            "locked": [ident for offset, ident in enumerate(room_ids) if state >> (self._lock_shift + offset) & 1],
+            "solved": [row[0] for offset, row in enumerate(self.world.puzzles)
+                       if state >> (self._puzzle_shift + offset) & 1],
+            "items": items,
+        }
@@ -0,0 +1,211 @@
+"""
+World templates - build the world once, then stamp out fresh sessions.
+
+Game() runs every create_*/add_* builder and allocates the whole world each
+time. A WorldTemplate keeps one pristine Game around and clones it instead:
+every Room (and its item/NPC/puzzle indexes), NPC, Puzzle, Player
+and Backpack is copied and all the
+references between them (exits, room contents, Puzzle.unlocks_room,
+the player's room and backpack...) are pointed at the copies.
+Text, items, definitions (see definitions.py), tuples of those, the
+compiled world and other objects that are not entities are shared, not
+copied, except for attributes a class lists in FRESH_ON_CLONE (per game
+services like the navigator) which start out as None. Entities use __slots__, so their
+attributes are read from the slots.
+Every room's text is rendered on the template first, so clones start with
+it cached and all share the same strings until something in a room changes.
+
+The template's object graph is walked once and flattened into tables:
+the class of every object, then the attributes to set on them - shared
+values, references to other copies, flat lists and dicts with the copies
+patched in, and the few nested containers that are deep copied. Cloning
+is just a loop over those tables, with none of the builder calls, argument
+handling and list appends Game() goes through.
+"""
+
+import copy
+
+from backpack import Backpack
+from game import Game
+from npc import NPC
+from player import Player
+from puzzle import Puzzle
+from room import EntityIndex, Room
+from text_ui import TextUI
+
+
+# Classes whose instances belong to one session and get copied on clone.
+# (Items never change, so sessions share them.)
+ENTITY_TYPES = (Room, EntityIndex, NPC, Puzzle, Player, Backpack)
+
+# Containers, which are rebuilt or deep copied rather than shared.
+_CONTAINER_TYPES = (list, dict, set, tuple)
+
+# Values that can be shared between sessions as-is.
+_ATOMIC_TYPES = (str, int, float, bool, type(None))
+
+# Attributes of Game that are per-session but not part of the world.
+_SESSION_ATTRIBUTES = ("ui",)
+
+
+class WorldTemplate:
+    """
+    A frozen copy of the game world that new sessions are cloned from.
+    The template game itself is never handed out or changed.
+    """
+
+    def __init__(self, game=None):
+        """
+        Makes a template.
+
+        Args:
+            game: Game to use as the template (default: a brand new Game()).
+                Should not be used again by the caller afterwards.
+        """
+        self.template = game if game is not None else Game()
+        for room in self.template.rooms.values():
+            # Rendered now, the text is copied into every clone for free.
+            room.get_long_description()
+            room.show_items()
+            room.show_puzzles()
+        self._objects = []
+        self._index = {}
+        for name, value in self.template.__dict__.items():
+            if name not in _SESSION_ATTRIBUTES:
+                self._collect(value)
+        self._build_tables()
+
+    def _collect(self, value):
+        """Finds every entity reachable from value and gives it an index."""
+        if isinstance(value, (list, tuple)):
+            for element in value:
+                self._collect(element)
+        elif isinstance(value, dict):
+            for element in value.values():
+                self._collect(element)
+        elif isinstance(value, ENTITY_TYPES) and id(value) not in self._index:
+            self._index[id(value)] = len(self._objects)
+            self._objects.append(value)
+            for attribute in _attributes(value).values():
+                self._collect(attribute)
+
+    def _build_tables(self):
+        """
+        Builds the tables new_game() clones from. Every object is known by
+        its position: the entities in the order they were found, then the game.
+        """
+        # cls.__new__ looked up once per object, not on every clone
+        self._constructors = [(cls.__new__, cls) for cls in
+                              [type(obj) for obj in self._objects] + [type(self.template)]]
+        self._ids = [id(obj) for obj in self._objects]
+        self._shared = []      # (object, attribute, value)
+        self._references = []  # (object, attribute, entity)
+        self._containers = []  # (object, attribute, list/dict to copy, [(key, entity), ...])
+        self._deep = []        # (object, attribute, value to deep copy)
+
+        game = {name: value for name, value in self.template.__dict__.items()
+                if name not in _SESSION_ATTRIBUTES}
+        states = [_attributes(obj) for obj in self._objects] + [game]
+        for target, (state, obj) in enumerate(zip(states, self._objects + [self.template])):
+            fresh = getattr(type(obj), "FRESH_ON_CLONE", ())
+            for name, value in state.items():
+                if name in fresh:
+                    self._shared.append((target, name, None))
+                else:
+                    self._add(target, name, value)
+
+    def _add(self, target, name, value):
+        """Puts one attribute of one object into the table that rebuilds it."""
+        if id(value) in self._index:
+            self._references.append((target, name, self._index[id(value)]))
+        elif type(value) is list and all(self._is_flat(element) for element in value):
+            patches = [(key, self._index[id(element)]) for key, element in enumerate(value)
+                       if id(element) in self._index]
+            self._containers.append((target, name, value, patches))
+        elif type(value) is dict and all(type(key) in _ATOMIC_TYPES for key in value) \
+                and all(self._is_flat(element) for element in value.values()):
+            patches = [(key, self._index[id(element)]) for key, element in value.items()
+                       if id(element) in self._index]
+            self._containers.append((target, name, value, patches))
+        elif type(value) is tuple and all(self._is_shared(element) for element in value):
+            self._shared.append((target, name, value))
+        elif isinstance(value, _CONTAINER_TYPES):
+            # Nested or mixed containers are deep copied.
+            self._deep.append((target, name, value))
+        else:
+            # Text, numbers and any other object (the compiled world, services...) are shared.
+            self._shared.append((target, name, value))
+
+    def _clone(self):
+        """
+        Makes the copies and fills them in from the tables.
+
+        Returns:
+            A new game of the template's class
+        """
+        objects = [new(cls) for new, cls in self._constructors]
+        for target, name, value in self._shared:
+            setattr(objects[target], name, value)
+        for target, name, entity in self._references:
+            setattr(objects[target], name, objects[entity])
+        for target, name, value, patches in self._containers:
+            value = value.copy()
+            for key, entity in patches:
+                value[key] = objects[entity]
+            setattr(objects[target], name, value)
+        if self._deep:
+            # deep copies need to map template entities to their clones
+            memo = dict(zip(self._ids, objects))
+            for target, name, value in self._deep:
+                setattr(objects[target], name, copy.deepcopy(value, memo))
+        return objects[-1]
+
+    def _is_shared(self, value):
+        """If value is shared by clones as it is: anything but an entity or a container"""
+        return id(value) not in self._index and not isinstance(value, _CONTAINER_TYPES)
+
+    def _is_flat(self, value):
+        """If value can go straight into a copied list or dict: an entity, or anything but a container"""
+        return id(value) in self._index or not isinstance(value, _CONTAINER_TYPES)
+
+    def new_game(self, ui=None):
+        """
+        Makes a fresh session from the template.
+
+        Args:
+            ui: UI for the new session (default: console TextUI)
+
+        Returns:
+            A Game in the same state the template was in
+        """
+        game = self._clone()
+        game.ui = ui if ui is not None else TextUI()
+        return game
+
+
+def _attributes(obj):
+    """An object's attributes, from its __slots__ and any __dict__, as a dict"""
+    attributes = {}
+    for cls in reversed(type(obj).__mro__):
+        for name in cls.__dict__.get("__slots__", ()):
+            if name not in ("__weakref__", "__dict__"):
+                try:
+                    attributes[name] = cls.__dict__[name].__get__(obj, cls)
+                except AttributeError:
+                    pass  # never set
+    attributes.update(getattr(obj, "__dict__", {}))
+    return attributes
+
+
+_default_template = None
+
+
+def new_game(ui=None):
+    """
+    Makes a fresh default game from a shared, lazily built template.
+    Much quicker than Game() when lots of sessions are needed.
+    """
+    global _default_template
+    if _default_template is None:
+        _default_template = WorldTemplate()
+    return _default_template.new_game(ui)
@@ -1,12 +1,47 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
 import unittest
 from game import Game
+from headless import WINNING_SCRIPT, run_batch, run_session
+from text_ui import CaptureUI, TextUI, parse_command
+from output import BufferedSink, NullSink
+from savegame import SaveError, SaveStore, capture, dumps, loads, write_atomic
+from journal import Journal, replay
+from solver import Solver
+from state import MAX_STACK, StateCodec
+from env import GameEnv
+from metrics import Metrics
+from matcher import Matcher
+from navigation import Navigator
+from worldgen import WorldGenerator, generate_world, write_world
+from world_store import StoreGame, WorldStore, open_store, store_path, write_store
+from benchmark import (COMMAND_CASES, STEADY_UNITS, bench_commands, compare, load_baseline, median_results,
+                       save_baseline)
+try:
+    import numpy
+    from vector_engine import VectorEngine
+except ImportError:  # numpy is optional
+    numpy = None
+from backpack import Backpack
+from item import Item
+from puzzle import Puzzle
+from template import WorldTemplate, new_game
+from server import PROMPT, GameServer
+from sharding import ShardedHost, rendezvous_owner
+from multiplayer import SharedWorld, wander
+from world import WorldError, cache_path, compile_world, load_world, read_compiled
 
 class TestGame(unittest.TestCase):
     """Main test suite for our AGI escape room game"""
     
     def setUp(self):
         """Fresh game for each test"""
-        self.game = Game()
+        self.game = new_game()
     
     def test_room_navigation(self):
         """Player should be able to move between rooms and see available exits"""
@@ -113,5 +148,1491 @@ class TestGame(unittest.TestCase):
         room.add_npc(self.game.sama)
         self.assertIn(self.game.sama.name, room.get_long_description())
 
+
+class TestHeadless(unittest.TestCase):
+    """Scripted sessions without a console"""
+
+    def test_winning_script(self):
+        """The winning script should win and capture what the game said"""
+        result = run_session(WINNING_SCRIPT)
+        self.assertTrue(result.won)
+        self.assertTrue(result.finished)
+        self.assertEqual(result.commands_run, len(WINNING_SCRIPT))
+        self.assertIn("You've saved the world! You win!", result.output)
+
+    def test_search_is_captured(self):
+        """Search output should go through the UI, not straight to stdout"""
+        result = run_session(["go south", "search"])
+        self.assertTrue(any("basic-keycard" in line for line in result.output))
+
+    def test_batch_report(self):
+        """A batch should count sessions and commands"""
+        report = run_batch([WINNING_SCRIPT, ["go south", "quit"]], workers=1)
+        self.assertEqual(report.sessions, 2)
+        self.assertEqual(report.wins, 1)
+        self.assertEqual(report.commands, len(WINNING_SCRIPT) + 2)
+        self.assertGreater(report.commands_per_sec, 0)
+
+
+class TestTemplate(unittest.TestCase):
+    """Cloning sessions from a prebuilt world"""
+
+    def setUp(self):
+        self.template = WorldTemplate()
+        self.game = self.template.new_game()
+
+    def test_references_rewired(self):
+        """Every reference in a clone should point at the clone's own objects"""
+        game = self.game
+        original = self.template.template
+        self.assertIsNot(game.lab, original.lab)
+        self.assertIs(game.roons_phone.unlocks_room, game.lab)
+        self.assertIs(game.roons_phone.gives_items, game.scientific_keycard)
+        self.assertIs(game.gpu_puzzle.required_items[0], game.fan)
+        self.assertIs(game.lobby.get_exit("east"), game.corridor)
+        self.assertIs(game.player.current_room, game.outside)
+        self.assertIn(game.basic_keycard, game.lobby.items)
+
+    def test_containers_copied(self):
+        """Flat and nested containers on the game should be copied with their entities swapped for the clone's"""
+        original = Game(CaptureUI())
+        original.landmarks = [original.lobby, "lobby", 1.5]
+        original.routes = {"east": [original.lobby, original.corridor]}
+        game = WorldTemplate(original).new_game(CaptureUI())
+        self.assertEqual(game.landmarks, [game.lobby, "lobby", 1.5])
+        self.assertIsNot(game.landmarks, original.landmarks)
+        self.assertEqual(game.routes, {"east": [game.lobby, game.corridor]})
+        self.assertIsNot(game.routes["east"], original.routes["east"])
+        self.assertIs(game.routes["east"][0], game.lobby)
+
+    def test_clones_are_independent(self):
+        """Playing one clone shouldnt change the template or other clones"""
+        other = self.template.new_game()
+        self.game.roons_phone.solve("xitter")
+        self.game.sama.get_dialogue()
+        self.assertFalse(self.game.lab.islocked)
+        self.assertTrue(other.lab.islocked)
+        self.assertTrue(self.template.template.lab.islocked)
+        self.assertEqual(other.sama.dialogue_counter, 0)
+
+    def test_shared_definitions(self):
+        """Sessions should share items and definitions, keeping only their own state"""
+        other = Game(CaptureUI())
+        for game in (self.game, other):
+            self.assertIs(game.lobby.definition, self.template.template.lobby.definition)
+            self.assertIs(game.sama.definition, self.template.template.sama.definition)
+            self.assertIs(game.fan, self.template.template.fan)
+        for entity in (self.game.lobby, self.game.lobby.items, self.game.fan, self.game.sama, self.game.gpu_puzzle,
+                       self.game.player, self.game.player.backpack):
+            self.assertFalse(hasattr(entity, "__dict__"), type(entity).__name__)
+        self.game.lobby.description = "in a flooded lobby."
+        self.assertEqual(self.game.lobby.description, "in a flooded lobby.")
+        self.assertNotEqual(other.lobby.description, "in a flooded lobby.")
+
+    def test_changes_stay_in_session(self):
+        """Setting what comes from a shared definition should only change that session"""
+        other = Game(CaptureUI())
+        game = self.game
+        game.corridor.required_keycard_level = 3
+        game.sama.dialogue = ["Hello"]
+        game.roons_phone.password = "tweet"
+        self.assertEqual((game.corridor.required_keycard_level, game.sama.dialogue, game.roons_phone.password),
+                         (3, ("Hello",), "tweet"))
+        for session in (other, self.template.template, self.template.new_game()):
+            self.assertEqual(session.corridor.required_keycard_level, 1)
+            self.assertNotEqual(session.sama.dialogue, ("Hello",))
+            self.assertEqual(session.roons_phone.password, "xitter")
+        with self.assertRaises(AttributeError):
+            game.fan.description = "A broken fan"
+        with self.assertRaises(AttributeError):
+            game.lobby.definition.description = "in a flooded lobby."
+        self.assertIsInstance(other.sama.dialogue, tuple)
+        heavy = game.fan.replace(weight=5)
+        self.assertEqual((heavy.weight, heavy.name, other.fan.weight), (5, "fan", 1))
+
+    def test_new_description_shown(self):
+        """Changing a room's description should change the text it shows"""
+        room = self.game.lobby
+        self.assertNotIn("flooded", room.get_long_description())
+        room.description = "in a flooded lobby"
+        self.assertTrue(room.get_long_description().startswith("Location: in a flooded lobby, Exits:"))
+
+    def test_shared_changes_shown(self):
+        """Changing an NPC, puzzle or neighbour should change the text of the rooms showing it"""
+        game = self.game
+        room = game.money_room
+        self.assertNotIn("soaking wet", room.get_long_description())
+        game.sama.description = "soaking wet"
+        self.assertIn("Sam Altman - soaking wet", room.get_long_description())
+        self.assertNotIn("soaking wet", self.template.new_game().money_room.get_long_description())
+        game.roon_den.show_puzzles()
+        game.roons_phone.description = "a cracked phone"
+        self.assertIn("a cracked phone", game.roon_den.show_puzzles())
+
+    def test_keycard_level_change(self):
+        """Raising a room's keycard level should relock it and show in its neighbours' text"""
+        game = self.game
+        self.assertIn("requires level 1 keycard", game.lobby.get_long_description())
+        game.corridor.islocked = False
+        game.corridor.required_keycard_level = 3
+        self.assertTrue(game.corridor.islocked)
+        self.assertIn("requires level 3 keycard", game.lobby.get_long_description())
+        game.player.current_room = game.lobby
+        game.player.backpack.add_item(game.basic_keycard)
+        game.process_command(("use", "basic-keycard"))
+        self.assertTrue(game.corridor.islocked)
+
+
+TINY_WORLD = {
+    "name": "Tiny",
+    "start_room": "hall",
+    "rooms": {
+        "hall": {"description": "in a hall.", "exits": {"north": "vault"}, "items": ["key"]},
+        "vault": {"description": "in a vault.", "keycard_level": 1, "exits": {"south": "hall"}}
+    },
+    "items": {"key": {"name": "key", "description": "A keycard", "can_be_taken": True, "keycard_level": 1}}
+}
+
+
+class TestWorld(unittest.TestCase):
+    """Loading worlds from data files"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "tiny.json")
+        with open(self.path, "w") as f:
+            json.dump(TINY_WORLD, f)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_custom_world(self):
+        """Game should play whatever world it is given"""
+        game = Game(world_path=self.path)
+        self.assertIs(game.player.current_room, game.hall)
+        self.assertTrue(game.vault.islocked)
+        game.process_command(("take", "key"))
+        game.process_command(("use", "key"))
+        game.process_command(("go", "north"))
+        self.assertIs(game.player.current_room, game.rooms["vault"])
+
+    def test_compiled_cache(self):
+        """The compiled form should be cached and dropped when the source changes"""
+        world = load_world(self.path)
+        stat = os.stat(self.path)
+        cached = read_compiled(cache_path(self.path), stat)
+        self.assertEqual(cached.to_tables(), world.to_tables())
+        with open(self.path, "a") as f:
+            f.write("\n")
+        self.assertIsNone(read_compiled(cache_path(self.path), os.stat(self.path)))
+
+    def test_bad_world(self):
+        """Dangling references and missing fields should be reported"""
+        broken = json.loads(json.dumps(TINY_WORLD))
+        broken["rooms"]["hall"]["exits"]["east"] = "nowhere"
+        with self.assertRaises(WorldError):
+            compile_world(broken)
+        del broken["rooms"]["hall"]["description"]
+        with self.assertRaises(WorldError):
+            compile_world(broken)
+
+    def test_unhashable_references(self):
+        """References that are lists or objects should be reported with where they are"""
+        for path, value in ((("rooms", "hall", "exits", "north"), ["vault"]),
+                            (("rooms", "hall", "items"), [{"id": "key"}])):
+            broken = json.loads(json.dumps(TINY_WORLD))
+            container = broken
+            for key in path[:-1]:
+                container = container[key]
+            container[path[-1]] = value
+            with self.assertRaises(WorldError) as caught:
+                compile_world(broken)
+            self.assertIn(".".join(path), str(caught.exception))
+
+
+RULES_WORLD = {
+    "name": "Rules",
+    "start_room": "hall",
+    "rooms": {
+        "hall": {"description": "in a hall.", "exits": {"north": "vault"}, "items": ["coin", "badge"],
+                 "npcs": ["guard"], "puzzles": ["lock"]},
+        "vault": {"description": "in a vault.", "locked": True, "exits": {"south": "hall"}}
+    },
+    "items": {
+        "coin": {"name": "coin", "description": "A coin"},
+        "badge": {"name": "badge", "description": "A badge"},
+        "crown": {"name": "crown", "description": "A crown", "can_be_taken": False}
+    },
+    "npcs": {"guard": {"name": "guard", "description": "A guard", "dialogue": ["Halt!"]}},
+    "puzzles": {"lock": {"name": "lock", "description": "A lock", "password": "open", "success_message": "Click."}},
+    "rules": [
+        {"use": "coin", "on": "guard", "needs_items": ["badge"], "message": "Come in.", "unlocks_room": "vault"},
+        {"use": "coin", "on": "guard", "message": "Not without a badge."},
+        {"use": "badge", "on": "guard", "needs_solved": ["lock"], "message": "Take this.", "gives_item": "crown"},
+        {"use": "coin", "on": "lock", "message": "The coin fits the lock. You win!", "wins": True}
+    ]
+}
+
+
+class TestRules(unittest.TestCase):
+    """Item on NPC and item on puzzle rules from the world file"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        path = os.path.join(self.folder.name, "rules.json")
+        with open(path, "w") as f:
+            json.dump(RULES_WORLD, f)
+        self.game = Game(CaptureUI(), path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_first_rule_that_holds_fires(self):
+        """Rules for the same item and target should be tried in order, checking their conditions"""
+        game = self.game
+        self.assertEqual(len(game.rules), 4)
+        game.process_command(("take", "coin"))
+        game.process_command(("use", "coin on guard"))
+        self.assertEqual(game.ui.lines[-1], "Not without a badge.")
+        self.assertTrue(game.vault.islocked)
+        game.process_command(("take", "badge"))
+        game.process_command(("use", "coin on guard"))
+        self.assertEqual(game.ui.lines[-1], "Come in.")
+        self.assertFalse(game.vault.islocked)
+
+    def test_effects(self):
+        """Rules should be able to give items, win the game and be used on puzzles"""
+        game = self.game
+        for line in ["take badge", "use badge on guard", "solve open", "use badge on guard"]:
+            game.process_command(parse_command(line))
+        self.assertTrue(game.player.backpack.check_item(game.crown))
+        self.assertNotIn("Take this.", game.ui.lines[:-1])
+        game.process_command(("take", "coin"))
+        game.process_command(("use", "coin on lock"))
+        self.assertTrue(game.game_won)
+
+    def test_full_backpack(self):
+        """A reward that wont fit in the backpack should be left in the room, not lost"""
+        game = self.game
+        game.player.backpack.capacity = 1
+        for line in ["take badge", "solve open", "use badge on guard"]:
+            game.process_command(parse_command(line))
+        self.assertEqual(game.ui.lines[-1], "Your backpack is too full for the crown, so it is left here.")
+        self.assertFalse(game.player.backpack.check_item(game.crown))
+        self.assertIn(game.crown, game.hall.items)
+
+    def test_given_twice(self):
+        """A rule firing again shouldnt make a second copy of what it gives"""
+        game = self.game
+        for line in ["take badge", "solve open", "use badge on guard", "use badge on guard"]:
+            game.process_command(parse_command(line))
+        self.assertEqual(game.ui.lines[-1], "You already have the crown.")
+        self.assertTrue(game.player.backpack.check_item(game.crown))
+        self.assertNotIn(game.crown, game.hall.items)
+
+    def test_default_world(self):
+        """The OpenAI HQ NPCs should react through rules, not code"""
+        game = new_game(CaptureUI())
+        self.assertEqual(len(game.rules), 2)
+        game.player.backpack.add_item(game.safety_handbook)
+        self.assertTrue(game.sama.use_item_with(game.safety_handbook, game))
+        self.assertFalse(game.agi_room.islocked)
+        self.assertFalse(game.sama.use_item_with(game.fan, game))
+        self.assertFalse(game.game_won)
+
+    def test_bad_rules(self):
+        """Rules on things that arent NPCs or puzzles, or with unknown ids, should be refused"""
+        for change in ({"on": "hall"}, {"use": "nothing"}, {"unlocks_room": "attic"}, {"needs_solved": ["coin"]},
+                       {"needs_items": [["coin"]]}, {"gives_item": {"id": "coin"}}):
+            broken = json.loads(json.dumps(RULES_WORLD))
+            broken["rules"][0].update(change)
+            with self.assertRaises(WorldError):
+                compile_world(broken)
+
+
+class TestCommands(unittest.TestCase):
+    """The command registry"""
+
+    def setUp(self):
+        self.ui = CaptureUI()
+        self.game = new_game(self.ui)
+
+    def test_command_words(self):
+        """Command words should come from the registry, inventory included"""
+        words = self.game.show_command_words()
+        self.assertIn("inventory", words)
+        self.assertIn("save", words)
+        self.game.process_command(("i", None))
+        self.assertEqual(self.ui.lines[-1], "Your backpack is empty")
+
+    def test_arity(self):
+        """Commands with the wrong number of words should be rejected before running"""
+        self.assertFalse(self.game.process_command(("quit", "now")))
+        self.assertEqual(self.ui.lines[-1], "'quit' doesn't need anything after it.")
+        self.game.process_command(("GO", None))
+        self.assertEqual(self.ui.lines[-1], "Go where?")
+        self.assertTrue(self.game.process_command(("quit", None)))
+
+    def test_bare_solve(self):
+        """A bare solve should say when there's no puzzle before asking for a solution"""
+        self.game.process_command(("solve", None))
+        self.assertEqual(self.ui.lines[-1], "There's no puzzle to solve here.")
+        self.game.player.current_room = self.game.roon_den
+        self.game.process_command(("solve", None))
+        self.assertEqual(self.ui.lines[-1], "What's your solution?")
+
+    def test_plain_ui(self):
+        """A UI that only has print should still be shown rooms"""
+        class PlainUI:
+            def __init__(self):
+                self.lines = []
+
+            def print(self, text):
+                self.lines.append(text)
+
+        ui = PlainUI()
+        game = new_game(ui)
+        for line in ("go south", "look", "go north", "goto lobby"):
+            game.process_command(parse_command(line))
+        self.assertTrue(ui.lines[0].startswith("Location: in the lobby"))
+        self.assertTrue(ui.lines[1].startswith("You see"))
+        self.assertEqual(ui.lines[-2], "You go south.")
+        self.assertTrue(ui.lines[-1].startswith("Location: in the lobby"))
+
+    def test_plugin_command(self):
+        """Plugins should be able to add commands to one game"""
+        self.game.commands = self.game.commands.copy()
+        self.game.commands.register("dance", lambda game: game.ui.print("You dance"), aliases=["boogie"])
+        self.game.process_command(("boogie", None))
+        self.assertEqual(self.ui.lines[-1], "You dance")
+        self.assertNotIn("dance", new_game().show_command_words())
+
+
+class TestBackpack(unittest.TestCase):
+    """The name indexed backpack"""
+
+    def test_lookup_and_order(self):
+        """Items should be found by name in any case and listed in the order added"""
+        backpack = Backpack(5)
+        fan = Item("fan", "A fan", True)
+        card = Item("Keycard", "A card", True)
+        backpack.add_item(card)
+        backpack.add_item(fan)
+        self.assertIs(backpack.get_item("KEYCARD"), card)
+        self.assertTrue(backpack.has_item("fan"))
+        self.assertEqual(backpack.get_inventory(), ["Keycard", "fan"])
+        self.assertFalse(backpack.add_item(fan))
+        self.assertTrue(backpack.remove_item(card))
+        self.assertFalse(backpack.remove_item(card))
+        self.assertEqual(backpack.contents, [fan])
+
+    def test_stacks_and_weight(self):
+        """Stacks should share a slot and weight should be limited"""
+        backpack = Backpack(1, max_weight=10)
+        coin = Item("coin", "A coin", True, stackable=True, weight=2)
+        self.assertTrue(backpack.add_item(coin, 3))
+        self.assertTrue(backpack.add_item(coin))
+        self.assertEqual(backpack.quantity("coin"), 4)
+        self.assertEqual(backpack.get_inventory(), ["coin x4"])
+        self.assertFalse(backpack.add_item(coin, 2))
+        self.assertFalse(backpack.add_item(Item("rock", "A rock", True)))
+        backpack.remove_item(coin, 4)
+        self.assertEqual((len(backpack), backpack.weight), (0, 0))
+
+    def test_bad_quantities(self):
+        """Adding none, fewer than none or a stack of something that doesnt stack should fail loudly"""
+        backpack = Backpack(5, max_weight=10)
+        coin = Item("coin", "A coin", True, stackable=True, weight=2)
+        fan = Item("fan", "A fan", True, weight=1)
+        for item, quantity in ((coin, 0), (coin, -3), (fan, 0), (fan, 2)):
+            with self.assertRaises(ValueError):
+                backpack.add_item(item, quantity)
+        self.assertEqual((len(backpack), backpack.weight), (0, 0))
+        self.assertTrue(backpack.add_item(fan))
+
+    def test_large_inventory_puzzle(self):
+        """Item puzzles should check a big backpack through its index"""
+        backpack = Backpack(10000)
+        items = [Item(f"junk-{i}", "Junk", True) for i in range(5000)]
+        for item in items:
+            backpack.add_item(item)
+        puzzle = Puzzle("Vault", "Needs lots of junk", "Open!", required_items=items[::2])
+        success, _ = puzzle.solve(items=backpack)
+        self.assertTrue(success)
+
+
+class TestRoomIndexes(unittest.TestCase):
+    """Finding things in a room by name"""
+
+    def setUp(self):
+        self.ui = CaptureUI()
+        self.game = new_game(self.ui)
+
+    def test_render_cache(self):
+        """Room text should only be made again when what it shows changes"""
+        lobby = self.game.lobby
+        text = lobby.show_items()
+        self.assertIs(lobby.show_items(), text)
+        self.assertIs(lobby.get_long_description(), new_game(CaptureUI()).lobby.get_long_description())
+        self.game.player.current_room = lobby
+        self.game.process_command(("take", "basic-keycard"))
+        self.assertEqual(lobby.show_items(), "You see no items in this room")
+        long_text = lobby.get_long_description()
+        lobby.set_exit("up", self.game.outside)
+        self.assertIsNot(lobby.get_long_description(), long_text)
+        self.assertIn("'up'", lobby.get_long_description())
+        lobby.add_npc(self.game.sama)
+        self.assertIn("Present: Sam Altman", lobby.get_long_description())
+
+    def test_lookup_by_word(self):
+        """A unique word of a name should be enough to find something"""
+        self.assertIs(self.game.money_room.get_npc("sam"), self.game.sama)
+        self.assertIs(self.game.roon_den.get_puzzle("PHONE"), self.game.roons_phone)
+        self.assertIs(self.game.lab.get_item("handbook"), self.game.safety_handbook)
+        self.assertIsNone(self.game.lab.get_item("fan"))
+
+    def test_add_and_remove(self):
+        """Names should be unique per room and removal should update the index"""
+        room = self.game.fan_closet
+        self.assertFalse(room.add_item(Item("fan", "Another fan", True)))
+        self.assertIs(room.remove_item(self.game.fan), self.game.fan)
+        self.assertNotIn("fan", room.items)
+        self.assertEqual(len(room.items), 0)
+
+    def test_take_removes_from_room(self):
+        """Taking something should move it out of the room"""
+        self.game.player.move_to(self.game.lobby)
+        self.game.process_command(("take", "Basic-Keycard"))
+        self.assertNotIn(self.game.basic_keycard, self.game.lobby.items)
+        self.assertIn("basic-keycard", self.game.player.get_inventory())
+
+    def test_target_specific_puzzle_and_npc(self):
+        """solve <puzzle> <answer> and speak <npc> should pick the right one"""
+        room = self.game.roon_den
+        room.add_puzzle(Puzzle("Safe", "A wall safe", "The safe opens", password="1234"))
+        self.game.player.current_room = room
+        self.game.process_command(("solve", "safe 1234"))
+        self.assertTrue(room.get_puzzle("safe").is_solved)
+        self.assertFalse(self.game.roons_phone.is_solved)
+        self.game.process_command(("solve", "phone xitter"))
+        self.assertTrue(self.game.roons_phone.is_solved)
+
+        self.game.money_room.add_npc(self.game.truth_terminal)
+        self.game.player.current_room = self.game.money_room
+        self.game.process_command(("speak", "terminal"))
+        self.assertEqual(self.ui.lines[-1], self.game.truth_terminal.dialogue[0])
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    """The asyncio game server"""
+
+    async def asyncSetUp(self):
+        self.server = GameServer(port=0, idle_timeout=0.2)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_sessions_are_separate(self):
+        """Each connection should get its own game"""
+        first = await asyncio.open_connection("127.0.0.1", self.server.port)
+        second = await asyncio.open_connection("127.0.0.1", self.server.port)
+        for reader, _ in (first, second):
+            welcome = await reader.readuntil(PROMPT.encode())
+            self.assertIn(b"You are Gary", welcome)
+        first[1].write(b"go south\n")
+        reply = await first[0].readuntil(PROMPT.encode())
+        self.assertIn(b"in the lobby", reply)
+        second[1].write(b"search\n")
+        reply = await second[0].readuntil(PROMPT.encode())
+        self.assertIn(b"You see no items in this room", reply)
+        self.assertEqual(len(self.server.sessions), 2)
+        for _, writer in (first, second):
+            writer.close()
+
+    async def test_idle_timeout(self):
+        """Idle players should be disconnected"""
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        await reader.readuntil(PROMPT.encode())
+        rest = await asyncio.wait_for(reader.read(), timeout=2)
+        self.assertIn(b"idle", rest)
+        writer.close()
+
+    async def test_saves_across_connections(self):
+        """A player should get back to their saves on a new connection by logging in with their key"""
+        with tempfile.TemporaryDirectory() as folder:
+            server = GameServer(port=0, idle_timeout=None, save_dir=folder)
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+                welcome = (await reader.readuntil(PROMPT.encode())).decode()
+                key = welcome.split("Your player key is ")[1].split(".")[0]
+                writer.write(b"go south\nsave\n")
+                await reader.readuntil(PROMPT.encode())
+                reply = await reader.readuntil(PROMPT.encode())
+                self.assertIn(b"Game saved successfully!", reply)
+                self.assertEqual(server.saves.slots(key), ["quicksave"])
+                writer.close()
+
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+                await reader.readuntil(PROMPT.encode())
+                writer.write(f"load\nlogin {key}\nload\n".encode())
+                self.assertIn(b"No saved game found!", await reader.readuntil(PROMPT.encode()))
+                self.assertIn(b"quicksave", await reader.readuntil(PROMPT.encode()))
+                self.assertIn(b"in the lobby", await reader.readuntil(PROMPT.encode()))
+                writer.close()
+            finally:
+                await server.close()
+
+    async def test_metrics_endpoint(self):
+        """Commands played on the server should show up in its metrics over HTTP"""
+        server = GameServer(port=0, idle_timeout=None, metrics_port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            await reader.readuntil(PROMPT.encode())
+            writer.write(b"go south\nGO north\n")
+            await reader.readuntil(PROMPT.encode())
+            await reader.readuntil(PROMPT.encode())
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.metrics_port)
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            reply = await reader.read()
+            self.assertTrue(reply.startswith(b"HTTP/1.0 200 OK"))
+            self.assertIn(b'agi_commands_total{verb="go"} 2', reply)
+            self.assertIn(b"agi_sessions_active 1", reply)
+        finally:
+            await server.close()
+
+
+class TestSaveGame(unittest.TestCase):
+    """Saving and loading games"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.game = new_game(CaptureUI())
+        self.game.saves = SaveStore(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def play(self, game, commands):
+        for line in commands:
+            game.process_command(parse_command(line))
+
+    def test_round_trip(self):
+        """Loading a slot should bring back everything that changed"""
+        self.play(self.game, WINNING_SCRIPT[:20])
+        self.play(self.game, ["speak", "save midgame"])
+        saved = capture(self.game)
+        self.play(self.game, WINNING_SCRIPT[20:])
+        self.assertTrue(self.game.game_won)
+
+        other = new_game(CaptureUI())
+        other.saves = self.game.saves
+        self.play(other, ["load midgame"])
+        self.assertEqual(capture(other), saved)
+        self.assertFalse(other.game_won)
+        self.play(other, WINNING_SCRIPT[20:])
+        self.assertTrue(other.game_won)
+
+    def test_sessions_and_slots(self):
+        """Each session should have its own slots"""
+        self.game.session_id = "player1"
+        self.play(self.game, ["go south", "save", "save spare"])
+        self.assertEqual(self.game.saves.slots("player1"), ["quicksave", "spare"])
+        self.assertEqual(self.game.saves.slots(), [])
+        self.play(self.game, ["load ../etc"])
+        self.assertIn("Slot names can only use letters, numbers, - and _.", self.game.ui.lines)
+
+        other = new_game(CaptureUI())
+        other.saves = self.game.saves
+        self.play(other, ["load"])
+        self.assertIn("No saved game found!", other.ui.lines)
+
+    def test_concurrent_writes(self):
+        """Threads writing the same file at once should each leave a whole file and no temporary ones"""
+        path = os.path.join(self.folder.name, "slot.sav")
+        errors = []
+
+        def write(number):
+            try:
+                for _ in range(50):
+                    write_atomic(path, bytes([number]) * 1000)
+            except OSError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(path, "rb") as f:
+            data = f.read()
+        self.assertEqual(data, data[:1] * 1000)
+        self.assertEqual(os.listdir(self.folder.name), ["slot.sav"])
+
+    def test_bad_saves(self):
+        """Saves from another world or broken files should leave the game alone"""
+        data = dumps(self.game)
+        self.play(self.game, ["go south"])
+        before = capture(self.game)
+        with self.assertRaises(SaveError):
+            loads(self.game, data[:-5])
+        with self.assertRaises(SaveError):
+            loads(self.game, data.replace(b"lobby", b"lobbx"))
+        with self.assertRaises(SaveError):
+            loads(self.game, data.replace(b"OpenAI HQ", b"Elsewhere"))
+        self.assertEqual(capture(self.game), before)
+
+
+class TestJournal(unittest.TestCase):
+    """Command journal and crash recovery"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = Journal(self.folder.name, snapshot_every=7)
+        self.game = new_game(CaptureUI())
+        self.journal.attach(self.game, "player1")
+
+    def tearDown(self):
+        self.journal.close()
+        self.folder.cleanup()
+
+    def play(self, commands):
+        for line in commands:
+            self.game.process_command(parse_command(line))
+
+    def test_recover(self):
+        """Recovering should give back everything committed, and nothing after"""
+        self.play(WINNING_SCRIPT[:20] + ["speak", "dance"])
+        self.journal.commit()
+        committed = capture(self.game)
+        self.journal.snapshot_every = 1000
+        self.play(WINNING_SCRIPT[20:])  # lost in the crash
+        self.assertTrue(self.game.game_won)
+
+        journal = Journal(self.folder.name)
+        recovered = journal.recover("player1", ui=CaptureUI())
+        self.assertEqual(capture(recovered), committed)
+        self.assertEqual(recovered.ui.lines, [])
+        for line in WINNING_SCRIPT[20:]:
+            recovered.process_command(parse_command(line))
+        self.assertTrue(recovered.game_won)
+        journal.close()
+
+    def test_load_and_torn_lines(self):
+        """load is snapshotted instead of logged, and half written lines are skipped"""
+        self.game.saves = SaveStore(self.folder.name)
+        self.play(["go south", "save", "go east", "load", "take basic-keycard"])
+        self.journal.commit()
+        with open(self.journal.segment_path(self.journal._segment), "ab") as f:
+            f.write(b"player1\t99\tgo")
+        log = self.journal.read_log()
+        self.assertEqual([word for _, word, _ in log["player1"]], ["go", "go", "take"])
+        recovered = Journal(self.folder.name).recover("player1", attach=False)
+        self.assertEqual(capture(recovered), capture(self.game))
+
+    def test_compact(self):
+        """Segments covered by snapshots should be deleted"""
+        self.journal.segment_size = 1
+        for _ in range(3):
+            self.play(["look"] * 7)
+            self.journal.commit()
+        self.assertEqual(len(self.journal.segments()), 3)
+        self.assertEqual(self.journal.compact(), 2)
+        self.assertEqual(self.journal.segments(), [self.journal._segment])
+        recovered = Journal(self.folder.name).recover("player1", attach=False)
+        self.assertEqual(capture(recovered), capture(self.game))
+
+    def test_committer(self):
+        """Snapshots should wait for the committer, which should compact the journal too"""
+        self.journal.segment_size = 1
+        self.journal.compact_interval = 0
+
+        async def play():
+            committer = asyncio.create_task(self.journal.run_committer())
+            for count in range(1, 4):
+                self.play(["look"] * 7)
+                self.assertNotEqual((self.journal.read_snapshot("player1") or [0])[0], count * 7)
+                await self.journal.sync()
+                self.assertEqual(self.journal.read_snapshot("player1")[0], count * 7)
+            await asyncio.sleep(0.05)
+            committer.cancel()
+
+        asyncio.run(play())
+        self.assertEqual(self.journal.segments(), [self.journal._segment])
+
+
+class TestStateCodec(unittest.TestCase):
+    """Packing game state into an int"""
+
+    def setUp(self):
+        self.game = new_game(CaptureUI())
+        self.codec = StateCodec.for_game(self.game)
+
+    def test_round_trip(self):
+        """Every state of a game should unpack into a game that packs the same"""
+        other = new_game(CaptureUI())
+        for line in WINNING_SCRIPT[:-1] + ["speak"]:
+            self.game.process_command(parse_command(line))
+            state = self.codec.encode(self.game)
+            self.codec.decode(other, state)
+            self.assertEqual(self.codec.encode(other), state)
+            self.assertEqual(other.player.current_room.entity_id, self.game.player.current_room.entity_id)
+            self.assertEqual(sorted(other.player.get_inventory()), sorted(self.game.player.get_inventory()))
+        self.assertEqual(self.codec.from_bytes(self.codec.to_bytes(state)), state)
+        self.assertEqual(self.codec.describe(state)["items"]["fan"], "backpack")
+
+    def test_canonical(self):
+        """The order things happened in shouldnt matter"""
+        other = new_game(CaptureUI())
+        for game, order in ((self.game, ["fan", "safety-handbook"]), (other, ["safety-handbook", "fan"])):
+            game.player.current_room = game.fan_closet
+            game.fan_closet.add_item(game.safety_handbook)
+            game.lab.remove_item(game.safety_handbook)
+            for name in order:
+                game.process_command(("take", name))
+        self.assertNotEqual(self.game.player.get_inventory(), other.player.get_inventory())
+        self.assertEqual(self.codec.encode(self.game), self.codec.encode(other))
+
+    def test_bad_state(self):
+        """States that dont fit the world should be refused"""
+        with self.assertRaises(ValueError):
+            self.codec.decode(self.game, 1 << self.codec.bits)
+        with self.assertRaises(ValueError):
+            self.codec.decode(self.game, (1 << self.codec._room_bits) - 1)
+
+    def test_big_stacks(self):
+        """Stacks should pack up to MAX_STACK, and bigger ones should be refused rather than cut short"""
+        world = dict(RULES_WORLD, items=dict(RULES_WORLD["items"], coin={"name": "coin", "description": "A coin",
+                                                                          "stackable": True, "weight": 0}))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "stacks.json")
+            with open(path, "w") as f:
+                json.dump(world, f)
+            game, other = Game(CaptureUI(), path), Game(CaptureUI(), path)
+        codec = StateCodec.for_game(game)
+        game.hall.remove_item(game.coin)
+        game.player.backpack.add_item(game.coin, MAX_STACK)
+        codec.decode(other, codec.encode(game))
+        self.assertEqual(list(other.player.backpack.stacks()), [(other.coin, MAX_STACK)])
+        game.player.backpack.add_item(game.coin)
+        with self.assertRaises(ValueError):
+            codec.encode(game)
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestVectorEngine(unittest.TestCase):
+    """Stepping many games at once with numpy"""
+
+    def setUp(self):
+        self.engine = VectorEngine(64)
+        self.games = [new_game(TextUI(NullSink())) for _ in range(self.engine.n)]
+        self.codec = StateCodec.for_game(self.games[0])
+        self.random = numpy.random.default_rng(1)
+
+    def step_both(self, actions):
+        for game, action in zip(self.games, actions):
+            if not game.game_won:
+                game.process_command(parse_command(self.engine.actions[action]))
+        self.engine.step(actions)
+        for index, game in enumerate(self.games):
+            self.assertEqual(self.engine.packed_state(index), self.codec.encode(game),
+                             f"game {index} after {self.engine.actions[actions[index]]}")
+
+    def test_parity_random(self):
+        """Random actions should have the same effect as on Game objects"""
+        for _ in range(100):
+            self.step_both(self.random.integers(0, len(self.engine.actions), self.engine.n))
+
+    def test_parity_winning(self):
+        """Games mostly following the solution (with random detours) should win in both engines"""
+        path = [self.engine.actions.index(command) for command in Solver().solve()]
+        position = numpy.zeros(self.engine.n, dtype=int)
+        for _ in range(60):
+            follow = self.random.random(self.engine.n) < 0.8
+            planned = numpy.array(path)[numpy.minimum(position, len(path) - 1)]
+            self.step_both(numpy.where(follow, planned, self.random.integers(0, len(self.engine.actions),
+                                                                              self.engine.n)))
+            position += follow
+        self.assertTrue(self.engine.won.any())
+        self.assertEqual(self.engine.won.tolist(), [game.game_won for game in self.games])
+
+    def test_parity_small_backpack(self):
+        """Rewards that dont fit should be left in the room in both engines"""
+        game = Game(TextUI(NullSink()))
+        game.player.backpack.capacity = 1
+        template = WorldTemplate(game)
+        self.engine = VectorEngine(16, template)
+        self.games = [template.new_game(TextUI(NullSink())) for _ in range(self.engine.n)]
+        path = [self.engine.actions.index(command) for command in Solver().solve()]
+        solve = self.engine.actions.index("solve Roon's Phone xitter")
+        for action in path[:path.index(solve) + 1] + [solve]:
+            self.step_both(numpy.full(self.engine.n, action))
+        self.assertIn(self.games[0].scientific_keycard, self.games[0].roon_den.items)
+        for _ in range(50):
+            self.step_both(self.random.integers(0, len(self.engine.actions), self.engine.n))
+
+    def test_reset(self):
+        """Reset should put chosen games back to the start"""
+        start = self.engine.packed_state(0)
+        self.engine.step(numpy.full(self.engine.n, self.engine.actions.index("go south")))
+        mask = numpy.arange(self.engine.n) % 2 == 0
+        self.engine.reset(mask)
+        self.assertEqual(self.engine.packed_state(0), start)
+        self.assertNotEqual(self.engine.packed_state(1), start)
+
+
+class TestEnv(unittest.TestCase):
+    """The RL environment"""
+
+    def setUp(self):
+        self.env = GameEnv(max_steps=50)
+
+    def test_winning_episode(self):
+        """Playing the solution should end the episode with a reward"""
+        start = self.env.reset(seed=0)
+        for command in Solver().solve():
+            observation, reward, done, info = self.env.step(self.env.actions.index(command))
+        self.assertTrue(done)
+        self.assertTrue(info["won"])
+        self.assertEqual(reward, 1.0)
+        self.assertNotEqual(observation, start)
+        self.assertEqual(self.env.reset(), start)
+        self.assertFalse(self.env.game.game_won)
+
+    def test_action_mask(self):
+        """Only actions that make sense where the player is should be allowed"""
+        self.env.reset()
+        allowed = {action for action, ok in zip(self.env.actions, self.env.action_mask()) if ok}
+        self.assertEqual(allowed, {"go south", "help", "search", "inventory"})
+        self.env.step(self.env.actions.index("go south"))
+        allowed = {action for action, ok in zip(self.env.actions, self.env.action_mask()) if ok}
+        self.assertIn("take basic-keycard", allowed)
+        self.assertNotIn("use basic-keycard", allowed)
+        self.assertNotIn("quit", self.env.actions)
+
+    def test_truncated(self):
+        """Episodes should be cut off after max_steps"""
+        self.env.reset(seed=3)
+        for _ in range(49):
+            _, reward, done, info = self.env.step(self.env.sample_action())
+            self.assertFalse(done)
+        _, reward, done, info = self.env.step(self.env.actions.index("help"))
+        self.assertTrue(done)
+        self.assertTrue(info["truncated"])
+        self.assertEqual(reward, 0.0)
+
+
+class TestNavigation(unittest.TestCase):
+    """Routes between rooms and the goto command"""
+
+    def setUp(self):
+        self.game = new_game(CaptureUI())
+
+    def test_goto(self):
+        """goto should walk the shortest unlocked route in one command"""
+        for line in WINNING_SCRIPT[:6]:
+            self.game.process_command(parse_command(line))
+        self.game.process_command(("goto", "outside"))
+        self.assertIs(self.game.player.current_room, self.game.outside)
+        self.assertIn("You go south, west, north.", self.game.ui.lines)
+        self.game.process_command(("goto", "GPU cluster"))
+        self.assertIs(self.game.player.current_room, self.game.outside)
+        self.assertIn("You can't get there from here.", self.game.ui.lines)
+        self.game.process_command(("goto", "narnia"))
+        self.assertIn("There's no narnia that you know of.", self.game.ui.lines)
+
+    def test_unlocking_updates_routes(self):
+        """Routes should follow doors being unlocked and locked"""
+        navigator = self.game.get_navigator()
+        self.assertIsNone(navigator.route(self.game.outside, self.game.roon_den))
+        for line in WINNING_SCRIPT[:5]:
+            self.game.process_command(parse_command(line))
+        self.assertEqual(navigator.route(self.game.outside, self.game.roon_den), ["south", "east", "north"])
+        self.game.corridor.islocked = True
+        self.assertIsNone(navigator.route(self.game.outside, self.game.roon_den))
+        self.assertEqual(navigator.route(self.game.corridor, self.game.roon_den), ["north"])
+
+    def test_new_exits(self):
+        """Routes should follow exits added after the navigator was made"""
+        navigator = self.game.get_navigator()
+        self.assertIsNone(navigator.route(self.game.outside, self.game.fan_closet))
+        self.game.lobby.set_exit("down", self.game.fan_closet)
+        self.assertEqual(navigator.route(self.game.outside, self.game.fan_closet), ["south", "down"])
+
+    def test_every_navigator_told(self):
+        """Two navigators over the same rooms should both follow lock changes"""
+        first = self.game.get_navigator()
+        second = Navigator(self.game.rooms.values())
+        for navigator in (first, second):
+            self.assertIsNone(navigator.route(self.game.lobby, self.game.corridor))
+        self.game.corridor.islocked = False
+        for navigator in (first, second):
+            self.assertEqual(navigator.route(self.game.lobby, self.game.corridor), ["east"])
+
+    def test_clones_get_their_own(self):
+        """Games cloned from a template shouldnt share a navigator"""
+        template = WorldTemplate(Game(CaptureUI()))
+        template.template.get_navigator()
+        game = template.new_game(CaptureUI())
+        self.assertIsNone(game.navigator)
+        self.assertIsNone(game.lobby.navigators)
+        self.assertIsNot(game.get_navigator(), template.template.navigator)
+
+
+class TestSolver(unittest.TestCase):
+    """Finding the shortest way to win"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.solver = Solver()
+        cls.path = cls.solver.solve()
+
+    def test_shortest_win(self):
+        """The solution should win and be no longer than the known one"""
+        self.assertIsNotNone(self.path)
+        self.assertLessEqual(len(self.path), len(WINNING_SCRIPT))
+        self.assertTrue(run_session(self.path).won)
+        self.assertGreater(self.solver.states_per_sec, 0)
+
+    def test_from_game_in_progress(self):
+        """Solving from halfway should reuse what the first search worked out"""
+        game = new_game(CaptureUI())
+        for line in self.path[:10]:
+            game.process_command(parse_command(line))
+        transitions = len(self.solver._transitions)
+        self.assertEqual(self.solver.solve(game), self.path[10:])
+        self.assertEqual(len(self.solver._transitions), transitions)
+
+    def test_unwinnable(self):
+        """Worlds with no way to win should say so"""
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "tiny.json")
+            with open(path, "w") as f:
+                json.dump(TINY_WORLD, f)
+            solver = Solver(WorldTemplate(Game(world_path=path)))
+            self.assertIsNone(solver.solve())
+            self.assertEqual(solver.states_explored, 4)
+
+    def test_generated_world(self):
+        """A generated world of a few hundred rooms should be solved quickly"""
+        world, solution = generate_world(250, 4)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "generated.json")
+            write_world(path, world)
+            solver = Solver(WorldTemplate(Game(CaptureUI(), path)))
+            found = solver.solve(max_states=20000)
+            self.assertIsNotNone(found)
+            self.assertLessEqual(len(found), len(solution))
+            self.assertLess(solver.elapsed, 30)
+            game = Game(CaptureUI(), path)
+            for line in found:
+                game.process_command(parse_command(line))
+            self.assertTrue(game.game_won)
+
+
+class CountingStream(io.StringIO):
+    """A StringIO that counts how often it is written to"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+class TestOutput(unittest.TestCase):
+    """Output sinks"""
+
+    def test_one_write_per_command(self):
+        """All of a command's output should be written in one go"""
+        stream = CountingStream()
+        game = new_game(TextUI(BufferedSink(stream)))
+        game.player.current_room = game.lobby
+        game.process_command(("search", None))
+        self.assertEqual(stream.writes, 0)
+        game.ui.flush()
+        self.assertEqual(stream.writes, 1)
+        self.assertEqual(stream.getvalue().count("\n"), 2)
+
+    def test_backpack_is_quiet(self):
+        """Dropping something you dont have shouldnt print to stdout"""
+        game = new_game(TextUI(NullSink()))
+        stream = io.StringIO()
+        sys_stdout, sys.stdout = sys.stdout, stream
+        try:
+            self.assertFalse(game.player.drop_item(game.fan))
+        finally:
+            sys.stdout = sys_stdout
+        self.assertEqual(stream.getvalue(), "")
+
+    def test_null_session(self):
+        """Sessions that dont keep output should still play normally"""
+        result = run_session(WINNING_SCRIPT, keep_output=False)
+        self.assertTrue(result.won)
+        self.assertEqual(result.output, [])
+
+
+class TestMetrics(unittest.TestCase):
+    """Command counters and latency histograms"""
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.game = new_game(CaptureUI())
+        self.metrics.attach(self.game)
+
+    def play(self, commands):
+        for line in commands:
+            self.game.process_command(parse_command(line))
+
+    def test_counters(self):
+        """Commands, failures and puzzle attempts should be counted per verb and reason"""
+        self.play(WINNING_SCRIPT[:6] + ["dance", "Go up", "take", "solve wrong", "solve xitter", "inv"])
+        verbs = self.metrics.verbs()
+        self.assertEqual(verbs["go"][0], 4)
+        self.assertEqual(verbs["go"][1].count, 4)
+        self.assertEqual(verbs["unknown"][0], 1)
+        self.assertEqual(verbs["inventory"][0], 1)
+        failures = self.metrics.failures
+        self.assertEqual((failures["unknown_command"], failures["bad_arguments"]), (1, 1))
+        self.assertEqual((failures["no_door"], failures["wrong_password"]), (1, 1))
+        self.assertEqual(self.metrics.puzzle_attempts, {"roons_phone": [1, 1]})
+
+    def test_typed_words(self):
+        """However many different words are typed, only verbs and one unknown should be counted"""
+        self.play([f"xyzzy{number}" for number in range(500)] + ["GO north", "Go south", "inv"])
+        verbs = self.metrics.verbs()
+        self.assertEqual(sorted(verbs), ["go", "inventory", "unknown"])
+        self.assertEqual((verbs["unknown"][0], verbs["go"][0]), (500, 2))
+
+    def test_registries(self):
+        """A word should count as what it stands for in each game's own commands"""
+        other = new_game(CaptureUI())
+        other.commands = other.commands.copy()
+        other.commands.register("dance", lambda game: game.ui.print("You dance"))
+        self.metrics.attach(other)
+        self.play(["danc"])
+        other.process_command(parse_command("danc"))
+        verbs = self.metrics.verbs()
+        self.assertEqual((verbs["unknown"][0], verbs["dance"][0]), (1, 1))
+        self.game.commands = self.game.commands.copy()
+        self.game.commands.register("dancer", lambda game: None)
+        self.play(["danc"])
+        self.assertEqual(self.metrics.verbs()["dancer"][0], 1)
+
+    def test_replay_not_counted(self):
+        """Commands replayed from a journal were counted when they first ran"""
+        replay(self.game, [("go", "west"), ("go", "south")])
+        self.assertIs(self.game.player.current_room, self.game.lobby)
+        self.assertEqual(self.metrics.failures["no_door"], 0)
+        self.assertEqual(self.metrics.verbs(), {})
+        self.assertIs(self.game.metrics, self.metrics)
+
+    def test_sessions(self):
+        """Detaching should stop measuring and count the session's length"""
+        self.play(WINNING_SCRIPT)
+        self.assertEqual(self.metrics.active_sessions, 1)
+        self.metrics.detach(self.game)
+        self.assertIsNone(self.game.metrics)
+        self.play(["go north"])
+        self.assertEqual(self.metrics.active_sessions, 0)
+        self.assertEqual(self.metrics.session_lengths.count, 1)
+        self.assertEqual(self.metrics.session_lengths.total, len(WINNING_SCRIPT))
+
+    def test_exports(self):
+        """Prometheus text and JSON snapshots should agree on the counts"""
+        self.play(["go south", "go east", "look"])
+        snapshot = json.loads(self.metrics.to_json())
+        self.assertEqual(snapshot["commands"]["go"]["run"], 2)
+        self.assertEqual(snapshot["commands"]["go"]["seconds"]["buckets"][-1][1], 2)
+        self.assertEqual(snapshot["failures"]["locked_door"], 1)
+        text = self.metrics.to_prometheus()
+        self.assertIn('agi_commands_total{verb="search"} 1\n', text)
+        self.assertIn('agi_command_seconds_bucket{verb="go",le="+Inf"} 2\n', text)
+        self.assertIn('agi_command_failures_total{reason="locked_door"} 1\n', text)
+        self.assertIn("# TYPE agi_session_commands histogram", text)
+
+    def test_sampling(self):
+        """With sample_every every command should be counted but only some timed"""
+        metrics = Metrics(sample_every=3)
+        game = new_game(CaptureUI())
+        metrics.attach(game)
+        for _ in range(9):
+            game.process_command(("inventory", None))
+        run, histogram = metrics.verbs()["inventory"]
+        self.assertEqual((run, histogram.count), (9, 3))
+
+
+class TestMatcher(unittest.TestCase):
+    """Prefixes, typos and tab completion"""
+
+    def test_matcher(self):
+        """Unique prefixes and words one typo away should match, anything ambiguous shouldnt"""
+        matcher = Matcher(["take", "talk", "go", "goto", "north", "south", "safety-handbook"])
+        self.assertEqual(matcher.match("GO"), "go")
+        self.assertEqual(matcher.match("n"), "north")
+        self.assertEqual(matcher.match("safety"), "safety-handbook")
+        self.assertIsNone(matcher.match("ta"))
+        self.assertEqual(matcher.match("tkae"), "take")  # swapped
+        self.assertEqual(matcher.match("sout"), "south")  # prefix
+        self.assertEqual(matcher.match("soutth"), "south")  # added
+        self.assertEqual(matcher.match("safety handbook"), "safety-handbook")  # changed
+        self.assertEqual(matcher.match("tlk"), "talk")  # missing
+        self.assertIsNone(matcher.match("tale"))  # take or talk
+        self.assertIsNone(matcher.match("nrth south"))
+        self.assertEqual(matcher.complete("go"), ["go", "goto"])
+
+    def test_sloppy_commands(self):
+        """Typos and prefixes in verbs, directions, items and NPC names should still work"""
+        game = new_game(CaptureUI())
+        for line in ["go sout", "tkae basic", "inventroy", "use basic keycard", "Go East"]:
+            game.process_command(parse_command(line))
+        self.assertIs(game.player.current_room, game.corridor)
+        self.assertIn("Your backpack contains: basic-keycard", game.ui.lines)
+        game.player.current_room = game.money_room
+        game.process_command(parse_command("speak sma altman"))
+        self.assertIn(game.sama.dialogue[0], game.ui.lines)
+        game.process_command(parse_command("tke fna"))
+        self.assertEqual(game.ui.lines[-1], "There is no fna here")
+
+    def test_exact_commands(self):
+        """Near misses of quit, save and load shouldnt run them, only their words and aliases should"""
+        with tempfile.TemporaryDirectory() as folder:
+            game = new_game(CaptureUI())
+            game.saves = SaveStore(folder)
+            for line in ["e", "ext", "exits", "quiet", "lad", "loads", "sav"]:
+                self.assertFalse(game.process_command(parse_command(line)), line)
+                self.assertEqual(game.ui.lines[-1], "Don't know what you mean.", line)
+            self.assertEqual(game.saves.slots(), [])
+            self.assertEqual(game.complete("ex"), ["exit"])
+            self.assertTrue(game.process_command(parse_command("EXIT")))
+
+    def test_names_here(self):
+        """Only names in the room or backpack should count, so ones elsewhere dont make a prefix ambiguous"""
+        game = new_game(CaptureUI())
+        game.process_command(("go", "south"))
+        game.process_command(parse_command("take b"))  # not the book in the reactor
+        self.assertEqual(game.ui.lines[-1], "You took the basic-keycard")
+        game.player.current_room = game.lab
+        game.process_command(parse_command("take s"))
+        self.assertEqual(game.ui.lines[-1], "You took the safety-handbook")
+        game.process_command(parse_command("use b"))
+        self.assertNotIn("You don't have a b", game.ui.lines)
+        west = game.lab.get_exit("west")
+        game.process_command(parse_command("go w"))
+        self.assertIs(game.player.current_room, west)
+
+    def test_completion(self):
+        """Tab completion should offer commands, then what they can be used on here"""
+        game = new_game(CaptureUI())
+        self.assertEqual(game.complete("ta"), ["take", "talk"])
+        self.assertEqual(game.complete("go "), ["go south"])
+        game.process_command(("go", "south"))
+        self.assertEqual(game.complete("go "), ["go east", "go north", "go south"])
+        self.assertEqual(game.complete("take b"), ["take basic-keycard"])
+        game.process_command(("take", "basic-keycard"))
+        self.assertEqual(game.complete("use basic-keycard on "), [])
+        ui = game.ui
+        ui._complete = game.complete
+        self.assertEqual([ui.completer("go n", state) for state in range(2)], ["go north", None])
+
+
+class TestWorldGen(unittest.TestCase):
+    """Generated worlds"""
+
+    def test_solution_wins(self):
+        for rooms, seed, zone_size in [(40, 0, 20), (120, 3, 8), (500, 7, 20)]:
+            world, solution = generate_world(rooms, seed, zone_size)
+            self.assertEqual(len(world["rooms"]), rooms)
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "generated.json")
+                write_world(path, world)
+                game = Game(CaptureUI(), path)
+                for line in solution:
+                    self.assertFalse(game.game_won)
+                    game.process_command(parse_command(line))
+                self.assertTrue(game.game_won)
+
+    def test_seeded(self):
+        self.assertEqual(generate_world(60, 5), generate_world(60, 5))
+        self.assertNotEqual(generate_world(60, 5)[0], generate_world(60, 6)[0])
+
+    def test_bad_sizes(self):
+        with self.assertRaises(ValueError):
+            WorldGenerator(rooms=5)
+        with self.assertRaises(ValueError):
+            WorldGenerator(zone_size=2)
+
+
+class TestWorldStore(unittest.TestCase):
+    """Worlds played from a memory mapped store, a room at a time"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_store_file(self):
+        world = load_world()
+        path = os.path.join(self.folder.name, "hq.store")
+        write_store(world, path)
+        store = WorldStore(path)
+        self.assertEqual((store.name, store.start_room), (world.name, world.start_room))
+        self.assertEqual(len(store.rooms), len(world.rooms))
+        for index, row in enumerate(world.items):
+            self.assertEqual(store.items[index], row)
+            self.assertEqual(store.items.find(row[0]), index)
+        self.assertEqual(list(store.rooms.idents()), [row[0] for row in world.rooms])
+        self.assertIsNone(store.rooms.find("nowhere"))
+        self.assertEqual(store.directions, ("east", "north", "south", "west"))
+        store.close()
+        with open(path, "wb") as f:
+            f.write(b"not a store")
+        with self.assertRaises(WorldError):
+            WorldStore(path)
+
+    def test_winning_script(self):
+        """A game with a tiny room cache should play like any other"""
+        game = StoreGame(CaptureUI(), cache_size=2)
+        self.assertEqual(game.cache.loads, 1)
+        self.assertIs(game.lobby, game.rooms["lobby"])
+        self.assertIs(game.player.current_room, game.outside)
+        for line in WINNING_SCRIPT:
+            game.process_command(parse_command(line))
+        self.assertTrue(game.game_won)
+        game = StoreGame(CaptureUI(), cache_size=2)
+        for line in ["go south", "take basic-keycard", "use basic-keycard", "goto corridor"]:
+            game.process_command(parse_command(line))
+        self.assertIs(game.player.current_room, game.corridor)
+
+    def test_dropped_rooms_are_written_back(self):
+        game = StoreGame(CaptureUI(), cache_size=1)
+        for line in ["go south", "take basic-keycard", "use basic-keycard", "go north"]:
+            game.process_command(parse_command(line))
+        loads = game.cache.loads
+        self.assertIn(game.world.rooms.find("lobby"), game.cache.overlay)
+        game.process_command(("go", "south"))
+        self.assertGreater(game.cache.loads, loads)
+        self.assertIsNone(game.player.current_room.get_item("basic-keycard"))
+        self.assertFalse(game.corridor.islocked)
+
+    def test_generated_world(self):
+        """Startup should only make the start room, and a big world should still be winnable"""
+        world, solution = generate_world(300, 2, zone_size=10)
+        path = os.path.join(self.folder.name, "generated.json")
+        write_world(path, world)
+        store = open_store(path)
+        self.assertEqual(store.path, store_path(path))
+        self.assertIs(open_store(path), store)
+        game = StoreGame(CaptureUI(), path, cache_size=8)
+        self.assertEqual(game.cache.loads, 1)
+        for line in solution:
+            game.process_command(parse_command(line))
+        self.assertTrue(game.game_won)
+        self.assertTrue(game.cache.overlay)
+
+
+class TestSharding(unittest.TestCase):
+    """Sessions spread over worker processes"""
+
+    def test_rendezvous_owner(self):
+        """Removing a worker should only move that worker's sessions"""
+        workers = ["shard-0", "shard-1", "shard-2", "shard-3"]
+        sessions = [f"player{n}" for n in range(200)]
+        owners = {session: rendezvous_owner(session, workers) for session in sessions}
+        self.assertEqual(set(owners.values()), set(workers))
+        self.assertEqual(owners, {session: rendezvous_owner(session, workers[::-1]) for session in sessions})
+        left = [worker for worker in workers if worker != "shard-2"]
+        for session in sessions:
+            owner = rendezvous_owner(session, left)
+            if owners[session] == "shard-2":
+                self.assertIn(owner, left)
+            else:
+                self.assertEqual(owner, owners[session])
+        self.assertIsNone(rendezvous_owner("player0", []))
+
+    def test_dead_worker(self):
+        """Sessions of a worker that died should carry on from its journal on the others"""
+        sessions = [f"player{n}" for n in range(12)]
+        with tempfile.TemporaryDirectory() as folder:
+            host = ShardedHost(workers=3, journal_dir=folder)
+            try:
+                host.start()
+                for session in sessions:
+                    self.assertTrue(host.open(session))
+                for line in WINNING_SCRIPT[:10]:
+                    host.send_many([(session, line) for session in sessions])
+                owners = {session: host.owner(session) for session in sessions}
+                dead = owners[sessions[0]]
+                host._shards[dead].process.kill()
+                for line in WINNING_SCRIPT[10:]:
+                    answers = host.send_many([(session, line) for session in sessions])
+                self.assertTrue(all(finished for _, finished in answers))
+                self.assertNotIn(dead, host.workers)
+                moved = [session for session in sessions if host.owner(session) != owners[session]]
+                self.assertTrue(moved)
+                self.assertTrue(all(owners[session] == dead for session in moved))
+                self.assertEqual(set(host.stats()), set(host.workers))
+            finally:
+                host.close()
+
+    def test_dead_after_commit(self):
+        """A command committed by a worker that died before answering should not run again"""
+        session = "player0"
+        with tempfile.TemporaryDirectory() as folder:
+            host = ShardedHost(workers=2, journal_dir=folder)
+            try:
+                host.start()
+                host.open(session)
+                for line in WINNING_SCRIPT[:27]:
+                    host.send(session, line)
+                self.assertEqual(host._sequences[session], 27)
+                dead = host.owner(session)
+                host.send(session, "speak")  # committed and answered...
+                host._sequences[session] = 27  # ...but as if the answer never came back
+                host._shards[dead].process.kill()
+                self.assertEqual(host.send(session, "speak"), ([], False))
+                self.assertNotEqual(host.owner(session), dead)
+                game = new_game(CaptureUI())
+                for line in WINNING_SCRIPT[:27] + ["speak", "speak"]:
+                    game.ui.sink.clear()
+                    game.process_command(parse_command(line))
+                self.assertEqual(host.send(session, "speak"), (game.ui.lines, False))
+            finally:
+                host.close()
+
+    def test_failed_request(self):
+        """A request that fails should not leave other workers' answers unread"""
+        host = ShardedHost(workers=2)
+        try:
+            host.start()
+            first = "player0"
+            second = next(session for session in (f"player{n}" for n in range(1, 50))
+                          if host.owner(session) != host.owner(first))
+            with self.assertRaises(ValueError):
+                host._request([("bogus", first, None), ("command", second, "go south")])
+            lines, _ = host.send(second, "inventory")
+            self.assertEqual(lines, ["Your backpack is empty"])
+            self.assertEqual(host._homes[second], host.owner(second))
+        finally:
+            host.close()
+
+
+class TestMultiplayer(unittest.TestCase):
+    """Many players in one world"""
+
+    def setUp(self):
+        self.world = SharedWorld()
+        self.alice = self.world.join("alice", CaptureUI())
+        self.bob = self.world.join("bob", CaptureUI())
+
+    def play(self, game, *lines):
+        game.ui.sink.clear()
+        for line in lines:
+            game.process_command(parse_command(line))
+        return game.ui.lines
+
+    def test_shared_world(self):
+        """What one player takes, drops or unlocks should be the same for the others"""
+        self.play(self.alice, "go south", "take basic-keycard")
+        self.assertEqual(self.play(self.bob, "go south", "take basic-keycard")[-1], "There is no basic-keycard here")
+        self.play(self.alice, "use basic-keycard")
+        self.play(self.bob, "go east")
+        self.assertIs(self.bob.player.current_room, self.world.game.corridor)
+        self.assertEqual(self.play(self.alice, "go east", "drop basic-keycard")[-1], "You dropped the basic-keycard")
+        self.assertEqual(self.play(self.bob, "take basic-keycard"), ["You took the basic-keycard"])
+        self.assertRaises(ValueError, self.world.join, "bob")
+
+    def test_puzzle_reward(self):
+        """Only the first player to solve a puzzle should get what it gives"""
+        self.play(self.alice, *WINNING_SCRIPT[:7])
+        self.play(self.bob, "go south", "go east", "go north", "solve xitter")
+        self.assertTrue(self.alice.player.has_item("scientific-keycard"))
+        self.assertFalse(self.bob.player.has_item("scientific-keycard"))
+        self.world.leave("alice")
+        self.assertIn("scientific-keycard", self.world.game.roon_den.items)
+        self.assertEqual(self.play(self.bob, "take scientific-keycard"), ["You took the scientific-keycard"])
+
+    def test_stress(self):
+        """Players hammering take, drop and use on threads should never copy or lose an item"""
+        games = [self.alice, self.bob] + [self.world.join(f"player{number}", TextUI(NullSink()))
+                                          for number in range(6)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=wander, args=(game, 3000, number)) for number, game in enumerate(games)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        places = [item for room in self.world.game.rooms.values() for item in room.items]
+        places += [item for game in games for item in game.player.backpack]
+        self.assertEqual(len(places), len(set(places)))
+        given = {puzzle.gives_items for puzzle in self.world.game.puzzles.values()
+                 if puzzle.gives_items and puzzle.is_solved}
+        self.assertEqual(set(places), set(self.world.game.items.values()) - {
+            puzzle.gives_items for puzzle in self.world.game.puzzles.values() if puzzle.gives_items} | given)
+        unlocks = sum(line.startswith("You use the level") for game in games[:2] for line in game.ui.lines)
+        doors = [room for room in self.world.game.rooms.values() if room.required_keycard_level > 0]
+        self.assertLessEqual(unlocks, sum(not room.islocked for room in doors))
+
+
+class TestBenchmark(unittest.TestCase):
+    """The benchmark suite's baseline and regression checks"""
+
+    def test_compare(self):
+        """Only results worse than the baseline by more than the threshold should count"""
+        baseline = {"fast": (10.0, "us"), "slow": (10.0, "us"), "zero": (0.0, "us")}
+        results = {"fast": (12.0, "us"), "slow": (16.0, "us"), "zero": (5.0, "us"), "new": (1.0, "us")}
+        regressions = compare(results, baseline, threshold=0.5)
+        self.assertEqual([name for name, *_ in regressions], ["slow"])
+        self.assertAlmostEqual(regressions[0][3], 0.6)
+        self.assertEqual(compare(results, baseline, threshold=1.0), [])
+
+    def test_steady_units(self):
+        """Only memory and ratios should be compared when timings are advisory"""
+        baseline = {"command.go": (3.0, "us"), "memory.Game()": (10000.0, "bytes"), "ratio.x": (0.4, "x")}
+        results = {"command.go": (9.0, "us"), "memory.Game()": (16000.0, "bytes"), "ratio.x": (0.5, "x")}
+        regressions = compare(results, baseline, threshold=0.5, units=STEADY_UNITS)
+        self.assertEqual([name for name, *_ in regressions], ["memory.Game()"])
+        self.assertEqual(len(compare(results, baseline, threshold=0.5)), 2)
+
+    def test_median_results(self):
+        """One slow run should not make a timing fail"""
+        runs = [{"command.go": (3.0, "us")}, {"command.go": (30.0, "us")}, {"command.go": (3.2, "us")}]
+        results = median_results(runs)
+        self.assertEqual(results, {"command.go": (3.2, "us")})
+        self.assertEqual(compare(results, {"command.go": (3.0, "us")}, threshold=0.5), [])
+        self.assertEqual(median_results(runs[:2]), {"command.go": (16.5, "us")})
+
+    def test_baseline_file(self):
+        """A saved baseline should load back with its threshold"""
+        results = {"command.go": (3.25, "us"), "memory.Game()": (17000.0, "bytes")}
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "baseline.json")
+            save_baseline(path, results, threshold=0.2)
+            self.assertEqual(load_baseline(path), (results, 0.2))
+
+    def test_command_cases(self):
+        """Every verb should be timed doing something, not failing on bad arguments"""
+        results = bench_commands(number=2, repeat=1)
+        self.assertEqual(set(results), set(COMMAND_CASES))
+        for verb, (played, line) in COMMAND_CASES.items():
+            game = new_game(CaptureUI())
+            for command in WINNING_SCRIPT[:played]:
+                game.process_command(parse_command(command))
+            game.ui.sink.clear()
+            game.process_command(parse_command(line))
+            self.assertNotIn(game.ui.lines[0], [command.usage for command in game.commands], line)
+
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
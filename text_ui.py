@@ -2,31 +2,47 @@
 A simple text based User Interface (UI) for the Adventure World game.
 """
 
+from output import BufferedSink, CaptureSink
+
+
+def parse_command(input_line):
+    """
+        Splits a line of input into a command.
+    :param input_line: The raw line typed by the player
+    :return: a 2-tuple of the form (command_word, second_word)
+    """
+    all_words = input_line.split()
+    if not all_words:
+        return (None, None)
+    if len(all_words) > 1:
+        return (all_words[0], ' '.join(all_words[1:]))
+    return (all_words[0], None)
+
 
 class TextUI:
-    """A simple text based User Interface (UI) for the Adventure World game."""
+    """
+    A simple text based User Interface (UI) for the Adventure World game.
+    Everything printed goes to an output sink (see output.py) which by
+    default holds it until the next command is asked for, then writes it
+    to the console in one go.
+    """
 
-    def __init__(self):
-        # Nothing to do...
-        pass
+    def __init__(self, sink=None):
+        """
+        :param sink: Where printed text goes (default: a BufferedSink on stdout)
+        """
+        self.sink = sink if sink is not None else BufferedSink()
+        # Nobody reads the output, so commands neednt describe rooms etc.
+        self.quiet = self.sink.discards
 
     def get_command(self):
         """
-            Fetches a command from the console.
+            Fetches a command from the console, after showing any output
+            still waiting to be shown.
         :return: a 2-tuple of the form (command_word, second_word)
         """
-        word1 = None
-        word2 = None
-        print('> ', end='')
-        input_line = input()
-        if input_line != "":
-            all_words = input_line.split()
-            word1 = all_words[0]
-            if len(all_words) > 1:
-                word2 = ' '.join(all_words[1:])
-            else:
-                word2 = None
-        return (word1, word2)
+        self.sink.flush()
+        return parse_command(input('> '))
 
     def print(self, text):
         """
@@ -34,4 +50,60 @@ class TextUI:
         :param text: Text to be displayed
         :return: None
         """
-        print(text)
+        self.sink.write(text)
+
+    def flush(self):
+        """
+            Makes sure everything printed so far has been shown.
+        :return: None
+        """
+        self.sink.flush()
+
+    def enable_completion(self, complete):
+        """
+            Turns on tab completion of commands at the console, if readline
+            is available.
+        :param complete: Function from the line typed so far to the lines it could become
+            (eg Game.complete)
+        :return: True if completion is on
+        """
+        try:
+            import readline
+        except ImportError:  # not on every platform
+            return False
+        self._complete = complete
+        self._completions = []
+        readline.set_completer_delims("")  # complete whole lines, names can have spaces
+        readline.set_completer(self.completer)
+        readline.parse_and_bind("tab: complete")
+        return True
+
+    def completer(self, text, state):
+        """
+            The readline completer: the state'th way the line so far could go on.
+        :param text: The line typed so far
+        :param state: Which completion readline wants (0, 1, 2...)
+        :return: The completion, or None when there are no more
+        """
+        if state == 0:
+            self._completions = self._complete(text)
+        return self._completions[state] if state < len(self._completions) else None
+
+
+class CaptureUI(TextUI):
+    """A UI that keeps everything printed in memory instead of the console."""
+
+    def __init__(self):
+        super().__init__(CaptureSink())
+
+    @property
+    def lines(self):
+        """Every line printed so far"""
+        return self.sink.lines
+
+    def get_command(self):
+        """
+            A captured UI has no console to read commands from.
+        :return: None
+        """
+        raise RuntimeError("CaptureUI cannot read commands, pass them to Game.process_command")
@@ -0,0 +1,289 @@
+"""
+Vectorised engine - steps thousands of copies of a world at once with NumPy.
+
+Game objects are fine for players but far too slow for training agents on
+tens of thousands of games in parallel. A VectorEngine keeps the state of
+N games of one world in NumPy arrays instead:
+
+    room        int (N,)             the player's room in each game
+    locked      bool (N, rooms)      which rooms are locked
+    location    int (N, items)       where each item is (0 = gone,
+                                     1 = backpack, 2 + n = room n)
+    solved      bool (N, puzzles)    which puzzles are solved
+    dialogue    int (N, NPCs)        how far each NPC's dialogue has got
+    won         bool (N,)            which games are won
+
+and applies one discrete action per game in a single call to step(),
+with the same rules as Game.process_command. The actions are the
+commands below, numbered in this order (see VectorEngine.actions):
+
+    go <direction>          for every direction used in the world
+    take <item>             for every item
+    use <item>              for every item (on the room's puzzle or NPC)
+    solve <puzzle> <password>   for every password puzzle
+    speak
+
+Everything the rules need is turned into lookup tables once per world:
+the exit table (room, direction) -> room, keycard levels, each room's
+first puzzle and NPC, the items each puzzle needs, and what each NPC does
+when shown each item, read from the world's rules (see rules.py). Only
+plain rules on NPCs are supported: a world with rules on puzzles, rules
+that give items or rules with conditions raises ValueError.
+
+Locks and the backpack are boolean arrays rather than packed integer
+bitmasks so worlds can have any number of rooms and items; NumPy stores
+them a byte per flag and works on them just as quickly.
+
+Text is never generated. packed_state() gives a game's state in the
+StateCodec format, which is how the parity tests compare this engine
+with the object one.
+
+Needs NumPy.
+"""
+
+import numpy as np
+
+from state import StateCodec
+from template import WorldTemplate
+
+
+GO, TAKE, USE, SOLVE, SPEAK = range(5)
+
+GONE, BACKPACK, FIRST_ROOM = 0, 1, 2
+
+
+class VectorEngine:
+    """
+    N games of one world, stepped together.
+
+    Attributes:
+        n: How many games
+        actions: The command for each action number
+        room, locked, location, solved, dialogue, won: The state arrays (see above)
+    """
+
+    def __init__(self, n, template=None):
+        self.n = n
+        self.template = template if template is not None else WorldTemplate()
+        game = self.template.template
+        world = game.world
+        self.codec = StateCodec(world)
+        rooms = list(game.rooms.values())
+        items = list(game.items.values())
+        puzzles = list(game.puzzles.values())
+        npcs = list(game.npcs.values())
+        room_index = {id(room): index for index, room in enumerate(rooms)}
+        item_index = {id(item): index for index, item in enumerate(items)}
+        npc_index = {id(npc): index for index, npc in enumerate(npcs)}
+        puzzle_index = {id(puzzle): index for index, puzzle in enumerate(puzzles)}
+
+        directions = []
+        for room in rooms:
+            directions += [direction for direction in room.exits if direction not in directions]
+        self.exits = np.full((len(rooms), len(directions)), -1, dtype=np.int32)
+        for r, room in enumerate(rooms):
+            for direction, target in room.exits.items():
+                self.exits[r, directions.index(direction)] = room_index[id(target)]
+        self.door_level = np.array([room.required_keycard_level for room in rooms], dtype=np.int32)
+        self.first_puzzle = np.array([puzzle_index[id(room.puzzles.first())] if room.puzzles else -1
+                                      for room in rooms], dtype=np.int32)
+        self.first_npc = np.array([npc_index[id(room.npcs.first())] if room.npcs else -1
+                                   for room in rooms], dtype=np.int32)
+
+        self.can_take = np.array([item.can_be_taken for item in items], dtype=bool)
+        self.is_keycard = np.array([item.is_keycard for item in items], dtype=bool)
+        self.keycard_level = np.array([item.keycard_level for item in items], dtype=np.int32)
+        self.weight = np.array([item.weight for item in items], dtype=np.int64)
+        self.capacity = game.player.backpack.capacity
+        self.max_weight = game.player.backpack.max_weight
+
+        self.required = np.zeros((len(puzzles), len(items)), dtype=bool)
+        for p, puzzle in enumerate(puzzles):
+            for item in puzzle.required_items:
+                self.required[p, item_index[id(item)]] = True
+        self.needs_items = self.required.any(axis=1)
+        self.unlocks = np.array([room_index[id(puzzle.unlocks_room)] if puzzle.unlocks_room else -1
+                                 for puzzle in puzzles], dtype=np.int32)
+        self.gives = np.array([item_index[id(puzzle.gives_items)] if puzzle.gives_items else -1
+                               for puzzle in puzzles], dtype=np.int32)
+        self.puzzle_room = np.full(len(puzzles), -1, dtype=np.int32)
+        for r, room in enumerate(rooms):
+            for puzzle in room.puzzles:
+                self.puzzle_room[puzzle_index[id(puzzle)]] = r
+        self.dialogue_last = np.array([max(len(npc.dialogue) - 1, 0) for npc in npcs], dtype=np.int32)
+        self.reaction_unlocks, self.reaction_wins = self._find_reactions(game, room_index, item_index, npc_index)
+
+        self.actions = [f"go {direction}" for direction in directions]
+        self.actions += [f"take {item.name}" for item in items]
+        self.actions += [f"use {item.name}" for item in items]
+        password_puzzles = [p for p, puzzle in enumerate(puzzles) if puzzle.password is not None]
+        self.actions += [f"solve {puzzles[p].name} {puzzles[p].password}" for p in password_puzzles]
+        self.actions.append("speak")
+        self.action_kind = np.array([GO] * len(directions) + [TAKE] * len(items) + [USE] * len(items)
+                                    + [SOLVE] * len(password_puzzles) + [SPEAK], dtype=np.int8)
+        self.action_arg = np.array(list(range(len(directions))) + list(range(len(items))) * 2
+                                   + password_puzzles + [0], dtype=np.int32)
+
+        self._start_room = room_index[id(game.player.current_room)]
+        self._start_locked = np.array([room.islocked for room in rooms], dtype=bool)
+        self._start_location = np.zeros(len(items), dtype=np.int32)
+        for r, room in enumerate(rooms):
+            for item in room.items:
+                self._start_location[item_index[id(item)]] = FIRST_ROOM + r
+        for item in game.player.backpack:
+            self._start_location[item_index[id(item)]] = BACKPACK
+        self._start_solved = np.array([puzzle.is_solved for puzzle in puzzles], dtype=bool)
+        self._start_dialogue = np.array([npc.dialogue_counter for npc in npcs], dtype=np.int32)
+
+        self.room = np.empty(n, dtype=np.int32)
+        self.locked = np.empty((n, len(rooms)), dtype=bool)
+        self.location = np.empty((n, len(items)), dtype=np.int32)
+        self.solved = np.empty((n, len(puzzles)), dtype=bool)
+        self.dialogue = np.empty((n, len(npcs)), dtype=np.int32)
+        self.won = np.empty(n, dtype=bool)
+        self.reset()
+
+    def _find_reactions(self, game, room_index, item_index, npc_index):
+        """
+        What each NPC does when shown each item, from the world's rules:
+        (rooms unlocked (npcs, items, rooms), wins (npcs, items))
+        """
+        unlocks = np.zeros((len(npc_index), len(item_index), len(room_index)), dtype=bool)
+        wins = np.zeros((len(npc_index), len(item_index)), dtype=bool)
+        for (target, item), rules in game.rules.items():
+            if target not in game.npcs or any(rule.conditional or rule.gives_item for rule in rules):
+                raise ValueError(f"the rule for using {item} on {target} isn't supported by the vector engine")
+            npc, item = npc_index[id(game.npcs[target])], item_index[id(game.items[item])]
+            rule = rules[0]
+            if rule.unlocks_room is not None:
+                unlocks[npc, item, room_index[id(game.rooms[rule.unlocks_room])]] = True
+            wins[npc, item] = rule.wins
+        return unlocks, wins
+
+    def reset(self, mask=None):
+        """Puts every game (or the games where mask is True) back to the start"""
+        if mask is None:
+            mask = slice(None)
+        self.room[mask] = self._start_room
+        self.locked[mask] = self._start_locked
+        self.location[mask] = self._start_location
+        self.solved[mask] = self._start_solved
+        self.dialogue[mask] = self._start_dialogue
+        self.won[mask] = False
+
+    def step(self, actions):
+        """
+        Runs one action in every game that isnt won yet.
+
+        Args:
+            actions: Action number per game, shape (n,)
+
+        Returns:
+            Which games are won, shape (n,)
+        """
+        actions = np.asarray(actions)
+        kind = self.action_kind[actions]
+        arg = self.action_arg[actions]
+        playing = ~self.won
+        for which, run in ((GO, self._go), (TAKE, self._take), (USE, self._use),
+                           (SOLVE, self._solve), (SPEAK, self._speak)):
+            games = np.flatnonzero(playing & (kind == which))
+            if games.size:
+                run(games, arg[games])
+        return self.won
+
+    def _in_backpack(self, games):
+        return self.location[games] == BACKPACK
+
+    def _can_add(self, games, items):
+        """If each item would fit in the backpack of its game"""
+        carried = self._in_backpack(games)
+        fits = ~carried[np.arange(games.size), items] & (carried.sum(axis=1) < self.capacity)
+        if self.max_weight is not None:
+            fits &= (carried * self.weight).sum(axis=1) + self.weight[items] <= self.max_weight
+        return fits
+
+    def _go(self, games, directions):
+        target = self.exits[self.room[games], directions]
+        ok = target >= 0
+        games, target = games[ok], target[ok]
+        ok = ~self.locked[games, target]
+        self.room[games[ok]] = target[ok]
+
+    def _take(self, games, items):
+        ok = ((self.location[games, items] == FIRST_ROOM + self.room[games]) & self.can_take[items]
+              & self._can_add(games, items))
+        self.location[games[ok], items[ok]] = BACKPACK
+
+    def _use(self, games, items):
+        has = self.location[games, items] == BACKPACK
+        games, items = games[has], items[has]
+        rooms = self.room[games]
+        puzzles = self.first_puzzle[rooms]
+
+        # an item puzzle in the room is solved if everything it needs is in the backpack
+        item_puzzle = (puzzles >= 0) & self.needs_items[np.maximum(puzzles, 0)]
+        on_puzzle, puzzle = games[item_puzzle], puzzles[item_puzzle]
+        if on_puzzle.size:
+            missing = self.required[puzzle] & ~self._in_backpack(on_puzzle)
+            done = ~missing.any(axis=1)
+            self._mark_solved(on_puzzle[done], puzzle[done])
+
+        # keycards unlock every locked door here they are good enough for
+        rest = ~item_puzzle
+        keycard = rest & self.is_keycard[items]
+        on_doors, level = games[keycard], self.keycard_level[items[keycard]]
+        if on_doors.size:
+            doors = self.exits[self.room[on_doors]]
+            real = doors >= 0
+            doors = np.maximum(doors, 0)
+            required = self.door_level[doors]
+            opens = (real & (required > 0) & self.locked[on_doors[:, None], doors]
+                     & (required <= level[:, None]))
+            rows, columns = np.nonzero(opens)
+            self.locked[on_doors[rows], doors[rows, columns]] = False
+
+        # otherwise the item is shown to the NPC here
+        shown = rest & ~self.is_keycard[items]
+        npcs = self.first_npc[rooms[shown]]
+        with_npc = npcs >= 0
+        on_npc, npc, item = games[shown][with_npc], npcs[with_npc], items[shown][with_npc]
+        if on_npc.size:
+            self.locked[on_npc] &= ~self.reaction_unlocks[npc, item]
+            self.won[on_npc] |= self.reaction_wins[npc, item]
+
+    def _solve(self, games, puzzles):
+        here = self.puzzle_room[puzzles] == self.room[games]
+        games, puzzles = games[here], puzzles[here]
+        first_time = ~self.solved[games, puzzles]
+        self._mark_solved(games, puzzles)
+
+        # the reward, only on the first solve, goes in the backpack or if it
+        # wont fit is left in the room (see Game.give_item)
+        gives = self.gives[puzzles]
+        giving = first_time & (gives >= 0)
+        games, items = games[giving], gives[giving]
+        held = self.location[games, items] == BACKPACK
+        games, items = games[~held], items[~held]
+        if games.size:
+            fits = self._can_add(games, items)
+            self.location[games, items] = np.where(fits, BACKPACK, FIRST_ROOM + self.room[games])
+
+    def _mark_solved(self, games, puzzles):
+        self.solved[games, puzzles] = True
+        unlocks = self.unlocks[puzzles]
+        opening = unlocks >= 0
+        self.locked[games[opening], unlocks[opening]] = False
+
+    def _speak(self, games, _):
+        npcs = self.first_npc[self.room[games]]
+        with_npc = npcs >= 0
+        games, npcs = games[with_npc], npcs[with_npc]
+        counter = self.dialogue[games, npcs]
+        self.dialogue[games, npcs] = np.where(counter < self.dialogue_last[npcs], counter + 1, counter)
+
+    def packed_state(self, index):
+        """The state of one game, packed the same way as StateCodec.encode"""
+        return self.codec.pack(int(self.room[index]), self.won[index], self.locked[index],
+                               self.solved[index], self.location[index].tolist(),
+                               self.dialogue[index].tolist())
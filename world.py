@@ -0,0 +1,357 @@
+"""
+World files - the rooms, items, NPCs and puzzles of a game, as data.
+
+A world is written as a JSON file (see worlds/openai_hq.json). The world
+compiler checks it and turns it into a compact form made only of tuples,
+strings and numbers, with every reference already resolved to a list index.
+That compiled form is cached with marshal next to the source, in a
+__pycache__ folder (just like Python does for .py files), so later startups
+load it straight away and skip the JSON parsing and validation unless the
+source has changed. Compiled worlds can also be shipped on their own and
+loaded directly.
+
+Usage:
+    python world.py worlds/openai_hq.json [more worlds...]
+"""
+
+import json
+import marshal
+import os
+import sys
+
+from savegame import write_atomic
+
+
+DEFAULT_WORLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worlds", "openai_hq.json")
+
+COMPILED_SUFFIX = ".world"
+
+# Bump when the compiled layout changes so old caches get rebuilt.
+FORMAT_VERSION = 3
+_MAGIC = "AGI-WORLD"
+
+# World ids become attributes on Game, so they cant hide these.
+RESERVED_IDS = {"ui", "player", "game_won", "world", "rooms", "items", "npcs", "puzzles",
+                "session_id", "player_id", "journal", "navigator", "metrics", "rules", "cache",
+                "shared"}
+
+
+class WorldError(Exception):
+    """Raised when a world file is broken (bad JSON, missing fields, dangling ids...)."""
+
+
+class CompiledWorld:
+    """
+    A checked world, ready to build games from.
+    Every reference is an index into the matching table (-1 for none).
+
+    Attributes:
+        name: Display name of the world
+        start_room: Index of the room the player starts in
+        backpack_capacity: How many item slots the player's backpack has
+        backpack_max_weight: Total weight the backpack can hold (None = no limit)
+        rooms: (id, description, locked, keycard_level) per room
+        exits: ((direction, room index), ...) per room
+        items: (id, name, description, can_be_taken, can_be_used, is_keycard, keycard_level,
+                stackable, weight) per item
+        npcs: (id, name, description, dialogue) per NPC
+        puzzles: (id, name, description, success_message, password,
+                  required item indexes, unlocks room index, gives item index) per puzzle
+        placements: (item indexes, npc indexes, puzzle indexes) per room
+        rules: (item index, "npc" or "puzzle", target index, message, unlocks room index,
+                gives item index, wins, needed item indexes, needed puzzle indexes) per rule
+                (see rules.py)
+    """
+
+    def __init__(self, tables):
+        (self.name, self.start_room, self.backpack_capacity, self.backpack_max_weight, self.rooms,
+         self.exits, self.items, self.npcs, self.puzzles, self.placements, self.rules) = tables
+
+    def to_tables(self):
+        """The world as one marshal friendly tuple"""
+        return (self.name, self.start_room, self.backpack_capacity, self.backpack_max_weight, self.rooms,
+                self.exits, self.items, self.npcs, self.puzzles, self.placements, self.rules)
+
+
+def compile_world(source, origin="<world>"):
+    """
+    Checks a parsed world file and compiles it.
+
+    Args:
+        source: The world as loaded from JSON
+        origin: Where it came from, for error messages
+
+    Returns:
+        A CompiledWorld
+
+    Raises:
+        WorldError: if anything is missing, the wrong type or refers to
+            something that doesnt exist
+    """
+    def fail(message):
+        raise WorldError(f"{origin}: {message}")
+
+    def section(name):
+        value = source.get(name, {})
+        if not isinstance(value, dict):
+            fail(f"'{name}' should be an object of id -> definition")
+        for ident, definition in value.items():
+            if not ident.isidentifier() or ident in RESERVED_IDS:
+                fail(f"'{ident}' in '{name}' is not a usable id")
+            if not isinstance(definition, dict):
+                fail(f"{name}.{ident} should be an object")
+        return value
+
+    def field(where, definition, key, kind, default=None):
+        if key not in definition:
+            if default is None:
+                fail(f"{where} is missing '{key}'")
+            return default
+        value = definition[key]
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            fail(f"{where}.{key} has the wrong type")
+        return value
+
+    def lookup(where, index, ident):
+        if not isinstance(ident, str):
+            fail(f"{where} should be an id, not {ident!r}")
+        if ident not in index:
+            fail(f"{where} refers to unknown id '{ident}'")
+        return index[ident]
+
+    if not isinstance(source, dict):
+        fail("a world should be a JSON object")
+    room_defs = section("rooms")
+    item_defs = section("items")
+    npc_defs = section("npcs")
+    puzzle_defs = section("puzzles")
+    if not room_defs:
+        fail("a world needs at least one room")
+    ids_seen = {}
+    for kind, defs in (("rooms", room_defs), ("items", item_defs), ("npcs", npc_defs), ("puzzles", puzzle_defs)):
+        for ident in defs:
+            if ident in ids_seen:
+                fail(f"'{ident}' is used in both '{ids_seen[ident]}' and '{kind}'")
+            ids_seen[ident] = kind
+
+    room_index = {ident: i for i, ident in enumerate(room_defs)}
+    item_index = {ident: i for i, ident in enumerate(item_defs)}
+    npc_index = {ident: i for i, ident in enumerate(npc_defs)}
+    puzzle_index = {ident: i for i, ident in enumerate(puzzle_defs)}
+
+    items = []
+    for ident, definition in item_defs.items():
+        where = f"items.{ident}"
+        keycard_level = field(where, definition, "keycard_level", int, 0)
+        items.append((ident, field(where, definition, "name", str), field(where, definition, "description", str),
+                      field(where, definition, "can_be_taken", bool, True),
+                      field(where, definition, "can_be_used", bool, True),
+                      field(where, definition, "is_keycard", bool, keycard_level > 0), keycard_level,
+                      field(where, definition, "stackable", bool, False),
+                      field(where, definition, "weight", int, 1)))
+
+    npcs = []
+    for ident, definition in npc_defs.items():
+        where = f"npcs.{ident}"
+        dialogue = field(where, definition, "dialogue", list)
+        if not dialogue or not all(isinstance(line, str) for line in dialogue):
+            fail(f"{where}.dialogue should be a non-empty list of strings")
+        npcs.append((ident, field(where, definition, "name", str), field(where, definition, "description", str),
+                     tuple(dialogue)))
+
+    puzzles = []
+    for ident, definition in puzzle_defs.items():
+        where = f"puzzles.{ident}"
+        password = definition.get("password")
+        required = field(where, definition, "required_items", list, [])
+        if (password is None) == (not required):
+            fail(f"{where} needs exactly one of 'password' or 'required_items'")
+        if password is not None and not isinstance(password, str):
+            fail(f"{where}.password has the wrong type")
+        unlocks = definition.get("unlocks_room")
+        gives = definition.get("gives_item")
+        puzzles.append((ident, field(where, definition, "name", str), field(where, definition, "description", str),
+                        field(where, definition, "success_message", str), password,
+                        tuple(lookup(f"{where}.required_items", item_index, item) for item in required),
+                        -1 if unlocks is None else lookup(f"{where}.unlocks_room", room_index, unlocks),
+                        -1 if gives is None else lookup(f"{where}.gives_item", item_index, gives)))
+
+    rooms = []
+    exits = []
+    placements = []
+    placed = set()
+    for ident, definition in room_defs.items():
+        where = f"rooms.{ident}"
+        rooms.append((ident, field(where, definition, "description", str),
+                      field(where, definition, "locked", bool, False),
+                      field(where, definition, "keycard_level", int, 0)))
+        room_exits = field(where, definition, "exits", dict, {})
+        exits.append(tuple((direction, lookup(f"{where}.exits.{direction}", room_index, target))
+                           for direction, target in room_exits.items()))
+        contents = []
+        for key, index in (("items", item_index), ("npcs", npc_index), ("puzzles", puzzle_index)):
+            indexes = []
+            for entity in field(where, definition, key, list, []):
+                indexes.append(lookup(f"{where}.{key}", index, entity))
+                if entity in placed:
+                    fail(f"{where} places '{entity}' but it is already in another room")
+                placed.add(entity)
+            contents.append(tuple(indexes))
+        placements.append(tuple(contents))
+
+    rule_defs = source.get("rules", [])
+    if not isinstance(rule_defs, list):
+        fail("'rules' should be a list of rules")
+    rules = []
+    for number, definition in enumerate(rule_defs):
+        where = f"rules[{number}]"
+        if not isinstance(definition, dict):
+            fail(f"{where} should be an object")
+        target = field(where, definition, "on", str)
+        if target in npc_index:
+            kind, target = "npc", npc_index[target]
+        elif target in puzzle_index:
+            kind, target = "puzzle", puzzle_index[target]
+        else:
+            fail(f"{where} is used on '{target}', which is not an NPC or puzzle")
+        unlocks = definition.get("unlocks_room")
+        gives = definition.get("gives_item")
+        needs_items = field(where, definition, "needs_items", list, [])
+        needs_solved = field(where, definition, "needs_solved", list, [])
+        rules.append((lookup(where, item_index, field(where, definition, "use", str)), kind, target,
+                      field(where, definition, "message", str),
+                      -1 if unlocks is None else lookup(f"{where}.unlocks_room", room_index, unlocks),
+                      -1 if gives is None else lookup(f"{where}.gives_item", item_index, gives),
+                      field(where, definition, "wins", bool, False),
+                      tuple(lookup(f"{where}.needs_items", item_index, item) for item in needs_items),
+                      tuple(lookup(f"{where}.needs_solved", puzzle_index, puzzle) for puzzle in needs_solved)))
+
+    start_room = lookup("start_room", room_index, field("world", source, "start_room", str))
+    capacity = field("world", source, "backpack_capacity", int, 5)
+    max_weight = source.get("backpack_max_weight")
+    if max_weight is not None and (not isinstance(max_weight, int) or isinstance(max_weight, bool)):
+        fail("world.backpack_max_weight has the wrong type")
+    return CompiledWorld((field("world", source, "name", str, "Untitled"), start_room, capacity, max_weight,
+                          tuple(rooms), tuple(exits), tuple(items), tuple(npcs), tuple(puzzles),
+                          tuple(placements), tuple(rules)))
+
+
+def cache_path(source_path):
+    """Where the compiled cache for a world source file lives."""
+    folder, filename = os.path.split(os.path.abspath(source_path))
+    return os.path.join(folder, "__pycache__", os.path.splitext(filename)[0] + COMPILED_SUFFIX)
+
+
+def write_compiled(world, path, source_stat=None):
+    """
+    Saves a compiled world. The file is written to a temporary name first
+    and then renamed so a half written cache is never picked up.
+
+    Args:
+        world: The CompiledWorld
+        path: File to write
+        source_stat: os.stat of the source it was compiled from, if any
+    """
+    stamp = (source_stat.st_mtime_ns, source_stat.st_size) if source_stat else (0, 0)
+    data = marshal.dumps((_MAGIC, FORMAT_VERSION) + stamp + (world.to_tables(),))
+    write_atomic(path, data)
+
+
+def read_compiled(path, source_stat=None):
+    """
+    Loads a compiled world.
+
+    Args:
+        path: File to read
+        source_stat: If given, the cache is only used when it was compiled
+            from a source with this modification time and size
+
+    Returns:
+        A CompiledWorld, or None if the file is missing, stale or from an
+        older format
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, version, mtime_ns, size, tables = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if magic != _MAGIC or version != FORMAT_VERSION:
+        return None
+    if source_stat is not None and (mtime_ns, size) != (source_stat.st_mtime_ns, source_stat.st_size):
+        return None
+    return CompiledWorld(tables)
+
+
+def compile_file(path):
+    """
+    Parses, checks and compiles a world source file, refreshing its cache.
+
+    Returns:
+        A CompiledWorld
+    """
+    stat = os.stat(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            source = json.load(f)
+    except ValueError as error:
+        raise WorldError(f"{path}: not valid JSON ({error})") from None
+    world = compile_world(source, origin=path)
+    try:
+        write_compiled(world, cache_path(path), stat)
+    except OSError:
+        pass  # read only install, just compile every time
+    return world
+
+
+# Worlds already loaded by this process: path -> (mtime, size, CompiledWorld)
+_loaded = {}
+
+
+def load_world(path=None):
+    """
+    Gets a compiled world, doing as little work as possible: a world this
+    process already loaded is reused, then the on-disk cache is tried, and
+    only if both are stale is the source parsed and checked again.
+
+    Args:
+        path: A .json world source or a compiled COMPILED_SUFFIX file
+            (default: the OpenAI HQ world)
+
+    Returns:
+        A CompiledWorld
+    """
+    path = os.path.abspath(path or DEFAULT_WORLD)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    loaded = _loaded.get(path)
+    if loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+
+    if path.endswith(COMPILED_SUFFIX):
+        world = read_compiled(path)
+        if world is None:
+            raise WorldError(f"{path}: not a compiled world for this version of the game")
+    else:
+        world = read_compiled(cache_path(path), stat) or compile_file(path)
+    _loaded[path] = (stamp, world)
+    return world
+
+
+def main(argv=None):
+    """Compiles world files given on the command line and reports any errors."""
+    paths = sys.argv[1:] if argv is None else argv
+    ok = True
+    for path in paths or [DEFAULT_WORLD]:
+        try:
+            world = compile_file(path)
+        except (OSError, WorldError) as error:
+            print(error)
+            ok = False
+            continue
+        print(f"{path}: '{world.name}' ok ({len(world.rooms)} rooms, {len(world.items)} items, "
+              f"{len(world.npcs)} NPCs, {len(world.puzzles)} puzzles, {len(world.rules)} rules) -> {cache_path(path)}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
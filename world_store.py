@@ -0,0 +1,667 @@
+"""
+World stores - huge worlds kept in a memory mapped file, loaded a room at a time.
+
+Game() builds every Room, Item, NPC and Puzzle of its world up front, so
+starting a game on a million room world takes seconds and hundreds of
+megabytes before the player has typed anything. A store keeps the static
+content of a world (what the world file says) in a file of marshal
+records that is memory mapped, so opening one only reads a small header
+and the operating system pages records in as they are read and shares
+them between every process using the file:
+
+    magic, header position
+    per table (rooms, items, npcs, puzzles):
+        record offsets, records         one marshal record per entity
+        id offsets, ids                 each entity's id, as UTF-8
+        order                           entity indexes sorted by id
+    header                              name, start room, backpack size,
+                                        every exit direction, rule count,
+                                        the source's stamp and the tables'
+                                        positions
+
+Ids are found with a binary search over the order array, rules are kept
+in the record of the NPC or puzzle they are used on, and rooms keep their
+exits and contents as indexes.
+
+A StoreGame plays a store. It is a Game whose rooms are only made when
+something looks them up (entering them, looking at a neighbour's door,
+goto, a rule unlocking one...) through its RoomCache, which keeps the
+most recently used ones in a bounded LRU cache. Rooms still in use
+elsewhere (the player's room, say) stay findable through a weak map, so
+there is never more than one copy of a room. When a room is finally
+dropped, anything that happened to it (its lock, what is lying in it,
+its puzzles being solved, how far its NPCs have got) is written back to
+the cache's overlay, as a small tuple of indexes, and put back when it
+is made again. Unchanged rooms write nothing. Items, NPCs and puzzles
+are made along with their room, and kept unique the same way.
+
+Startup does not depend on the size of the world: the header is read,
+the start room is made and that is it. Things that look at the whole
+world (saving, StateCodec, the vector engine, WorldTemplate) still work
+on a StoreGame but go through every room to do it, and goto searches the
+store's exits, so they cost time in proportion to the world.
+
+Usage:
+    python world_store.py worlds/openai_hq.json [more worlds...]
+
+    game = StoreGame(ui, "worlds/huge.json")  # builds the store the first time
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+import weakref
+from collections import OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+
+from game import Game
+from item import Item
+from npc import NPC
+from player import Player
+from puzzle import Puzzle
+from room import Room
+from rules import Rule, RuleBook
+from savegame import write_atomic
+from text_ui import TextUI
+from world import DEFAULT_WORLD, WorldError, cache_path, load_world
+
+
+STORE_SUFFIX = ".store"
+
+# Bump when the file layout changes so old stores get rebuilt.
+STORE_VERSION = 1
+_MAGIC = b"AGISTORE"
+_PREAMBLE = struct.Struct("<8sQ")  # magic, header position
+_OFFSET = struct.Struct("<Q")
+_ORDER = struct.Struct("<I")
+
+_TABLES = ("rooms", "items", "npcs", "puzzles")
+
+# Rooms a StoreGame keeps made when nothing else is using them.
+DEFAULT_CACHE_SIZE = 1024
+
+
+def store_path(source_path):
+    """Where the store built from a world source file lives (next to its compiled cache)."""
+    return os.path.splitext(cache_path(source_path))[0] + STORE_SUFFIX
+
+
+def write_store(world, path, source_stat=None):
+    """
+    Writes a compiled world as a store. Like compiled worlds, it is written
+    to a temporary name first and then renamed.
+
+    Args:
+        world: The CompiledWorld
+        path: File to write
+        source_stat: os.stat of the source it was built from, if any
+    """
+    rules = {"npc": {}, "puzzle": {}}  # kind -> target index -> rules on it
+    for item, kind, target, *rule in world.rules:
+        rules[kind].setdefault(target, []).append((item, *rule))
+    tables = {
+        "rooms": [room + (exits,) + placement
+                  for room, exits, placement in zip(world.rooms, world.exits, world.placements)],
+        "items": world.items,
+        "npcs": [npc + (tuple(rules["npc"].get(index, ())),) for index, npc in enumerate(world.npcs)],
+        "puzzles": [puzzle + (tuple(rules["puzzle"].get(index, ())),)
+                    for index, puzzle in enumerate(world.puzzles)],
+    }
+
+    data = bytearray(_PREAMBLE.size)
+    layout = {}
+    for name in _TABLES:
+        rows = tables[name]
+        ids = [row[0].encode("utf-8") for row in rows]
+        records = data_position = len(data)
+        data += bytes(_OFFSET.size * (len(rows) + 1))
+        for index, blob in enumerate([marshal.dumps(row) for row in rows] + [None]):
+            _OFFSET.pack_into(data, data_position + _OFFSET.size * index, len(data))
+            if blob is not None:
+                data += blob
+        id_offsets = len(data)
+        data += bytes(_OFFSET.size * (len(ids) + 1))
+        for index, blob in enumerate(ids + [None]):
+            _OFFSET.pack_into(data, id_offsets + _OFFSET.size * index, len(data))
+            if blob is not None:
+                data += blob
+        order = len(data)
+        for index in sorted(range(len(ids)), key=ids.__getitem__):
+            data += _ORDER.pack(index)
+        layout[name] = (len(rows), records, id_offsets, order)
+
+    directions = sorted({direction for exits in world.exits for direction, _ in exits})
+    stamp = (source_stat.st_mtime_ns, source_stat.st_size) if source_stat else (0, 0)
+    header = (STORE_VERSION, stamp, world.name, world.start_room, world.backpack_capacity,
+              world.backpack_max_weight, tuple(directions), len(world.rules), layout)
+    _PREAMBLE.pack_into(data, 0, _MAGIC, len(data))
+    data += marshal.dumps(header)
+
+    write_atomic(path, data)
+
+
+class StoreTable:
+    """
+    One table of a store (its rooms, items...), read straight from the
+    mapped file. Indexes are the same as in the CompiledWorld.
+    """
+
+    def __init__(self, data, count, records, ids, order):
+        self._data = data
+        self._count = count
+        self._records = records
+        self._ids = ids
+        self._order = order
+
+    def __len__(self):
+        return self._count
+
+    def _span(self, start, index):
+        """Where entry index starts and ends, from the offsets array at start"""
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        position = start + _OFFSET.size * index
+        return _OFFSET.unpack_from(self._data, position)[0], _OFFSET.unpack_from(self._data, position + _OFFSET.size)[0]
+
+    def __getitem__(self, index):
+        """The record of entity index, the same row as the CompiledWorld's (rooms also have their exits and contents)"""
+        begin, end = self._span(self._records, index)
+        return marshal.loads(self._data[begin:end])
+
+    def ident(self, index):
+        """The id of entity index"""
+        begin, end = self._span(self._ids, index)
+        return self._data[begin:end].decode("utf-8")
+
+    def find(self, ident):
+        """The index of the entity with an id, or None"""
+        key = ident.encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            index = _ORDER.unpack_from(self._data, self._order + _ORDER.size * middle)[0]
+            begin, end = self._span(self._ids, index)
+            found = self._data[begin:end]
+            if found == key:
+                return index
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def idents(self):
+        """Every id, in index order"""
+        for index in range(self._count):
+            yield self.ident(index)
+
+
+class WorldStore:
+    """
+    A store file, memory mapped.
+
+    Attributes:
+        path: The store file
+        source_stamp: (mtime_ns, size) of the world source it was built from
+        name: Display name of the world
+        start_room: Index of the room the player starts in
+        backpack_capacity: How many item slots the player's backpack has
+        backpack_max_weight: Total weight the backpack can hold (None = no limit)
+        directions: Every direction an exit goes in
+        rule_count: How many rules the world has
+        rooms, items, npcs, puzzles: StoreTables
+    """
+
+    def __init__(self, path):
+        """
+        Raises:
+            WorldError: if the file isnt a store for this version of the game
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise WorldError(f"{path}: not a world store") from None
+        try:
+            magic, header_position = _PREAMBLE.unpack_from(self._data, 0)
+            if magic != _MAGIC:
+                raise ValueError
+            (version, self.source_stamp, self.name, self.start_room, self.backpack_capacity,
+             self.backpack_max_weight, self.directions, self.rule_count,
+             layout) = marshal.loads(self._data[header_position:])
+        except (struct.error, EOFError, ValueError, TypeError):
+            self.close()
+            raise WorldError(f"{path}: not a world store") from None
+        if version != STORE_VERSION:
+            self.close()
+            raise WorldError(f"{path}: a world store from another version of the game")
+        for name in _TABLES:
+            setattr(self, name, StoreTable(self._data, *layout[name]))
+
+    def close(self):
+        """Unmaps the file. Games using the store cant be played after this"""
+        self._data.close()
+
+
+# Stores already opened by this process: path -> (stamp of the world source, WorldStore)
+_stores = {}
+
+
+def open_store(path=None):
+    """
+    Gets a store, building it first if needed. A store this process already
+    opened is reused.
+
+    Args:
+        path: A STORE_SUFFIX file, or a world source (.json or compiled) to
+            use the store built from, which is (re)built when missing or
+            older than the source (default: the OpenAI HQ world)
+
+    Returns:
+        A WorldStore
+    """
+    path = os.path.abspath(path or DEFAULT_WORLD)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    opened = _stores.get(path)
+    if opened is not None and opened[0] == stamp:
+        return opened[1]
+
+    if path.endswith(STORE_SUFFIX):
+        store = WorldStore(path)
+    else:
+        built = store_path(path)
+        store = None
+        if os.path.exists(built):
+            try:
+                store = WorldStore(built)
+            except WorldError:
+                pass
+            if store is not None and store.source_stamp != stamp:
+                store.close()
+                store = None
+        if store is None:
+            write_store(load_world(path), built, stat)
+            store = WorldStore(built)
+    _stores[path] = (stamp, store)
+    return store
+
+
+class LazyExits(MutableMapping):
+    """
+    A StoredRoom's exits: direction -> room, where the rooms are indexes
+    until looked up, so making a room doesnt make its neighbours.
+    """
+
+    def __init__(self, cache, exits):
+        self._cache = cache
+        self._exits = dict(exits)  # direction -> room index, or a Room set later with set_exit
+
+    def __getitem__(self, direction):
+        target = self._exits[direction]
+        return self._cache.room(target) if type(target) is int else target
+
+    def get(self, direction, default=None):
+        target = self._exits.get(direction)
+        if target is None:
+            return default
+        return self._cache.room(target) if type(target) is int else target
+
+    def __setitem__(self, direction, room):
+        self._exits[direction] = room
+
+    def __delitem__(self, direction):
+        del self._exits[direction]
+
+    def __contains__(self, direction):
+        return direction in self._exits
+
+    def __iter__(self):
+        return iter(self._exits)
+
+    def __len__(self):
+        return len(self._exits)
+
+
+class StoredRoom(Room):
+    """A Room made from a store record, that writes back what happened to it when it is dropped."""
+
+    __slots__ = ("_cache", "store_index", "_static")
+
+    def __init__(self, cache, index, description, islocked=False, required_keycard_level=0, entity_id=None):
+        self._cache = cache
+        self.store_index = index
+        super().__init__(description, islocked, required_keycard_level, entity_id)
+
+    def __del__(self):
+        self._cache.write_back(self)
+
+
+class StoredPuzzle(Puzzle):
+    """A Puzzle that looks the room it unlocks up when it is solved, rather than holding on to it."""
+
+    __slots__ = ("_cache", "_unlocks_room")
+
+    def __init__(self, cache, *args, **kwargs):
+        self._cache = cache
+        super().__init__(*args, **kwargs)
+
+    @property
+    def unlocks_room(self):
+        room = self._unlocks_room
+        return self._cache.room(room) if type(room) is int else room
+
+    @unlocks_room.setter
+    def unlocks_room(self, room):
+        self._unlocks_room = room  # a room index, a Room or None
+
+
+class RoomCache:
+    """
+    Makes the rooms of one game from a store as they are needed, and keeps
+    track of what happened to them.
+
+    Attributes:
+        store: The WorldStore
+        size: Rooms kept made when nothing else is using them
+        overlay: Room index -> what happened to it (see write_back), for
+            rooms that were changed and dropped
+        loads: How many times a room has been made
+    """
+
+    def __init__(self, store, size=DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self.overlay = {}
+        self.loads = 0
+        self._recent = OrderedDict()  # index -> room, least recently used first
+        self._live = weakref.WeakValueDictionary()  # index -> every room still in memory
+        self._entities = {name: weakref.WeakValueDictionary() for name in ("items", "npcs", "puzzles")}
+        self._indexes = weakref.WeakKeyDictionary()  # item, NPC or puzzle -> its index
+
+    def room(self, index):
+        """The room with an index, made if needed"""
+        room = self._recent.get(index)
+        if room is not None:
+            self._recent.move_to_end(index)
+            return room
+        room = self._live.get(index)
+        if room is None:
+            room = self._load(index)
+        self._recent[index] = room
+        if len(self._recent) > self.size:
+            self._recent.popitem(last=False)
+        return room
+
+    def is_locked(self, index):
+        """If the room with an index is locked, without making it"""
+        room = self._live.get(index)
+        if room is not None:
+            return room.islocked
+        state = self.overlay.get(index)
+        if state is not None:
+            return state[0]
+        _, _, locked, keycard_level = self.store.rooms[index][:4]
+        return locked or keycard_level > 0
+
+    def _load(self, index):
+        """Makes a room and what is in it, as the store says or as it was written back"""
+        ident, description, locked, keycard_level, exits, items, npcs, puzzles = self.store.rooms[index]
+        room = StoredRoom(self, index, description, islocked=locked, required_keycard_level=keycard_level,
+                          entity_id=ident)
+        room.exits = LazyExits(self, exits)
+        room._static = (room.islocked, items, npcs, puzzles)  # what write_back compares against
+        state = self.overlay.get(index)
+        if state is not None:
+            locked, items, npcs, puzzles, solved, counters = state
+            room._islocked = locked
+        for item in items:
+            room.items.add(self.item(item))
+        for npc in npcs:
+            room.npcs.add(self.npc(npc))
+        for puzzle in puzzles:
+            room.puzzles.add(self.puzzle(puzzle))
+        if state is not None:
+            for puzzle, is_solved in zip(room.puzzles, solved):
+                puzzle.is_solved = is_solved
+            for npc, counter in zip(room.npcs, counters):
+                npc.dialogue_counter = counter
+        self._live[index] = room
+        self.loads += 1
+        return room
+
+    def write_back(self, room):
+        """
+        Remembers what happened to a room that is being dropped, so it is
+        the same when it is made again. Called by StoredRoom.
+        """
+        indexes = self._indexes
+        try:
+            state = (room.islocked,
+                     tuple(indexes[item] for item in room.items),
+                     tuple(indexes[npc] for npc in room.npcs),
+                     tuple(indexes[puzzle] for puzzle in room.puzzles),
+                     tuple(puzzle.is_solved for puzzle in room.puzzles),
+                     tuple(npc.dialogue_counter for npc in room.npcs))
+        except KeyError:
+            return  # the whole game is being thrown away, its entities first
+        locked, items, npcs, puzzles = room._static
+        if state == (locked, items, npcs, puzzles, (False,) * len(puzzles), (0,) * len(npcs)):
+            self.overlay.pop(room.store_index, None)
+        else:
+            self.overlay[room.store_index] = state
+
+    def _entity(self, table, index, make):
+        """An item, NPC or puzzle, made with make(record) if it isnt in memory"""
+        entities = self._entities[table]
+        entity = entities.get(index)
+        if entity is None:
+            entity = entities[index] = make(getattr(self.store, table)[index])
+            self._indexes[entity] = index
+        return entity
+
+    def item(self, index):
+        """The item with an index"""
+        return self._entity("items", index, lambda row: Item(
+            row[1], row[2], row[3], can_be_used=row[4], is_keycard=row[5], keycard_level=row[6],
+            stackable=row[7], weight=row[8], entity_id=row[0]))
+
+    def npc(self, index):
+        """The NPC with an index"""
+        return self._entity("npcs", index, lambda row: NPC(row[1], row[2], list(row[3]), entity_id=row[0]))
+
+    def puzzle(self, index):
+        """The puzzle with an index"""
+        def make(row):
+            ident, name, description, success_message, password, required, unlocks, gives, _ = row
+            return StoredPuzzle(self, name, description, success_message,
+                                unlocks_room=unlocks if unlocks >= 0 else None,
+                                password=password,
+                                required_items=[self.item(item) for item in required],
+                                gives_items=self.item(gives) if gives >= 0 else None,
+                                entity_id=ident)
+        return self._entity("puzzles", index, make)
+
+
+class EntityMap(Mapping):
+    """id -> entity for one table of a StoreGame (its rooms, items...), making them as they are looked up."""
+
+    def __init__(self, table, get):
+        self._table = table
+        self._get = get
+
+    def __getitem__(self, ident):
+        index = self._table.find(ident)
+        if index is None:
+            raise KeyError(ident)
+        return self._get(index)
+
+    def __contains__(self, ident):
+        return isinstance(ident, str) and self._table.find(ident) is not None
+
+    def __iter__(self):
+        return self._table.idents()
+
+    def __len__(self):
+        return len(self._table)
+
+
+class StoredRuleBook(RuleBook):
+    """
+    The rules of a store's world. Rules are read from the record of the
+    NPC or puzzle they are used on when first needed, then kept.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._rules = {}  # (target id, item id) -> rules, for the keys looked up so far
+
+    def __len__(self):
+        return self._store.rule_count
+
+    def find(self, game, target, item):
+        key = (target.entity_id, item.entity_id)
+        if key not in self._rules:
+            self._rules[key] = self._read(target, item)
+        return super().find(game, target, item)
+
+    def _read(self, target, item):
+        """The rules for using item on target, in world file order"""
+        store = self._store
+        table = store.npcs if isinstance(target, NPC) else store.puzzles
+        target_index = table.find(target.entity_id)
+        item_index = store.items.find(item.entity_id)
+        if target_index is None or item_index is None:
+            return ()
+        return tuple(Rule(message,
+                          unlocks_room=store.rooms.ident(unlocks) if unlocks >= 0 else None,
+                          gives_item=store.items.ident(gives) if gives >= 0 else None,
+                          wins=wins,
+                          needs_names=tuple(store.items[index][1].lower() for index in needs_items),
+                          needs_solved=tuple(store.puzzles.ident(index) for index in needs_solved))
+                     for (used, message, unlocks, gives, wins, needs_items, needs_solved) in table[target_index][-1]
+                     if used == item_index)
+
+
+class StoreNavigator:
+    """
+    Routes for goto in a StoreGame. Searches go over the store's exits
+    and lock states without making the rooms they pass through, so nothing
+    is cached and every search costs time in proportion to the rooms it
+    reaches.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def find_room(self, name):
+        """Finds a room by its id, ignoring case and with spaces for underscores. None if there isnt one"""
+        rooms = self._cache.store.rooms
+        ident = name.strip().replace(" ", "_")
+        index = rooms.find(ident)
+        if index is None:
+            index = rooms.find(ident.lower())
+        return None if index is None else self._cache.room(index)
+
+    def route(self, start, goal):
+        """The shortest list of directions from one room to another, or None if there isnt one"""
+        if start is goal:
+            return []
+        rooms = self._cache.store.rooms
+        start_index = start.store_index
+        goal_index = goal.store_index
+        tree = {start_index: None}
+        queue = deque([start_index])
+        while queue and goal_index not in tree:
+            index = queue.popleft()
+            for direction, target in rooms[index][4]:
+                if target not in tree and not self._cache.is_locked(target):
+                    tree[target] = (index, direction)
+                    queue.append(target)
+        if goal_index not in tree:
+            return None
+        directions = []
+        index = goal_index
+        while index != start_index:
+            index, direction = tree[index]
+            directions.append(direction)
+        directions.reverse()
+        return directions
+
+    def distance(self, start, goal):
+        """How many moves the shortest route takes, or None if there isnt one"""
+        directions = self.route(start, goal)
+        return None if directions is None else len(directions)
+
+    def lock_changed(self, room):
+        """Nothing is cached, so nothing to do"""
+
+
+class StoreGame(Game):
+    """
+    A Game played from a WorldStore, making rooms as they are needed.
+    World ids still work as attributes (game.lobby) and game.rooms,
+    game.items, game.npcs and game.puzzles still map ids to entities.
+    """
+
+    def __init__(self, ui=None, world_path=None, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Initialises the game.
+        :param ui: UI to talk to the player through (default: console TextUI)
+        :param world_path: Store or world file to play (default: the OpenAI HQ world), see open_store
+        :param cache_size: Rooms to keep made when nothing else is using them
+        """
+        self.game_won = False
+        self.session_id = None
+        self.journal = None
+        self.navigator = None
+        self.metrics = None
+        self.build_world(open_store(world_path), cache_size)
+        self.ui = ui if ui is not None else TextUI()
+
+    def build_world(self, world, cache_size=DEFAULT_CACHE_SIZE):
+        """
+            Sets the game up to make rooms from a store and puts the player
+            in the start room (the only room made so far).
+        :param world: A WorldStore from open_store
+        :param cache_size: Rooms to keep made when nothing else is using them
+        :return: None
+        """
+        self.world = world
+        self.cache = RoomCache(world, cache_size)
+        self.rules = StoredRuleBook.for_world(world)
+        self.rooms = EntityMap(world.rooms, self.cache.room)
+        self.items = EntityMap(world.items, self.cache.item)
+        self.npcs = EntityMap(world.npcs, self.cache.npc)
+        self.puzzles = EntityMap(world.puzzles, self.cache.puzzle)
+        self.player = Player("Player", self.cache.room(world.start_room), world.backpack_capacity,
+                             world.backpack_max_weight)
+
+    def get_navigator(self):
+        """The game's StoreNavigator, made on first use"""
+        if self.navigator is None:
+            self.navigator = StoreNavigator(self.cache)
+        return self.navigator
+
+
+def main(argv=None):
+    """Builds the stores of world files given on the command line and reports any errors."""
+    paths = sys.argv[1:] if argv is None else argv
+    ok = True
+    for path in paths or [DEFAULT_WORLD]:
+        try:
+            store = open_store(path)
+        except (OSError, WorldError) as error:
+            print(error)
+            ok = False
+            continue
+        print(f"{path}: '{store.name}' ok ({len(store.rooms)} rooms, {len(store.items)} items, "
+              f"{len(store.npcs)} NPCs, {len(store.puzzles)} puzzles, {store.rule_count} rules) -> {store.path}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
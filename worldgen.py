@@ -0,0 +1,333 @@
+"""
+World generator - big, random, always winnable worlds for scale testing.
+
+Builds a world file (the same JSON as worlds/openai_hq.json) from a seed,
+so the same seed and size always give the same world:
+
+    world, solution = generate_world(rooms=10000, seed=1)
+    write_world("big.json", world)
+    game = Game(world_path="big.json")
+
+The rooms are split into zones of about zone_size rooms. Each zone is a
+random tree of rooms joined by exits both ways. Zone n + 1 hangs off a
+door room in zone n, through a locked gate room (the first room of zone
+n + 1), and the gate is opened with one of the usual building blocks,
+everything it needs lying somewhere in zone n:
+
+    keycard     a keycard one tier up, used in the door room
+    password    a puzzle with its password written in its description
+    items       a puzzle that needs one or two items
+    npc         a rule: give an NPC an item and they open the gate
+
+The last zone has an NPC who wins the game when given the crown, which
+lies somewhere in that zone. Puzzles, NPCs and the door room each get a
+room of their own so the use command never picks the wrong target, and
+spare items and chatty NPCs are scattered around everywhere else.
+
+Because every zone only needs what is in the zone before it, the world is
+winnable by construction, and generate_world also returns a winning
+transcript (one go per move, so no goto searches).
+
+Usage:
+    python worldgen.py --rooms 10000 --seed 1 --output worlds/big.json --solution big.txt
+See benchmark.py --scaling for how the engine copes with world size.
+"""
+
+import argparse
+import json
+import random
+import sys
+
+
+OPPOSITE = {"north": "south", "south": "north", "east": "west", "west": "east", "up": "down", "down": "up"}
+
+GATE_KINDS = ("keycard", "password", "items", "npc")
+
+_ADJECTIVES = ("dusty", "humming", "dim", "cold", "cluttered", "quiet", "flickering", "narrow", "vast", "damp")
+_PLACES = ("server room", "office", "corridor", "storeroom", "meeting room", "lab", "kitchen", "archive",
+           "stairwell", "workshop")
+_SYLLABLES = ("ka", "lo", "mi", "ne", "tu", "ra", "zo", "fi", "de", "shu", "gra", "vel")
+
+
+class WorldGenerator:
+    """
+    Builds one generated world.
+
+    Attributes:
+        rooms: How many rooms the world has (at least 8)
+        zone_size: Rooms per zone (at least 4, the last zone takes what is left)
+        spare_items: Chance that a room gets an item nobody needs
+        chatty_npcs: Chance that a room gets an NPC who only talks
+    """
+
+    def __init__(self, rooms=1000, seed=0, zone_size=20, spare_items=0.2, chatty_npcs=0.05):
+        if rooms < 8 or zone_size < 4:
+            raise ValueError("a generated world needs at least 8 rooms and zones of at least 4")
+        self.rooms = rooms
+        self.seed = seed
+        self.zone_size = zone_size
+        self.spare_items = spare_items
+        self.chatty_npcs = chatty_npcs
+
+    def generate(self):
+        """
+        Returns:
+            (world, solution): the world as a JSON ready dict and a winning
+            list of commands
+        """
+        self.random = random.Random(self.seed)
+        self._rooms = {}
+        self._items = {}
+        self._npcs = {}
+        self._puzzles = {}
+        self._rules = []
+        self._solution = []
+        self._tier = 0
+
+        sizes = [self.zone_size] * (self.rooms // self.zone_size)
+        left = self.rooms - sum(sizes)
+        if left >= 4 or not sizes:
+            sizes.append(left)
+        else:
+            sizes[-1] += left
+        gate = None
+        for number, size in enumerate(sizes):
+            zone = self._build_zone(number, size, gate)
+            if number + 1 < len(sizes):
+                gate = self._add_gate(number, zone)
+            else:
+                self._add_ending(zone)
+        self._scatter()
+        world = {
+            "name": f"Generated world ({self.rooms} rooms, seed {self.seed})",
+            "start_room": "z0_r0",
+            "backpack_capacity": len(self._items) + 1,
+            "rooms": self._rooms,
+            "items": self._items,
+            "npcs": self._npcs,
+            "puzzles": self._puzzles,
+            "rules": self._rules,
+        }
+        return world, self._solution
+
+    def _build_zone(self, number, size, gate):
+        """
+        Makes a zone's rooms as a random tree. The first room is the zone's
+        gate (locked, opened from the zone before).
+
+        Returns:
+            The zone: dict with its room ids, each room's parent and the
+            direction from the parent, and where the player is
+        """
+        ids = [f"z{number}_r{index}" for index in range(size)]
+        parent = [None] * size
+        direction = [None] * size
+        free = {0: list(OPPOSITE)}  # room index -> directions it has no exit in yet
+        for index, ident in enumerate(ids):
+            self._rooms[ident] = {
+                "description": f"in a {self.random.choice(_ADJECTIVES)} {self.random.choice(_PLACES)}.",
+                "exits": {},
+            }
+            if index == 0:
+                if gate is not None:
+                    door, way, keycard_level = gate
+                    self._rooms[ident].update(locked=True, keycard_level=keycard_level)
+                    self._rooms[ident]["exits"][OPPOSITE[way]] = door
+                    free[0].remove(OPPOSITE[way])
+                continue
+            above = self.random.choice(list(free))
+            way = self.random.choice(free[above])
+            self._link(above, index, way, ids, free)
+            parent[index], direction[index] = above, way
+            free[index] = [d for d in OPPOSITE if d != OPPOSITE[way]]
+        return {"ids": ids, "parent": parent, "direction": direction, "free": free, "at": 0, "used": {0}}
+
+    def _link(self, above, index, way, ids, free):
+        """Joins room above to room index (way from above) and back"""
+        self._rooms[ids[above]]["exits"][way] = ids[index]
+        self._rooms[ids[index]]["exits"][OPPOSITE[way]] = ids[above]
+        free[above].remove(way)
+        if not free[above]:
+            del free[above]
+
+    def _pick_room(self, zone):
+        """A room of the zone with nothing special in it yet (marking it used)"""
+        spare = [index for index in range(len(zone["ids"])) if index not in zone["used"]]
+        index = self.random.choice(spare)
+        zone["used"].add(index)
+        return index
+
+    def _place_item(self, zone, ident, definition):
+        """Puts a new item in a random room of the zone, and takes it in the solution"""
+        self._items[ident] = definition
+        index = self.random.randrange(len(zone["ids"]))
+        self._rooms[zone["ids"][index]].setdefault("items", []).append(ident)
+        self._walk(zone, index)
+        self._solution.append(f"take {definition['name']}")
+
+    def _walk(self, zone, goal):
+        """Adds the moves from where the player is to room goal to the solution"""
+        parent, direction = zone["parent"], zone["direction"]
+        up, down = [], []
+        start, end = zone["at"], goal
+        depth = {}
+        node, steps = start, 0
+        while node is not None:
+            depth[node] = steps
+            node, steps = parent[node], steps + 1
+        while end not in depth:
+            down.append(direction[end])
+            end = parent[end]
+        node = start
+        while node != end:
+            up.append(OPPOSITE[direction[node]])
+            node = parent[node]
+        self._solution += [f"go {way}" for way in up + down[::-1]]
+        zone["at"] = goal
+
+    def _add_gate(self, number, zone):
+        """
+        Locks the next zone's gate behind one of GATE_KINDS, with everything
+        needed to open it in this zone.
+
+        Returns:
+            (door room id, direction from the door room to the gate, keycard level of the gate)
+        """
+        door = self.random.choice([index for index in zone["free"] if index not in zone["used"]]
+                                  or list(zone["free"]))
+        zone["used"].add(door)
+        way = self.random.choice(zone["free"][door])
+        zone["free"][door].remove(way)
+        gate = f"z{number + 1}_r0"
+        self._rooms[zone["ids"][door]]["exits"][way] = gate
+        kind = self.random.choice(GATE_KINDS)
+        keycard_level = 0
+
+        if kind == "keycard":
+            self._tier += 1
+            name = f"keycard-{self._tier}"
+            self._place_item(zone, f"keycard_{self._tier}", {
+                "name": name, "description": f"A level {self._tier} keycard", "keycard_level": self._tier})
+            keycard_level = self._tier
+            self._walk(zone, door)
+            self._solution.append(f"use {name}")
+        elif kind == "password":
+            password = "".join(self.random.choice(_SYLLABLES) for _ in range(3))
+            room = self._pick_room(zone)
+            self._add_puzzle(zone, room, f"terminal_{number}", {
+                "name": f"terminal-{number}",
+                "description": f"A locked terminal. A sticky note on it says '{password}'",
+                "password": password,
+                "success_message": "The terminal beeps and a door unlocks somewhere.",
+                "unlocks_room": gate,
+            })
+            self._walk(zone, room)
+            self._solution.append(f"solve {password}")
+        elif kind == "items":
+            room = self._pick_room(zone)
+            parts = [f"part_{number}_{count}" for count in range(self.random.randint(1, 2))]
+            for part in parts:
+                self._place_item(zone, part, {"name": part.replace("_", "-"), "description": "A spare part"})
+            self._add_puzzle(zone, room, f"machine_{number}", {
+                "name": f"machine-{number}",
+                "description": "A broken door machine with parts missing",
+                "required_items": parts,
+                "success_message": "The machine whirs and a door unlocks somewhere.",
+                "unlocks_room": gate,
+            })
+            self._walk(zone, room)
+            self._solution.append(f"use {parts[0].replace('_', '-')}")
+        else:
+            room = self._pick_room(zone)
+            npc, token = f"guard_{number}", f"pass_{number}"
+            self._add_npc(zone, room, npc, {
+                "name": f"guard-{number}", "description": "A guard by a locked door",
+                "dialogue": ["Nobody gets through without a pass."]})
+            self._place_item(zone, token, {"name": f"pass-{number}", "description": "A visitor's pass"})
+            self._rules.append({"use": token, "on": npc, "message": "The guard nods and unlocks a door.",
+                                "unlocks_room": gate})
+            self._walk(zone, room)
+            self._solution.append(f"use pass-{number} on guard-{number}")
+
+        self._walk(zone, door)
+        self._solution.append(f"go {way}")
+        return zone["ids"][door], way, keycard_level
+
+    def _add_puzzle(self, zone, room, ident, definition):
+        self._puzzles[ident] = definition
+        self._rooms[zone["ids"][room]].setdefault("puzzles", []).append(ident)
+
+    def _add_npc(self, zone, room, ident, definition):
+        self._npcs[ident] = definition
+        self._rooms[zone["ids"][room]].setdefault("npcs", []).append(ident)
+
+    def _add_ending(self, zone):
+        """The last zone: give the crown to the oracle to win"""
+        room = self._pick_room(zone)
+        self._add_npc(zone, room, "oracle", {
+            "name": "oracle", "description": "An ancient terminal, waiting for its crown",
+            "dialogue": ["Bring me the crown."]})
+        self._place_item(zone, "crown", {"name": "crown", "description": "A crown made of circuit boards"})
+        self._rules.append({"use": "crown", "on": "oracle", "message": "The oracle takes the crown. You win!",
+                            "wins": True})
+        self._walk(zone, room)
+        self._solution.append("use crown on oracle")
+
+    def _scatter(self):
+        """Spare items and chatty NPCs in rooms without puzzles or NPCs"""
+        for ident, room in self._rooms.items():
+            if "puzzles" in room or "npcs" in room:
+                continue
+            if self.random.random() < self.spare_items:
+                item = f"trinket_{len(self._items)}"
+                self._items[item] = {"name": item.replace("_", "-"), "description": "Something nobody needs"}
+                room.setdefault("items", []).append(item)
+            if self.random.random() < self.chatty_npcs:
+                npc = f"intern_{len(self._npcs)}"
+                self._npcs[npc] = {"name": npc.replace("_", "-"), "description": "An intern, still working",
+                                   "dialogue": ["Have you seen my manager?", "I should go home."]}
+                room["npcs"] = [npc]
+
+
+def generate_world(rooms=1000, seed=0, zone_size=20):
+    """
+    Generates a winnable world (see WorldGenerator).
+
+    Returns:
+        (world, solution): the world as a JSON ready dict and a winning list of commands
+    """
+    return WorldGenerator(rooms, seed, zone_size).generate()
+
+
+def write_world(path, world):
+    """Writes a generated world to a world file"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(world, f, separators=(",", ":"))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Generate a big winnable world.")
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zone-size", type=int, default=20, help="rooms between locked gates")
+    parser.add_argument("--output", default="generated.json", help="world file to write")
+    parser.add_argument("--solution", default=None, help="file to write a winning script to")
+    args = parser.parse_args(argv)
+
+    try:
+        world, solution = generate_world(args.rooms, args.seed, args.zone_size)
+    except ValueError as error:
+        print(error)
+        return 1
+    write_world(args.output, world)
+    if args.solution:
+        with open(args.solution, "w") as f:
+            f.write("\n".join(solution) + "\n")
+    print(f"{args.output}: {len(world['rooms'])} rooms, {len(world['items'])} items, {len(world['npcs'])} NPCs, "
+          f"{len(world['puzzles'])} puzzles, {len(world['rules'])} rules, won in {len(solution)} commands")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())